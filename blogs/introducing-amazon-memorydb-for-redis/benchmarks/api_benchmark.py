@@ -0,0 +1,284 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Load benchmark of the customers REST API with a mix of operations.
+
+The service (server.py, or async_server.py with --target async) is started
+against the cluster configured in the environment, normally a local Redis
+cluster with DB_SSL=false standing in for MemoryDB. After seeding --customers
+customers, --connections keep-alive connections run the operations of --mix for
+--duration seconds:
+
+    read   GET /customers/<id> of a random customer
+    write  PUT /customers/<id> of a random customer
+    list   GET /customers?limit=<--page-size>
+
+The report gives the throughput, the latency percentiles of every operation,
+and the Redis commands issued per request, from the INFO commandstats of every
+primary before and after the run. Commands run by scripts are counted as well.
+
+--save writes the report as a baseline, and --baseline compares the run with a
+saved one. The comparison fails when the throughput drops, or a p99 latency or
+the commands per request grow, by more than --tolerance.
+
+Usage:
+    source ../src/.env.sh && python api_benchmark.py --mix read=80,write=15,list=5 --save baselines/flask.json
+    source ../src/.env.sh && python api_benchmark.py --baseline baselines/flask.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from load_test import SRC_DIR, read_response, target_command, wait_for_port
+
+OPERATIONS = ("read", "write", "list")
+
+
+def parse_mix(spec):
+    """
+    Parses "read=80,write=15,list=5" into operation weights.
+    """
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation {name}, expected one of {', '.join(OPERATIONS)}")
+        mix[name] = float(weight)
+    return mix
+
+
+class RedisConnection:
+    """
+    Minimal RESP client, enough to read INFO commandstats without a Redis library.
+    """
+
+    def __init__(self, host, port, username=None, password=None):
+        self.sock = socket.create_connection((host, int(port)), timeout=5)
+        self.file = self.sock.makefile("rb")
+        if password:
+            self.command("AUTH", *([username] if username else []), password)
+
+    def command(self, *args):
+        payload = f"*{len(args)}\r\n" + "".join(f"${len(str(arg).encode())}\r\n{arg}\r\n" for arg in args)
+        self.sock.sendall(payload.encode())
+        return self._read()
+
+    def _read(self):
+        line = self.file.readline().rstrip(b"\r\n")
+        kind, rest = line[:1], line[1:]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RuntimeError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            return None if length < 0 else self.file.read(length + 2)[:-2].decode()
+        if kind == b"*":
+            return [self._read() for _ in range(int(rest))]
+        raise RuntimeError(f"Unexpected reply {line!r}")
+
+    def close(self):
+        self.sock.close()
+
+
+def command_counts():
+    """
+    Returns the number of calls of every command, summed over the primaries of the cluster.
+    """
+    username = os.environ.get("DB_USERNAME") or None
+    password = os.environ.get("DB_PASSWORD") or None
+    seed = RedisConnection(os.environ["DB_HOST"], os.environ["DB_PORT"], username, password)
+    primaries = [line.split()[1].split("@")[0] for line in seed.command("CLUSTER", "NODES").splitlines()
+                 if "master" in line.split()[2]]
+    seed.close()
+    counts = {}
+    for address in primaries:
+        host, _, port = address.rpartition(":")
+        connection = RedisConnection(host or os.environ["DB_HOST"], port, username, password)
+        for line in connection.command("INFO", "commandstats").splitlines():
+            if line.startswith("cmdstat_"):
+                name, stats = line[len("cmdstat_"):].split(":", 1)
+                calls = int(dict(item.split("=") for item in stats.split(","))["calls"])
+                counts[name] = counts.get(name, 0) + calls
+        connection.close()
+    return counts
+
+
+def operation_request(operation, ids, page_size):
+    customer_id = random.choice(ids)
+    if operation == "read":
+        return f"GET /customers/{customer_id} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n".encode()
+    if operation == "write":
+        body = json.dumps({"age": random.randrange(100)})
+        return (f"PUT /customers/{customer_id} HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n{body}").encode()
+    return f"GET /customers?limit={page_size} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n".encode()
+
+
+async def client(port, ids, mix, page_size, deadline, latencies, errors):
+    operations, weights = list(mix), list(mix.values())
+    reader = writer = None
+    while time.monotonic() < deadline:
+        if writer is None:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        operation = random.choices(operations, weights)[0]
+        start = time.perf_counter()
+        try:
+            writer.write(operation_request(operation, ids, page_size))
+            keep_alive = await read_response(reader)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            errors[operation] = errors.get(operation, 0) + 1
+            keep_alive = False
+        else:
+            latencies[operation].append((time.perf_counter() - start) * 1000)
+        if not keep_alive:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run_mix(port, ids, mix, args, duration):
+    latencies = {operation: [] for operation in mix}
+    errors = {}
+    deadline = time.monotonic() + duration
+    await asyncio.gather(*(client(port, ids, mix, args.page_size, deadline, latencies, errors)
+                           for _ in range(args.connections)))
+    return latencies, errors
+
+
+async def seed(port, count, connections):
+    """
+    Creates count customers with concurrent POSTs and returns their ids.
+    """
+    ids = []
+
+    async def worker(indexes):
+        # One connection per request, since the Flask development server closes them
+        for i in indexes:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            body = json.dumps({"name": f"bench-{i}", "age": i % 100})
+            writer.write((f"POST /customers HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"
+                          f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n{body}").encode())
+            response = await reader.read()
+            ids.append(json.loads(response.split(b"\r\n\r\n", 1)[1])["id"])
+            writer.close()
+
+    await asyncio.gather(*(worker(range(i, count, connections)) for i in range(connections)))
+    return ids
+
+
+def latency_summary(values):
+    values = sorted(values)
+    if not values:
+        return {"requests": 0}
+
+    def at(p):
+        return values[min(len(values) - 1, int(p / 100 * len(values)))]
+    return {"requests": len(values), "p50_ms": at(50), "p90_ms": at(90), "p99_ms": at(99), "p999_ms": at(99.9),
+            "max_ms": values[-1]}
+
+
+def run(args):
+    mix = parse_mix(args.mix)
+    env = dict(os.environ, HOST="127.0.0.1", PORT=str(args.port))
+    server = subprocess.Popen(target_command(args.target, args.python, args.port), cwd=SRC_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(args.port)
+        ids = asyncio.run(seed(args.port, args.customers, min(args.connections, args.customers)))
+        asyncio.run(run_mix(args.port, ids, mix, args, args.warmup))
+        before = command_counts()
+        latencies, errors = asyncio.run(run_mix(args.port, ids, mix, args, args.duration))
+        after = command_counts()
+    finally:
+        server.terminate()
+        server.wait()
+
+    requests = sum(len(values) for values in latencies.values())
+    # The INFO calls of the measurement itself are not part of the load
+    calls = {name: after[name] - before.get(name, 0) for name in after if name not in ("info", "cluster")}
+    calls = {name: count for name, count in calls.items() if count}
+    return {
+        "config": {"target": args.target, "mix": mix, "connections": args.connections, "customers": args.customers,
+                   "duration_s": args.duration, "page_size": args.page_size, "python": platform.python_version(),
+                   "platform": platform.platform()},
+        "requests": requests,
+        "errors": errors,
+        "requests_per_second": requests / args.duration,
+        "latency": {"all": latency_summary([v for values in latencies.values() for v in values]),
+                    **{operation: latency_summary(values) for operation, values in latencies.items()}},
+        "commands": calls,
+        "commands_per_request": sum(calls.values()) / requests if requests else 0.0,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """
+    Returns the relative changes from the baseline and the regressions beyond tolerance.
+    """
+    changes = {}
+    regressions = []
+
+    def check(name, current, previous, higher_is_worse):
+        if not previous:
+            return
+        change = (current - previous) / previous
+        changes[name] = {"baseline": previous, "current": current, "change": change}
+        if (change if higher_is_worse else -change) > tolerance:
+            regressions.append(name)
+
+    check("requests_per_second", report["requests_per_second"], baseline["requests_per_second"], False)
+    check("commands_per_request", report["commands_per_request"], baseline["commands_per_request"], True)
+    for operation, summary in report["latency"].items():
+        if "p99_ms" in summary and "p99_ms" in baseline["latency"].get(operation, {}):
+            check(f"{operation}.p99_ms", summary["p99_ms"], baseline["latency"][operation]["p99_ms"], True)
+    return changes, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=("flask", "async"), default="flask")
+    parser.add_argument("--python", default=sys.executable, help="Interpreter of the service")
+    parser.add_argument("--mix", default="read=80,write=15,list=5")
+    parser.add_argument("--customers", type=int, default=1000, help="Number of customer keys")
+    parser.add_argument("--connections", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--save", help="Write the report to this baseline file")
+    parser.add_argument("--baseline", help="Compare with this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["config"]["mix"] != report["config"]["mix"]:
+            print("Warning: the baseline was measured with another mix", file=sys.stderr)
+        changes, regressions = compare(report, baseline, args.tolerance)
+        report["comparison"] = {"baseline": args.baseline, "changes": changes, "regressions": regressions}
+    print(json.dumps(report, indent=2))
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    if report.get("comparison", {}).get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Compares the two ways of listing customers in server.py.
+
+The legacy path scans every customer key and sends one HGETALL per key. The
+paginated path scans a page of keys per node and sends the page's HGETALLs as
+one cluster pipeline. Both paths are timed against the cluster configured in
+the environment (see src/.env.example), after loading --customers customers.
+
+Usage:
+    source ../src/.env.sh && python list_customers.py --customers 100000
+    source ../src/.env.sh && python list_customers.py --customers 100000 --limit 500 --cleanup
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+import server  # noqa: E402
+
+
+def load_customers(count, batch_size=1000):
+    """
+    Tops the cluster up to count customers.
+    """
+    existing = sum(1 for _ in server.redis.scan_iter(server.key_mask, count=1000))
+    for start in range(existing, count, batch_size):
+        pipe = server.redis.pipeline()
+        for i in range(start, min(start + batch_size, count)):
+            pipe.hset(f"customer:{uuid.uuid4()}", mapping={"name": f"customer-{i}", "age": i % 100})
+        pipe.execute()
+    return max(count - existing, 0)
+
+
+def legacy_listing():
+    customers = []
+    for key in server.redis.scan_iter(server.key_mask):
+        customer = server.redis.hgetall(key)
+        customer['id'] = key.split(':')[1]
+        customers.append(customer)
+    return customers
+
+
+def paginated_listing(limit):
+    customers = 0
+    pages = 0
+    cursor = '0-0'
+    while cursor is not None:
+        keys, cursor = server.scan_page(cursor, limit)
+        for chunk in server.stream_json_array(server.fetch_customers(keys)):
+            customers += chunk.count('"id"')
+        pages += 1
+    return customers, pages
+
+
+def measure(function, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {"seconds": elapsed, "peak_memory_mb": peak / 2**20}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--customers", type=int, default=100000)
+    parser.add_argument("--limit", type=int, default=server.page_limit, help="Keys per page of the paginated path")
+    parser.add_argument("--cleanup", action="store_true", help="Delete every customer afterwards")
+    args = parser.parse_args()
+
+    loaded = load_customers(args.customers)
+
+    customers, legacy = measure(legacy_listing)
+    legacy["customers"] = len(customers)
+    del customers
+    (count, pages), paginated = measure(paginated_listing, args.limit)
+    paginated.update(customers=count, pages=pages, limit=args.limit)
+
+    report = {
+        "customers_loaded": loaded,
+        "legacy": legacy,
+        "paginated": paginated,
+        "speedup": legacy["seconds"] / paginated["seconds"],
+    }
+    print(json.dumps(report, indent=2))
+
+    if args.cleanup:
+        for key in server.redis.scan_iter(server.key_mask, count=1000):
+            server.redis.delete(key)
+
+
+if __name__ == "__main__":
+    main()
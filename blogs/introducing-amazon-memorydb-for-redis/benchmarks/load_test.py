@@ -0,0 +1,170 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Load test comparing the Flask service (server.py) with its asyncio variant
+(async_server.py).
+
+Each target is started as a subprocess against the cluster configured in the
+environment, for example a local Redis cluster with DB_SSL=false. After seeding
+--customers customers, --connections keep-alive connections send GET
+/customers/<id> requests for random customers during --duration seconds. The
+report gives the requests per second and the latency percentiles of each target.
+
+The two services pin different redis-py versions, so each can run in its own
+virtual environment with --flask-python and --async-python.
+
+Usage:
+    source ../src/.env.sh && python load_test.py --async-python ../src/.venv-async/bin/python
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+
+def target_command(target, python, port):
+    if target == "flask":
+        return [python, "server.py"]
+    return [python, "-m", "uvicorn", "async_server:app", "--host", "127.0.0.1", "--port", str(port),
+            "--log-level", "warning", "--no-access-log"]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"Nothing is listening on port {port}")
+
+
+def seed_customers(port, count):
+    ids = []
+    for i in range(count):
+        body = json.dumps({"name": f"load-{i}", "age": i % 100}).encode()
+        request = urllib.request.Request(f"http://127.0.0.1:{port}/customers", data=body, method="POST",
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request) as response:
+            ids.append(json.loads(response.read())["id"])
+    return ids
+
+
+def delete_customers(port, ids):
+    for customer_id in ids:
+        request = urllib.request.Request(f"http://127.0.0.1:{port}/customers/{customer_id}", method="DELETE")
+        urllib.request.urlopen(request).close()
+
+
+async def read_response(reader):
+    """
+    Reads one HTTP/1.1 response and returns whether the connection can be reused.
+    """
+    head = await reader.readuntil(b"\r\n\r\n")
+    headers = {}
+    for line in head.decode("latin-1").split("\r\n")[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip().lower()
+    if "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+    elif headers.get("transfer-encoding") == "chunked":
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif not head.startswith(b"HTTP/1.1 204") and not head.startswith(b"HTTP/1.1 304"):
+        await reader.read()
+        return False
+    return head.startswith(b"HTTP/1.1") and headers.get("connection") != "close"
+
+
+async def client(port, ids, deadline, latencies, errors):
+    reader = writer = None
+    while time.monotonic() < deadline:
+        if writer is None:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        request = f"GET /customers/{random.choice(ids)} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n".encode()
+        start = time.perf_counter()
+        try:
+            writer.write(request)
+            keep_alive = await read_response(reader)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            errors.append(1)
+            keep_alive = False
+        else:
+            latencies.append((time.perf_counter() - start) * 1000)
+        if not keep_alive:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run_load(port, ids, connections, duration):
+    latencies, errors = [], []
+    deadline = time.monotonic() + duration
+    await asyncio.gather(*(client(port, ids, deadline, latencies, errors) for _ in range(connections)))
+    return latencies, errors
+
+
+def percentile(values, p):
+    return statistics.quantiles(values, n=100, method="inclusive")[p - 1]
+
+
+def run_target(target, python, port, args):
+    env = dict(os.environ, HOST="127.0.0.1", PORT=str(port))
+    server = subprocess.Popen(target_command(target, python, port), cwd=SRC_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        ids = seed_customers(port, args.customers)
+        # Warm up the connection pools before measuring
+        asyncio.run(run_load(port, ids, args.connections, 1))
+        latencies, errors = asyncio.run(run_load(port, ids, args.connections, args.duration))
+        delete_customers(port, ids)
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "requests_per_second": len(latencies) / args.duration,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", default="flask,async")
+    parser.add_argument("--flask-python", default=sys.executable)
+    parser.add_argument("--async-python", default=sys.executable)
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--connections", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=20)
+    args = parser.parse_args()
+
+    pythons = {"flask": args.flask_python, "async": args.async_python}
+    report = {"connections": args.connections, "duration_s": args.duration, "targets": {}}
+    for target in args.targets.split(","):
+        report["targets"][target] = run_target(target, pythons[target], args.port, args)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Asyncio variant of server.py, serving the same /customers and /customers/<id>
+routes with Quart on the redis-py asyncio cluster client. A request waiting on
+MemoryDB does not hold a worker thread, and all requests of a worker share one
+connection pool per cluster node.
+
+Run it with an ASGI server, for example:
+    uvicorn async_server:app --host $HOST --port $PORT
+"""
+from quart import Quart, Response, request
+from quart.views import MethodView
+from redis.asyncio.cluster import RedisCluster
+from redis.exceptions import ResponseError
+from read_cache import INVALIDATION_CHANNEL
+from versioning import VERSION_FIELD, WRITE_SCRIPT, etag, expected_version, script_arguments
+from customer_queries import (KEY_PREFIX, LISTING_PARAMETERS, build_query, customer_id_from_key, customer_key,
+                              index_schema, parse_count, parse_cursor, parse_index_fields, tenant_customer_id,
+                              parse_search_reply, search_arguments)
+import certifi
+import json
+import logging
+import os
+
+host = os.environ['HOST']
+port = os.environ['PORT']
+db_host = os.environ['DB_HOST']
+db_port = os.environ['DB_PORT']
+db_username = os.environ['DB_USERNAME']
+db_password = os.environ['DB_PASSWORD']
+db_ssl = os.environ.get('DB_SSL', 'true').lower() == 'true'
+db_max_connections = int(os.environ.get('DB_MAX_CONNECTIONS', 100))
+
+key_mask = KEY_PREFIX + "*"
+page_limit = int(os.environ.get('PAGE_LIMIT', 100))
+max_page_limit = int(os.environ.get('MAX_PAGE_LIMIT', 1000))
+
+index_name = os.environ.get('INDEX_NAME', 'customers')
+indexed_fields = parse_index_fields(os.environ.get('INDEX_FIELDS', 'name:TAG:SORTABLE,age:NUMERIC:SORTABLE'))
+index_available = False
+
+logging.basicConfig(level=logging.INFO)
+
+ssl_options = {'ssl': True, 'ssl_ca_certs': certifi.where()} if db_ssl else {}
+
+# Created in the event loop of the server on startup
+redis = None
+write_script = None
+
+app = Quart(__name__)
+
+
+@app.before_serving
+async def connect():
+    global redis, index_available, write_script
+    redis = RedisCluster(
+        host=db_host,
+        port=int(db_port),
+        decode_responses=True,
+        max_connections=db_max_connections,
+        **ssl_options,
+        username=db_username or None,
+        password=db_password or None
+    )
+    if await redis.ping():
+        logging.info("Connected to Redis")
+    write_script = redis.register_script(WRITE_SCRIPT)
+    index_available = bool(indexed_fields) and await create_index(indexed_fields)
+
+
+@app.after_serving
+async def disconnect():
+    await redis.aclose()
+
+
+async def create_index(fields):
+    """
+    Creates the index over the customer hashes unless it exists.
+    Returns False when the cluster has no search support, so queries fall back to errors.
+    Search commands are sent to the default node, since the index covers the whole cluster.
+    """
+    try:
+        await redis.execute_command('FT.INFO', index_name, target_nodes=RedisCluster.DEFAULT_NODE)
+        logging.info("Using index %s", index_name)
+        return True
+    except ResponseError as e:
+        if 'unknown command' in str(e).lower():
+            logging.warning("Search is not available, filtered queries are disabled")
+            return False
+    await redis.execute_command('FT.CREATE', index_name, 'ON', 'HASH', 'PREFIX', 1, KEY_PREFIX, 'SCHEMA',
+                                *index_schema(fields), target_nodes=RedisCluster.DEFAULT_NODE)
+    logging.info("Created index %s", index_name)
+    return True
+
+
+def error(status, message):
+    return {'message': message}, status
+
+
+async def invalidate(*customer_ids):
+    """
+    Evicts customers from the read caches of the server.py instances sharing the cluster, with one message.
+    """
+    # The asyncio cluster client has no publish(), and a message published on any node reaches every node
+    await redis.execute_command('PUBLISH', INVALIDATION_CHANNEL, '\n'.join(customer_ids),
+                                target_nodes=RedisCluster.DEFAULT_NODE)
+
+
+async def scan_page(cursor, limit):
+    """
+    Returns about limit customer keys starting at cursor, and the cursor of the next page.
+    Cursors are the same as in server.py.
+    """
+    masters = sorted(redis.get_primaries(), key=lambda node: node.name)
+    node_index, node_cursor = parse_cursor(cursor)
+    keys = []
+    while node_index < len(masters) and len(keys) < limit:
+        node = masters[node_index]
+        cursors, node_keys = await redis.execute_command('SCAN', node_cursor, 'MATCH', key_mask,
+                                                         'COUNT', limit - len(keys), target_nodes=node)
+        node_cursor = cursors[node.name]
+        keys.extend(node_keys)
+        if node_cursor == 0:
+            node_index += 1
+    next_cursor = f"{node_index}-{node_cursor}" if node_index < len(masters) else None
+    return keys, next_cursor
+
+
+async def fetch_customers(keys, chunk_size=page_limit):
+    """
+    Yields the customers stored at keys, one cluster pipeline per chunk of keys.
+    """
+    for i in range(0, len(keys), chunk_size):
+        chunk = keys[i:i + chunk_size]
+        pipe = redis.pipeline()
+        for key in chunk:
+            pipe.hgetall(key)
+        for key, customer in zip(chunk, await pipe.execute()):
+            if customer:
+                customer['id'] = customer_id_from_key(key)
+                yield customer
+
+
+async def stream_customers(customers):
+    """
+    Streams an async iterable of customers as a JSON array, like stream_json_array.
+    """
+    yield '['
+    first = True
+    async for customer in customers:
+        yield ('' if first else ',') + json.dumps(customer)
+        first = False
+    yield ']'
+
+
+def customer_fields(body):
+    """
+    Returns the fields of a customer from a request body, without its id and version,
+    or None when the body has no field to write.
+    """
+    if not isinstance(body, dict):
+        return None
+    return {name: value for name, value in body.items() if name not in ('id', VERSION_FIELD)} or None
+
+
+def not_modified(version):
+    """
+    Returns whether the If-None-Match header of the request matches the version.
+    """
+    return bool(version) and (request.if_none_match.star_tag or request.if_none_match.contains(version))
+
+
+def version_headers(customer):
+    return {'ETag': etag(customer[VERSION_FIELD])} if VERSION_FIELD in customer else {}
+
+
+class Customers(MethodView):
+
+    async def get(self):
+        filters = [(name, value) for name, value in request.args.items(multi=True)
+                   if name not in LISTING_PARAMETERS]
+        if filters or 'sort' in request.args:
+            return await self.query(filters)
+
+        cursor = request.args.get('cursor')
+        try:
+            limit = parse_count(request.args.get('limit'), None, minimum=1)
+        except ValueError:
+            return error(400, "limit must be a positive integer")
+        if cursor is None and limit is None:
+            # Without pagination parameters every customer is returned, page by page
+            async def all_customers():
+                cursor = '0-0'
+                while cursor is not None:
+                    keys, cursor = await scan_page(cursor, page_limit)
+                    async for customer in fetch_customers(keys):
+                        yield customer
+            return Response(stream_customers(all_customers()), mimetype='application/json')
+
+        limit = min(limit or page_limit, max_page_limit)
+        try:
+            keys, next_cursor = await scan_page(cursor or '0-0', limit)
+        except ValueError:
+            return error(400, "Invalid cursor")
+        response = Response(stream_customers(fetch_customers(keys)), mimetype='application/json')
+        if next_cursor is not None:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
+
+    async def query(self, filters):
+        """
+        Filters and sorts customers with the index. The cursor of a query is the offset of the next page.
+        """
+        if not index_available:
+            return error(501, "Filtered queries need the search index")
+        sort_by = request.args.get('sort')
+        unknown = [name for name, _ in filters if name not in indexed_fields]
+        if unknown:
+            return error(400, f"Fields {', '.join(unknown)} are not indexed")
+        if sort_by and not indexed_fields.get(sort_by, (None, False))[1]:
+            return error(400, f"Field {sort_by} is not sortable")
+        try:
+            limit = min(parse_count(request.args.get('limit'), page_limit, minimum=1), max_page_limit)
+        except ValueError:
+            return error(400, "limit must be a positive integer")
+        try:
+            offset = parse_count(request.args.get('cursor'), 0)
+        except ValueError:
+            return error(400, "cursor must be a non-negative integer")
+        try:
+            args = search_arguments(index_name, build_query(filters, indexed_fields), sort_by,
+                                    request.args.get('order') == 'desc', offset, limit)
+        except ValueError:
+            return error(400, "Invalid numeric filter")
+        total, customers = parse_search_reply(
+            await redis.execute_command(*args, target_nodes=RedisCluster.DEFAULT_NODE))
+        headers = {'X-Total-Count': str(total)}
+        if offset + limit < total:
+            headers['X-Next-Cursor'] = str(offset + limit)
+        return customers, 200, headers
+
+    async def post(self):
+        try:
+            customer_id = tenant_customer_id(request.args.get('tenant'))
+        except ValueError as e:
+            return error(400, str(e))
+        customer = customer_fields(await request.get_json())
+        if customer is None:
+            return error(400, "Expected a JSON object with at least one field")
+        _, version = await write_script(keys=[customer_key(customer_id)], args=script_arguments(customer))
+        customer[VERSION_FIELD] = str(version)
+        customer['id'] = customer_id
+        return customer, 201, {'ETag': etag(version)}
+
+
+class CustomersID(MethodView):
+
+    async def get(self, customer_id):
+        key = customer_key(customer_id)
+        if request.if_none_match:
+            # Polling clients get a 304 from the version alone
+            version = await redis.hget(key, VERSION_FIELD)
+            if not_modified(version):
+                return '', 304, {'ETag': etag(version)}
+        customer = await redis.hgetall(key)
+        if customer:
+            customer['id'] = customer_id
+            return customer, 200, version_headers(customer)
+        return error(404, "Customer not found")
+
+    async def put(self, customer_id):
+        # Writes bump the version and honour If-Match like server.py, so both services can share the customers
+        fields = customer_fields(await request.get_json())
+        if fields is None:
+            return error(400, "Expected a JSON object with at least one field")
+        key = customer_key(customer_id)
+        current = None
+        if request.if_match and not request.if_match.star_tag:
+            current = await redis.hget(key, VERSION_FIELD)
+        expected = expected_version(request.if_match, current)
+        if expected is None:
+            return error(412, "The customer was modified or does not exist")
+        written, version = await write_script(keys=[key], args=script_arguments(fields, expected))
+        if not written:
+            return error(412, "The customer was modified or does not exist")
+        await invalidate(customer_id)
+        return '', 204, {'ETag': etag(version)}
+
+    async def delete(self, customer_id):
+        await redis.delete(customer_key(customer_id))
+        await invalidate(customer_id)
+        return '', 204
+
+
+app.add_url_rule('/customers', view_func=Customers.as_view('customers'))
+app.add_url_rule('/customers/<customer_id>', view_func=CustomersID.as_view('customers_id'))
+
+
+if __name__ == '__main__':
+    app.run(host=host, port=int(port))
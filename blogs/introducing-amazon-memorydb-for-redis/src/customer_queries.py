@@ -0,0 +1,169 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Key and query helpers shared by the Flask (server.py) and asyncio (async_server.py) services.
+"""
+import json
+import uuid
+
+# Query parameters of GET /customers that are not filters
+LISTING_PARAMETERS = ('cursor', 'limit', 'sort', 'order')
+
+KEY_PREFIX = "customer:"
+
+
+def customer_key(customer_id):
+    """
+    Returns the key of a customer. The id "<tenant>:<id>" of a tenant's customer
+    is stored under the hash-tagged key customer:{<tenant>}:<id>, so all the
+    customers of a tenant share one slot.
+    """
+    tenant, separator, rest = customer_id.partition(':')
+    return f"{KEY_PREFIX}{{{tenant}}}:{rest}" if separator else KEY_PREFIX + customer_id
+
+
+def customer_id_from_key(key):
+    """
+    Returns the customer id of a key, the reverse of customer_key().
+    """
+    customer_id = key[len(KEY_PREFIX):]
+    if customer_id.startswith('{'):
+        tenant, _, rest = customer_id[1:].partition('}:')
+        return f"{tenant}:{rest}"
+    return customer_id
+
+
+def tenant_customer_id(tenant):
+    """
+    Returns a new customer id, in the slot of the tenant when one is given.
+    :raises ValueError: If the tenant name contains a separator or braces.
+    """
+    customer_id = str(uuid.uuid4())
+    if not tenant:
+        return customer_id
+    if any(c in tenant for c in ':{}'):
+        raise ValueError("A tenant cannot contain ':', '{' or '}'")
+    return f"{tenant}:{customer_id}"
+
+
+def client_customer_id(customer_id, tenant=None):
+    """
+    Returns a customer id given by a client, like the id of an imported record. The id
+    is "<id>" or "<tenant>:<id>", and neither part may contain ':', '{' or '}', the rule
+    of tenant_customer_id(), so it cannot spoof the hash-tagged key of another tenant.
+    An id without a tenant is put in the slot of the tenant when one is given.
+    :raises ValueError: If the id is malformed or belongs to another tenant.
+    """
+    parts = customer_id.split(':')
+    if len(parts) > 2 or not all(parts) or any(c in part for part in parts for c in '{}'):
+        raise ValueError("An id is '<id>' or '<tenant>:<id>', without ':', '{' or '}' in either part")
+    if tenant and len(parts) == 1:
+        return f"{tenant}:{customer_id}"
+    if tenant and parts[0] != tenant:
+        raise ValueError(f"The id {customer_id} does not belong to the tenant {tenant}")
+    return customer_id
+
+
+def parse_index_fields(spec):
+    """
+    Parses INDEX_FIELDS into a dictionary of field name to (type, sortable).
+    """
+    fields = {}
+    for item in filter(None, (item.strip() for item in spec.split(','))):
+        name, field_type, *options = item.split(':')
+        field_type = field_type.upper()
+        if field_type not in ('TAG', 'NUMERIC', 'TEXT'):
+            raise ValueError(f"Unsupported type {field_type} for index field {name}")
+        fields[name] = (field_type, [option.upper() for option in options] == ['SORTABLE'])
+    return fields
+
+
+def index_schema(fields):
+    """
+    Returns the SCHEMA arguments of FT.CREATE for the parsed index fields.
+    """
+    schema = []
+    for name, (field_type, sortable) in fields.items():
+        schema += [name, field_type] + (['SORTABLE'] if sortable else [])
+    return schema
+
+
+def escape_query_value(value):
+    """
+    Escapes the punctuation of a query value, which the query syntax would otherwise parse.
+    """
+    return ''.join('\\' + c if not c.isalnum() and c != '_' else c for c in value)
+
+
+def build_query(filters, fields):
+    """
+    Builds the search query matching every (field, value) filter.
+    A NUMERIC value is either a number or an inclusive "min..max" range with optional bounds.
+    """
+    clauses = []
+    for name, value in filters:
+        field_type, _ = fields[name]
+        if field_type == 'NUMERIC':
+            low, _, high = value.partition('..') if '..' in value else (value, None, value)
+            low, high = float(low) if low else '-inf', float(high) if high else '+inf'
+            clauses.append(f"@{name}:[{low} {high}]")
+        elif field_type == 'TAG':
+            clauses.append(f"@{name}:{{{escape_query_value(value)}}}")
+        else:
+            clauses.append(f"@{name}:({escape_query_value(value)})")
+    return ' '.join(clauses) or '*'
+
+
+def search_arguments(index_name, query, sort_by, descending, offset, limit):
+    """
+    Returns the FT.SEARCH command for one page of a query.
+    """
+    args = ['FT.SEARCH', index_name, query]
+    if sort_by:
+        args += ['SORTBY', sort_by, 'DESC' if descending else 'ASC']
+    return args + ['LIMIT', offset, limit]
+
+
+def parse_search_reply(reply):
+    """
+    Returns the total number of matches and the customers of an FT.SEARCH reply.
+    """
+    customers = []
+    for key, values in zip(reply[1::2], reply[2::2]):
+        customer = dict(zip(values[::2], values[1::2]))
+        customer['id'] = customer_id_from_key(key)
+        customers.append(customer)
+    return reply[0], customers
+
+
+def parse_count(value, default, minimum=0):
+    """
+    Parses an integer query parameter like limit, returning default when it is missing.
+    :raises ValueError: If the value is not an integer or is below minimum.
+    """
+    if value is None:
+        return default
+    count = int(value)
+    if count < minimum:
+        raise ValueError(f"{value} is below {minimum}")
+    return count
+
+
+def parse_cursor(cursor):
+    """
+    Splits a listing cursor "<node index>-<node cursor>" into its two numbers.
+    :raises ValueError: If the cursor is malformed.
+    """
+    node_index, node_cursor = (int(part) for part in cursor.split('-'))
+    return node_index, node_cursor
+
+
+def stream_json_array(items):
+    """
+    Streams items as a JSON array without building the whole response in memory.
+    """
+    yield '['
+    for i, item in enumerate(items):
+        yield (',' if i else '') + json.dumps(item)
+    yield ']'
@@ -0,0 +1,148 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Local read cache for customer hashes, kept consistent across instances by an
+invalidation channel.
+
+Every write publishes the ids of the customers written on the channel, one per
+line, and every instance listens to it in a background thread and evicts the
+entries. While the listener is not subscribed, for example after losing its
+connection, invalidations can be missed, so the cache is emptied and bypassed
+until it subscribes again.
+"""
+from collections import OrderedDict
+import logging
+import threading
+import time
+
+INVALIDATION_CHANNEL = "customer:invalidations"
+
+
+class ReadCache:
+    """
+    Bounded LRU cache of customer hashes with hit ratio statistics.
+    """
+
+    def __init__(self, max_entries, ttl_seconds=None):
+        """
+        :param max_entries: Number of customers kept, the least recently used is evicted first.
+        :param ttl_seconds: Optional upper bound on the age of an entry, in case an invalidation is lost.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = False
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation and reset. The generation of the last invalidation
+        # of each customer is kept for as many customers as the cache holds; puts older
+        # than _floor, the last reset or forgotten invalidation, are all dropped.
+        self._generation = 0
+        self._invalidated = OrderedDict()
+        self._floor = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def generation(self):
+        """
+        Returns a token to pass to put() after reading from Redis. A put is dropped
+        when an invalidation of the same customer arrived in between, since the value
+        read may be stale.
+        """
+        with self._lock:
+            return self._generation
+
+    def get(self, customer_id):
+        with self._lock:
+            if not self.enabled:
+                return None
+            entry = self._entries.get(customer_id)
+            if entry is not None and self.ttl_seconds and time.monotonic() - entry[1] > self.ttl_seconds:
+                del self._entries[customer_id]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(customer_id)
+            self.hits += 1
+            return dict(entry[0])
+
+    def put(self, customer_id, customer, generation):
+        with self._lock:
+            if not self.enabled or generation < self._floor or self._invalidated.get(customer_id, 0) > generation:
+                return
+            self._entries[customer_id] = (dict(customer), time.monotonic())
+            self._entries.move_to_end(customer_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, customer_id):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            self._entries.pop(customer_id, None)
+            self._invalidated[customer_id] = self._generation
+            self._invalidated.move_to_end(customer_id)
+            while len(self._invalidated) > self.max_entries:
+                _, generation = self._invalidated.popitem(last=False)
+                self._floor = generation
+
+    def reset(self, enabled):
+        """
+        Empties the cache, and turns it on or off.
+        """
+        with self._lock:
+            self._generation += 1
+            self._floor = self._generation
+            self._invalidated.clear()
+            self._entries.clear()
+            self.enabled = enabled
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+            }
+
+
+def start_invalidation_listener(redis, cache, retry_seconds=1):
+    """
+    Subscribes to the invalidation channel in a daemon thread and evicts the
+    customers published on it. The cache is only enabled while subscribed.
+    """
+    def listen():
+        while True:
+            pubsub = redis.pubsub(ignore_subscribe_messages=False)
+            try:
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                for message in pubsub.listen():
+                    if message['type'] == 'subscribe':
+                        cache.reset(enabled=True)
+                        logging.info("Read cache enabled")
+                    elif message['type'] == 'message':
+                        for customer_id in message['data'].split('\n'):
+                            cache.invalidate(customer_id)
+            except Exception:
+                logging.exception("Lost the invalidation channel, read cache disabled")
+            finally:
+                cache.reset(enabled=False)
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+            time.sleep(retry_seconds)
+
+    thread = threading.Thread(target=listen, name="read-cache-invalidations", daemon=True)
+    thread.start()
+    return thread
@@ -1,13 +1,21 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
-from flask import Flask, request
+from flask import Flask, Response, request, stream_with_context
 from flask_restful import Resource, Api, abort
+from versioning import VERSION_FIELD, WRITE_SCRIPT, etag, expected_version, script_arguments
+from read_cache import INVALIDATION_CHANNEL, ReadCache, start_invalidation_listener
+from customer_queries import (KEY_PREFIX, LISTING_PARAMETERS, build_query, client_customer_id,
+                              customer_id_from_key, customer_key, index_schema, parse_count, parse_cursor,
+                              parse_index_fields, tenant_customer_id, parse_search_reply, search_arguments,
+                              stream_json_array)
 from rediscluster import RedisCluster
+from redis.exceptions import NoScriptError, ResponseError
 import certifi
+import json
 import logging
 import os
-import uuid
+import time
 
 host = os.environ['HOST']
 port = os.environ['PORT']
@@ -15,17 +23,37 @@ db_host = os.environ['DB_HOST']
 db_port = os.environ['DB_PORT']
 db_username = os.environ['DB_USERNAME']
 db_password = os.environ['DB_PASSWORD']
+db_ssl = os.environ.get('DB_SSL', 'true').lower() == 'true'
+
+key_mask = KEY_PREFIX + "*"
+page_limit = int(os.environ.get('PAGE_LIMIT', 100))
+max_page_limit = int(os.environ.get('MAX_PAGE_LIMIT', 1000))
+
+# Records per pipeline of the bulk endpoints, which bounds their memory use
+bulk_batch_size = int(os.environ.get('BULK_BATCH_SIZE', 1000))
+# Ids per request of the batch endpoints
+max_batch_ids = int(os.environ.get('MAX_BATCH_IDS', 1000))
+
+# Secondary index over the customer hashes, as "<field>:<TAG|NUMERIC|TEXT>[:SORTABLE]" items
+index_name = os.environ.get('INDEX_NAME', 'customers')
+index_fields = os.environ.get('INDEX_FIELDS', 'name:TAG:SORTABLE,age:NUMERIC:SORTABLE')
+
+# Local cache of customer reads, off unless READ_CACHE_SIZE is set (on every instance)
+read_cache_size = int(os.environ.get('READ_CACHE_SIZE', 0))
+read_cache_ttl = float(os.environ.get('READ_CACHE_TTL', 300))
 
 logging.basicConfig(level=logging.INFO)
 
+# TLS can be turned off with DB_SSL=false to run against a local Redis cluster
+ssl_options = {'ssl': True, 'ssl_ca_certs': certifi.where()} if db_ssl else {}
+
 redis = RedisCluster(startup_nodes=[{
             "host": db_host, 
             "port": db_port
         }],
         decode_responses=True, 
         skip_full_coverage_check=True,
-        ssl=True, 
-        ssl_ca_certs=certifi.where(),
+        **ssl_options,
         username=db_username, 
         password=db_password
 )
@@ -37,54 +65,464 @@ app = Flask(__name__)
 api = Api(app)
 
 
+def create_index(fields):
+    """
+    Creates the index over the customer hashes unless it exists.
+    Returns False when the cluster has no search support, so queries fall back to errors.
+    """
+    try:
+        redis.execute_command('FT.INFO', index_name)
+        logging.info("Using index %s", index_name)
+        return True
+    except ResponseError as e:
+        if 'unknown command' in str(e).lower():
+            logging.warning("Search is not available, filtered queries are disabled")
+            return False
+    redis.execute_command('FT.CREATE', index_name, 'ON', 'HASH', 'PREFIX', 1, KEY_PREFIX, 'SCHEMA',
+                          *index_schema(fields))
+    logging.info("Created index %s", index_name)
+    return True
+
+
+indexed_fields = parse_index_fields(index_fields)
+index_available = bool(indexed_fields) and create_index(indexed_fields)
+
+read_cache = ReadCache(read_cache_size, read_cache_ttl) if read_cache_size else None
+if read_cache:
+    start_invalidation_listener(redis, read_cache)
+
+
+write_script = redis.register_script(WRITE_SCRIPT)
+redis.script_load(WRITE_SCRIPT)
+
+
+def write_customer(customer_id, fields, expected=''):
+    """
+    Writes the fields of a customer and bumps its version in one script.
+    Returns whether the write happened and the new version, or the current one
+    when the customer does not have the expected version.
+    """
+    written, version = write_script(keys=[customer_key(customer_id)], args=script_arguments(fields, expected))
+    return bool(written), str(version) if version != '' else None
+
+
+def invalidate(*customer_ids):
+    """
+    Evicts customers from the read cache of every instance after a write, with one message.
+    """
+    if read_cache:
+        for customer_id in customer_ids:
+            read_cache.invalidate(customer_id)
+        redis.publish(INVALIDATION_CHANNEL, '\n'.join(customer_ids))
+
+
+def search_customers(filters, sort_by, descending, offset, limit):
+    """
+    Runs a filtered query on the index. Returns the total number of matches and the customers of the page.
+    """
+    reply = redis.execute_command(*search_arguments(index_name, build_query(filters, indexed_fields),
+                                                    sort_by, descending, offset, limit))
+    return parse_search_reply(reply)
+
+
+def scan_node(node, cursor, count):
+    """
+    Runs one SCAN step for customer keys on a single cluster node.
+    Returns the next cursor of that node and the keys found.
+    """
+    conn = redis.connection_pool.get_connection_by_node(node)
+    try:
+        conn.send_command('SCAN', cursor, 'MATCH', key_mask, 'COUNT', count)
+        next_cursor, keys = conn.read_response()
+    finally:
+        redis.connection_pool.release(conn)
+    return int(next_cursor), keys
+
+
+def scan_page(cursor, limit):
+    """
+    Returns about limit customer keys starting at cursor, and the cursor of the next page.
+
+    A cluster cursor is "<node index>-<node cursor>", walking the master nodes
+    one after the other. Like SCAN, a page can hold slightly more than limit keys
+    and the next cursor is None once every node has been scanned.
+    """
+    masters = sorted(redis.connection_pool.nodes.all_masters(), key=lambda node: node['name'])
+    node_index, node_cursor = parse_cursor(cursor)
+    keys = []
+    while node_index < len(masters) and len(keys) < limit:
+        node_cursor, node_keys = scan_node(masters[node_index], node_cursor, limit - len(keys))
+        keys.extend(node_keys)
+        if node_cursor == 0:
+            node_index += 1
+    next_cursor = f"{node_index}-{node_cursor}" if node_index < len(masters) else None
+    return keys, next_cursor
+
+
+def fetch_customers(keys, chunk_size=page_limit):
+    """
+    Yields the customers stored at keys. Each chunk of HGETALLs is sent as one
+    cluster pipeline, which groups the commands into one round trip per node.
+    """
+    for i in range(0, len(keys), chunk_size):
+        chunk = keys[i:i + chunk_size]
+        pipe = redis.pipeline()
+        for key in chunk:
+            pipe.hgetall(key)
+        for key, customer in zip(chunk, pipe.execute()):
+            if customer:
+                customer['id'] = customer_id_from_key(key)
+                yield customer
+
+
+def all_customers(batch_size):
+    """
+    Yields every customer, scanning and fetching batch_size keys at a time.
+    """
+    cursor = '0-0'
+    while cursor is not None:
+        keys, cursor = scan_page(cursor, batch_size)
+        yield from fetch_customers(keys, batch_size)
+
+
+def write_batch(records):
+    """
+    Writes (customer_id, fields) records with one cluster pipeline, which sends
+    the commands of each node, whatever their slot, in one round trip.
+    """
+    def execute():
+        pipe = redis.pipeline()
+        for customer_id, fields in records:
+            pipe.execute_command('EVALSHA', write_script.sha, 1, customer_key(customer_id),
+                                 *script_arguments(fields))
+        pipe.execute()
+
+    try:
+        execute()
+    except NoScriptError:
+        # A node lost its scripts, for example after a failover. Records written
+        # before the error get one more version, which is harmless.
+        redis.script_load(WRITE_SCRIPT)
+        execute()
+    invalidate(*(customer_id for customer_id, _ in records))
+
+
+def parse_bulk_record(line, tenant=None):
+    """
+    Returns the (customer_id, fields) of an NDJSON line. A record without an id
+    gets a new one, and both are put in the slot of the tenant when one is given.
+    :raises ValueError: If the line is not a JSON object of scalar fields, or its id is invalid.
+    """
+    fields = json.loads(line)
+    if not isinstance(fields, dict) or not fields:
+        raise ValueError("Expected a non-empty JSON object")
+    customer_id = fields.pop('id', None)
+    if customer_id is None or customer_id == '':
+        customer_id = tenant_customer_id(tenant)
+    else:
+        customer_id = client_customer_id(str(customer_id), tenant)
+    if not fields or any(isinstance(value, (dict, list)) or value is None for value in fields.values()):
+        raise ValueError("Expected string or number fields")
+    return customer_id, {name: json.dumps(value) if isinstance(value, bool) else value
+                         for name, value in fields.items()}
+
+
+class CustomersBulk(Resource):
+
+    def post(self):
+        """
+        Imports customers from an NDJSON body, one customer per line, without
+        loading the whole body. Lines with an "id" overwrite that customer.
+        """
+        tenant = request.args.get('tenant')
+        try:
+            tenant_customer_id(tenant)
+        except ValueError as e:
+            abort(400, message=str(e))
+        start = time.perf_counter()
+        imported = 0
+        errors = []
+        batch = []
+        for line_number, line in enumerate(request.stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                batch.append(parse_bulk_record(line, tenant))
+            except ValueError as e:
+                if len(errors) < 100:
+                    errors.append({'line': line_number, 'error': str(e)})
+                continue
+            if len(batch) >= bulk_batch_size:
+                write_batch(batch)
+                imported += len(batch)
+                batch = []
+        if batch:
+            write_batch(batch)
+            imported += len(batch)
+        seconds = time.perf_counter() - start
+        logging.info("Imported %d customers in %.1fs", imported, seconds)
+        return {
+            'imported': imported,
+            'seconds': seconds,
+            'records_per_second': imported / seconds if seconds else 0.0,
+            'errors': errors,
+        }
+
+
+def keys_by_slot(customer_ids):
+    """
+    Groups the keys of customers by hash slot. The customers of one tenant share a slot.
+    """
+    slots = {}
+    for customer_id in customer_ids:
+        key = customer_key(customer_id)
+        slots.setdefault(redis.connection_pool.nodes.keyslot(key), []).append((customer_id, key))
+    return slots
+
+
+def batch_ids():
+    """
+    Returns the distinct ids of the JSON body {"ids": [...]} of a batch request.
+    """
+    body = request.get_json(silent=True)
+    ids = body.get('ids') if isinstance(body, dict) else None
+    if not isinstance(ids, list) or not all(isinstance(customer_id, str) and customer_id for customer_id in ids):
+        abort(400, message='Expected {"ids": [...]} with string ids')
+    if len(ids) > max_batch_ids:
+        abort(400, message=f"At most {max_batch_ids} ids per request")
+    return list(dict.fromkeys(ids))
+
+
+class CustomersBatchGet(Resource):
+
+    def post(self):
+        """
+        Returns the customers of a list of ids, in the order of the list, and the ids not found.
+        The HGETALLs are sorted by slot and sent as one cluster pipeline, one round trip per node.
+        """
+        ids = batch_ids()
+        found = {}
+        if read_cache:
+            for customer_id in ids:
+                customer = read_cache.get(customer_id)
+                if customer:
+                    found[customer_id] = customer
+            generation = read_cache.generation()
+        pipe = redis.pipeline()
+        fetched = []
+        missing = [customer_id for customer_id in ids if customer_id not in found]
+        for _, slot_keys in sorted(keys_by_slot(missing).items()):
+            for customer_id, key in slot_keys:
+                pipe.hgetall(key)
+                fetched.append(customer_id)
+        for customer_id, customer in zip(fetched, pipe.execute() if fetched else []):
+            if customer:
+                found[customer_id] = customer
+                if read_cache:
+                    read_cache.put(customer_id, customer, generation)
+        customers = []
+        for customer_id in ids:
+            if customer_id in found:
+                found[customer_id]['id'] = customer_id
+                customers.append(found[customer_id])
+        return {'customers': customers, 'missing': [customer_id for customer_id in ids if customer_id not in found]}
+
+
+class CustomersBatchDelete(Resource):
+
+    def post(self):
+        """
+        Deletes the customers of a list of ids with one DEL per hash slot, all sent
+        as one cluster pipeline. Returns the number of customers deleted.
+        """
+        ids = batch_ids()
+        pipe = redis.pipeline()
+        for slot_keys in keys_by_slot(ids).values():
+            pipe.execute_command('DEL', *(key for _, key in slot_keys))
+        deleted = sum(pipe.execute()) if ids else 0
+        if ids:
+            invalidate(*ids)
+        return {'deleted': deleted}
+
+
+class CustomersExport(Resource):
+
+    def get(self):
+        """
+        Streams every customer as NDJSON.
+        """
+        def export():
+            start = time.perf_counter()
+            exported = 0
+            for customer in all_customers(bulk_batch_size):
+                exported += 1
+                yield json.dumps(customer) + '\n'
+            seconds = time.perf_counter() - start
+            logging.info("Exported %d customers in %.1fs (%.0f records/s)", exported, seconds,
+                         exported / seconds if seconds else 0.0)
+        return Response(stream_with_context(export()), mimetype='application/x-ndjson')
+
+
+def customer_fields(body):
+    """
+    Returns the fields of a customer from a request body, without its id and version.
+    """
+    if not isinstance(body, dict):
+        abort(400, message="Expected a JSON object")
+    fields = {name: value for name, value in body.items() if name not in ('id', VERSION_FIELD)}
+    if not fields:
+        abort(400, message="Expected at least one field")
+    return fields
+
+
+def not_modified(version):
+    """
+    Returns whether the If-None-Match header of the request matches the version.
+    """
+    return bool(version) and (request.if_none_match.star_tag or request.if_none_match.contains(version))
+
+
+def version_headers(customer):
+    return {'ETag': etag(customer[VERSION_FIELD])} if VERSION_FIELD in customer else {}
+
+
 class Customers(Resource):
 
     def get(self):
-        key_mask = "customer:*"
-        customers = []
-        for key in redis.scan_iter(key_mask):
-            customer_id = key.split(':')[1]
-            customer = redis.hgetall(key)
-            customer['id'] = customer_id
-            customers.append(customer)
-        return customers
+        filters = [(name, value) for name, value in request.args.items(multi=True)
+                   if name not in LISTING_PARAMETERS]
+        if filters or 'sort' in request.args:
+            return self.query(filters)
+
+        cursor = request.args.get('cursor')
+        try:
+            limit = parse_count(request.args.get('limit'), None, minimum=1)
+        except ValueError:
+            abort(400, message="limit must be a positive integer")
+        if cursor is None and limit is None:
+            # Without pagination parameters every customer is returned, page by page
+            return Response(stream_with_context(stream_json_array(all_customers(page_limit))),
+                            mimetype='application/json')
+
+        limit = min(limit or page_limit, max_page_limit)
+        try:
+            keys, next_cursor = scan_page(cursor or '0-0', limit)
+        except ValueError:
+            abort(400, message="Invalid cursor")
+        response = Response(stream_with_context(stream_json_array(fetch_customers(keys))),
+                            mimetype='application/json')
+        if next_cursor is not None:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
+
+    def query(self, filters):
+        """
+        Filters and sorts customers with the index. The cursor of a query is the offset of the next page.
+        """
+        if not index_available:
+            abort(501, message="Filtered queries need the search index")
+        sort_by = request.args.get('sort')
+        unknown = [name for name, _ in filters if name not in indexed_fields]
+        if unknown:
+            abort(400, message=f"Fields {', '.join(unknown)} are not indexed")
+        if sort_by and not indexed_fields.get(sort_by, (None, False))[1]:
+            abort(400, message=f"Field {sort_by} is not sortable")
+        try:
+            limit = min(parse_count(request.args.get('limit'), page_limit, minimum=1), max_page_limit)
+        except ValueError:
+            abort(400, message="limit must be a positive integer")
+        try:
+            offset = parse_count(request.args.get('cursor'), 0)
+        except ValueError:
+            abort(400, message="cursor must be a non-negative integer")
+        try:
+            total, customers = search_customers(filters, sort_by, request.args.get('order') == 'desc',
+                                                offset, limit)
+        except ValueError:
+            abort(400, message="Invalid numeric filter")
+        response = Response(stream_with_context(stream_json_array(customers)), mimetype='application/json')
+        response.headers['X-Total-Count'] = total
+        if offset + limit < total:
+            response.headers['X-Next-Cursor'] = offset + limit
+        return response
 
     def post(self):
         print(request.json)
-        customer_id = str(uuid.uuid4())
-        key = "customer:" + customer_id
-        redis.hset(key, mapping=request.json)
-        customer = request.json
+        try:
+            customer_id = tenant_customer_id(request.args.get('tenant'))
+        except ValueError as e:
+            abort(400, message=str(e))
+        customer = customer_fields(request.json)
+        _, version = write_customer(customer_id, customer)
+        customer[VERSION_FIELD] = version
         customer['id'] = customer_id
-        return customer, 201
+        return customer, 201, {'ETag': etag(version)}
 
 
 class Customers_ID(Resource):
 
     def get(self, customer_id):
-        key = "customer:" + customer_id
+        if read_cache:
+            customer = read_cache.get(customer_id)
+            if customer:
+                if not_modified(customer.get(VERSION_FIELD)):
+                    return '', 304, version_headers(customer)
+                customer['id'] = customer_id
+                return customer, 200, version_headers(customer)
+            generation = read_cache.generation()
+        key = customer_key(customer_id)
+        if request.if_none_match:
+            # Polling clients get a 304 from the version alone
+            version = redis.hget(key, VERSION_FIELD)
+            if not_modified(version):
+                return '', 304, {'ETag': etag(version)}
         customer = redis.hgetall(key)
         print(customer)
+        if customer and read_cache:
+            read_cache.put(customer_id, customer, generation)
         if customer:
             customer['id'] = customer_id
-            return customer
+            return customer, 200, version_headers(customer)
         else:
             abort(404)
 
     def put(self, customer_id):
         print(request.json)
-        key = "customer:" + customer_id
-        redis.hset(key, mapping=request.json)
-        return '', 204
+        fields = customer_fields(request.json)
+        current = None
+        if request.if_match and not request.if_match.star_tag:
+            current = redis.hget(customer_key(customer_id), VERSION_FIELD)
+        expected = expected_version(request.if_match, current)
+        if expected is None:
+            abort(412, message="The customer was modified or does not exist")
+        written, version = write_customer(customer_id, fields, expected)
+        if not written:
+            abort(412, message="The customer was modified or does not exist")
+        invalidate(customer_id)
+        return '', 204, {'ETag': etag(version)}
 
     def delete(self, customer_id):
-        key = "customer:" + customer_id
+        key = customer_key(customer_id)
         redis.delete(key)
+        invalidate(customer_id)
         return '', 204
 
 
+class ReadCacheStats(Resource):
+
+    def get(self):
+        if not read_cache:
+            abort(404, message="The read cache is disabled")
+        return read_cache.stats()
+
+
 api.add_resource(Customers, '/customers')
 api.add_resource(Customers_ID, '/customers/<customer_id>')
+api.add_resource(CustomersBulk, '/customers:bulk')
+api.add_resource(CustomersExport, '/customers:export')
+api.add_resource(CustomersBatchGet, '/customers:batchGet')
+api.add_resource(CustomersBatchDelete, '/customers:batchDelete')
+api.add_resource(ReadCacheStats, '/stats/read-cache')
 
 
 if __name__ == '__main__':
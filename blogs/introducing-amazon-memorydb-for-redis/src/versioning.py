@@ -0,0 +1,68 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""
+Version counter of the customer hashes, used for ETags and conditional writes.
+
+The version is kept in the _version field of each hash and bumped by the same
+script that writes the fields, so a version always identifies one content.
+"""
+
+VERSION_FIELD = "_version"
+
+# KEYS[1]: customer key
+# ARGV[1]: version the customer must have, "*" for any existing customer, "" for no condition
+# ARGV[2..]: field and value pairs
+# Returns {1, new version} after writing, or {0, current version} when the condition fails.
+WRITE_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], '_version')
+if ARGV[1] == '*' then
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return {0, ''}
+    end
+elseif ARGV[1] ~= '' and ARGV[1] ~= current then
+    return {0, current or ''}
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+if current then
+    return {1, redis.call('HINCRBY', KEYS[1], '_version', 1)}
+end
+-- A new customer starts at the server time in microseconds, so a customer that
+-- is deleted and created again does not reuse the versions of the old one
+local now = redis.call('TIME')
+local version = now[1] .. string.format('%06d', tonumber(now[2]))
+redis.call('HSET', KEYS[1], '_version', version)
+return {1, version}
+"""
+
+
+def script_arguments(fields, expected=''):
+    """
+    Returns the ARGV of WRITE_SCRIPT. The version cannot be written by clients.
+    """
+    args = [expected]
+    for name, value in fields.items():
+        if name != VERSION_FIELD:
+            args += [name, value]
+    return args
+
+
+def etag(version):
+    return f'"{version}"'
+
+
+def expected_version(if_match, current):
+    """
+    Returns the version a write must expect, as the ARGV[1] of WRITE_SCRIPT, for the
+    If-Match header of a request (werkzeug ETags) and the current version of the
+    customer. Returns None when the condition already fails: If-Match only matches
+    strong tags, so a header listing only weak or empty tags never matches.
+    """
+    if if_match.star_tag:
+        return '*'
+    if not if_match:
+        return ''
+    # The script checks a single version, so pick the listed version the customer has, if any
+    if current and if_match.contains(current):
+        return current
+    return None
@@ -0,0 +1,113 @@
+"""
+Cold-start benchmark for the answerQuestionFunction Lambda.
+
+Every run starts a fresh Python interpreter, imports app.py and sends two
+requests, reporting the import time, the first (cold) request latency and the
+second (warm) request latency. MemoryDB is replaced by a local stand-in (a Redis
+with the search module, for example `docker run -p 6379:6379 redis/redis-stack-server`)
+and Bedrock by an in-process fake, so only the initialization work of the
+function itself is measured.
+
+Usage:
+    python cold_start.py --runs 10 --host localhost --port 6379
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+FUNCTION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "terraform", "answerQuestionFunction")
+
+
+class FakeBody:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def read(self):
+        return self.payload
+
+
+class FakeBedrockRuntime:
+    """
+    Returns a deterministic embedding derived from the input text.
+    """
+
+    def __init__(self, dimensions):
+        self.dimensions = dimensions
+
+    def invoke_model(self, body, **kwargs):
+        import numpy as np
+        request = json.loads(body)
+        rng = np.random.default_rng(abs(hash(request["inputText"])) % 2**32)
+        embedding = rng.random(request.get("dimensions", self.dimensions), dtype=np.float32).tolist()
+        return {"body": FakeBody(json.dumps({"embedding": embedding}))}
+
+
+class FakeBedrockAgentRuntime:
+    def retrieve_and_generate(self, input, **kwargs):
+        return {"output": {"text": f"Answer to: {input['text']}"}}
+
+
+def child(args):
+    """
+    Runs inside the fresh interpreter and prints one JSON result line.
+    """
+    sys.path.insert(0, FUNCTION_DIR)
+    start = time.perf_counter()
+    import app
+    import_ms = (time.perf_counter() - start) * 1000
+
+    app.bedrock_client = FakeBedrockRuntime(args.dimensions)
+    app.bedrock_agent_runtime = FakeBedrockAgentRuntime()
+
+    latencies = []
+    for question in (f"cold start question {time.time_ns()}", f"warm question {time.time_ns()}"):
+        event = {"body": json.dumps({"question": question})}
+        start = time.perf_counter()
+        app.lambda_handler(event, None)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    print(json.dumps({"import_ms": import_ms, "first_request_ms": latencies[0], "warm_request_ms": latencies[1]}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--cluster-mode", action="store_true", help="The stand-in runs in cluster mode")
+    parser.add_argument("--ssl", action="store_true")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    env = dict(os.environ,
+               PERISTENT_SEMANTIC_CACHE_ENDPOINT=args.host,
+               PERISTENT_SEMANTIC_CACHE_PORT=str(args.port),
+               PERISTENT_SEMANTIC_CACHE_SSL=str(args.ssl).lower(),
+               PERISTENT_SEMANTIC_CACHE_CLUSTER_MODE=str(args.cluster_mode).lower(),
+               AWS_XRAY_SDK_ENABLED="false",
+               AWS_DEFAULT_REGION=os.getenv("AWS_DEFAULT_REGION", "us-east-1"))
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--dimensions", str(args.dimensions)]
+
+    results = []
+    for _ in range(args.runs):
+        output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    report = {"runs": args.runs}
+    for metric in ("import_ms", "first_request_ms", "warm_request_ms"):
+        values = [r[metric] for r in results]
+        report[metric] = {"median": statistics.median(values), "min": min(values), "max": max(values)}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
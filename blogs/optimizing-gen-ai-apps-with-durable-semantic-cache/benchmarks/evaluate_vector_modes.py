@@ -0,0 +1,130 @@
+"""
+Compares the vector storage modes of the semantic cache.
+
+Every question of a log is embedded in every mode (see vector_modes.py). The
+log is replayed against an in-memory cache per mode: a question is a hit when a
+previous question is within --radius (cosine distance). The report gives, for
+every mode, the hit rate, the agreement of its hit/miss decisions with the
+baseline mode and the memory per entry. The memory is estimated from the vector
+size and the HNSW graph links (--hnsw-m), or measured against a local Redis
+with the search module when --host is given.
+
+The log is a text file with one question per line, or JSON lines with a
+"question" field.
+
+Usage:
+    python evaluate_vector_modes.py questions.log
+    python evaluate_vector_modes.py questions.log --modes titan-v1,titan-v2-256 --host localhost
+"""
+import argparse
+import json
+import os
+import sys
+
+import boto3
+import numpy as np
+
+FUNCTION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "terraform", "answerQuestionFunction")
+sys.path.insert(0, FUNCTION_DIR)
+
+from vector_modes import VECTOR_MODES, get_vector_mode  # noqa: E402
+from replay_dedup import read_questions  # noqa: E402
+
+
+def embed_all(mode, questions, bedrock_client, raw_cache):
+    """
+    Embeds the questions in a mode. Projection modes reuse the embeddings of their base model.
+    """
+    vectors = []
+    for question in questions:
+        key = (mode.model_id, mode.request_dimensions, question)
+        if key not in raw_cache:
+            response = bedrock_client.invoke_model(body=mode.request_body(question), contentType="application/json",
+                                                   accept="*/*", modelId=mode.model_id)
+            raw_cache[key] = json.loads(response["body"].read())["embedding"]
+        vectors.append(mode.transform(raw_cache[key]))
+    vectors = np.array(vectors, dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def replay_hits(vectors, radius):
+    """
+    Returns, for every question in log order, whether an earlier question is within radius.
+    """
+    distances = 1 - vectors @ vectors.T
+    return np.array([i > 0 and distances[i, :i].min() <= radius for i in range(len(vectors))])
+
+
+def estimated_bytes_per_entry(mode, hnsw_m):
+    # Vector plus roughly 2*M neighbour ids of 8 bytes on the base layer of the graph
+    return mode.bytes_per_vector + 2 * hnsw_m * 8
+
+
+def measured_bytes_per_entry(mode, vectors, host, port, hnsw_m):
+    """
+    Creates a scratch index for the mode on a local Redis and measures the memory growth per vector.
+    """
+    import redis
+    client = redis.Redis(host=host, port=port)
+    index_name = f"eval-{mode.name}"
+    prefix = f"eval:{mode.name}:"
+    try:
+        client.execute_command("FT.DROPINDEX", index_name, "DD")
+    except redis.ResponseError:
+        pass
+    client.execute_command("FT.CREATE", index_name, "ON", "HASH", "PREFIX", 1, prefix, "SCHEMA",
+                           "vector", "VECTOR", "HNSW", 8, "TYPE", "FLOAT32", "DIM", mode.dimensions,
+                           "DISTANCE_METRIC", "COSINE", "M", hnsw_m)
+    before = client.info("memory")["used_memory"]
+    pipe = client.pipeline(transaction=False)
+    for i, vector in enumerate(vectors):
+        pipe.hset(f"{prefix}{i}", "vector", vector.tobytes())
+    pipe.execute()
+    after = client.info("memory")["used_memory"]
+    client.execute_command("FT.DROPINDEX", index_name, "DD")
+    return (after - before) / len(vectors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log")
+    parser.add_argument("--modes", default=",".join(VECTOR_MODES))
+    parser.add_argument("--baseline", default="titan-v1")
+    parser.add_argument("--radius", type=float, default=0.4)
+    parser.add_argument("--hnsw-m", type=int, default=16)
+    parser.add_argument("--host", help="Local Redis with the search module to measure memory per entry")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+
+    questions = read_questions(args.log)
+    bedrock_client = boto3.client("bedrock-runtime", region_name="us-east-1")
+    names = args.modes.split(",")
+    if args.baseline not in names:
+        names.insert(0, args.baseline)
+
+    raw_cache = {}
+    vectors = {name: embed_all(get_vector_mode(name), questions, bedrock_client, raw_cache) for name in names}
+    hits = {name: replay_hits(vectors[name], args.radius) for name in names}
+    baseline = hits[args.baseline]
+
+    report = {"questions": len(questions), "radius": args.radius, "baseline": args.baseline, "modes": {}}
+    for name in names:
+        mode = get_vector_mode(name)
+        result = {
+            "dimensions": mode.dimensions,
+            "hit_rate": float(hits[name].mean()),
+            "agreement_with_baseline": float((hits[name] == baseline).mean()),
+            "false_hits": int((hits[name] & ~baseline).sum()),
+            "missed_hits": int((~hits[name] & baseline).sum()),
+            "vector_bytes": mode.bytes_per_vector,
+            "estimated_bytes_per_entry": estimated_bytes_per_entry(mode, args.hnsw_m),
+        }
+        if args.host:
+            result["measured_bytes_per_entry"] = measured_bytes_per_entry(mode, vectors[name], args.host, args.port,
+                                                                          args.hnsw_m)
+        report["modes"][name] = result
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Replays a question log and reports how many semantic cache entries the old and
+new key schemes produce.
+
+Both schemes look a question up before adding it, so a question that is already
+cached is a hit and is not written again. A question is only written twice when
+it misses again while its first answer is still being generated: the replay makes
+an answer visible --window requests after its miss, and sends every request to one
+of --containers containers.
+
+The old scheme keyed entries on Python's hash() of the raw question, which is
+randomized per process, so each container missing the same question concurrently
+wrote its own copy. The new scheme keys entries on a digest of the normalized
+question and the model tag. With --embeddings, the write also runs the range query
+of add_to_cache, and refreshes an existing entry instead of adding one when it is
+within --dedup-radius (cosine distance) of the new question. With --embeddings, lookups hit within --hit-radius like the
+function does; without, only repeats of the same normalized question hit.
+
+The log is a text file with one question per line, or JSON lines with a
+"question" field.
+
+Usage:
+    python replay_dedup.py questions.log --containers 20 --window 20
+    python replay_dedup.py questions.log --containers 20 --window 20 --embeddings
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+import numpy as np
+
+FUNCTION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "terraform", "answerQuestionFunction")
+sys.path.insert(0, FUNCTION_DIR)
+
+from local_cache import question_digest  # noqa: E402
+
+EMBEDDING_MODEL_ID = "amazon.titan-embed-text-v1"
+
+
+def read_questions(path):
+    questions = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                line = json.loads(line)["question"]
+            questions.append(line)
+    return questions
+
+
+def embed(questions):
+    import boto3
+    client = boto3.client("bedrock-runtime", region_name="us-east-1")
+    vectors = []
+    for question in questions:
+        response = client.invoke_model(body=json.dumps({"inputText": question}), contentType="application/json",
+                                       accept="*/*", modelId=EMBEDDING_MODEL_ID)
+        vectors.append(json.loads(response["body"].read())["embedding"])
+    vectors = np.array(vectors, dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def replay(rows, containers, window, stable_keys, vectors=None, hit_radius=0.4, dedup_radius=None):
+    """
+    Replays the requests through lookup-then-insert and returns the number of entries written.
+    :param rows: For every request, the row of its normalized question (and of its vector).
+    :param containers: For every request, the container that serves it.
+    :param window: Requests between a miss and the time its entry is visible to lookups.
+    :param stable_keys: Whether all containers write a question to the same key.
+    :param vectors: Normalized question vectors, to hit and deduplicate by cosine distance.
+    """
+    entries = {}    # key -> (row, index of the first request that sees the entry)
+
+    def visible_rows(index):
+        return [row for row, visible_at in entries.values() if visible_at <= index]
+
+    def within(row, candidates, radius):
+        if not candidates:
+            return False
+        if vectors is None:
+            return row in candidates
+        return (1 - vectors[candidates] @ vectors[row]).min() <= radius
+
+    for i, (row, container) in enumerate(zip(rows, containers)):
+        if within(row, visible_rows(i), hit_radius):
+            continue
+        key = row if stable_keys else (container, row)
+        if key in entries:
+            continue
+        # add_to_cache runs its dedup query when the answer is written, at the end of
+        # the window, so it sees the entries written by concurrent misses
+        if dedup_radius is not None and within(row, visible_rows(i + window), dedup_radius):
+            continue
+        entries[key] = (row, i + window)
+    return len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log")
+    parser.add_argument("--containers", type=int, default=10, help="Concurrent Lambda containers to simulate")
+    parser.add_argument("--embeddings", action="store_true", help="Embed the questions with Bedrock to count near-duplicates")
+    parser.add_argument("--window", type=int, default=10,
+                        help="Requests that arrive while a miss is answered and written")
+    parser.add_argument("--hit-radius", type=float, default=0.4)
+    parser.add_argument("--dedup-radius", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    questions = read_questions(args.log)
+    rng = random.Random(args.seed)
+    containers = [rng.randrange(args.containers) for _ in questions]
+    digests = {}
+    rows = [digests.setdefault(question_digest(question, namespace=EMBEDDING_MODEL_ID), len(digests))
+            for question in questions]
+    vectors = None
+    if args.embeddings:
+        first_questions = {}
+        for question, row in zip(questions, rows):
+            first_questions.setdefault(row, question)
+        vectors = embed([first_questions[row] for row in range(len(digests))])
+
+    def entries(stable_keys, dedup_radius=None):
+        return replay(rows, containers, args.window, stable_keys, vectors, args.hit_radius, dedup_radius)
+
+    report = {
+        "questions": len(questions),
+        "distinct_questions": len(digests),
+        "containers": args.containers,
+        "window": args.window,
+        "entries_old_scheme": entries(stable_keys=False),
+        "entries_stable_keys": entries(stable_keys=True),
+    }
+    if args.embeddings:
+        report["entries_stable_keys_and_near_duplicates"] = entries(stable_keys=True, dedup_radius=args.dedup_radius)
+    final = report.get("entries_stable_keys_and_near_duplicates", report["entries_stable_keys"])
+    report["index_reduction"] = 1 - final / report["entries_old_scheme"] if report["entries_old_scheme"] else 0.0
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,26 @@ import json
 import logging
 import sys
 import traceback
+from redis import Redis
 from redis.cluster import RedisCluster
+from redis.exceptions import ResponseError
 from redis.commands.search.field import TagField, VectorField, TextField
 from redis.commands.search.indexDefinition import IndexDefinition, IndexType
-from redis.commands.search.query import Query
+from redis.commands.search.document import Document
 import numpy as np
 import sys
 import os
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait
 from aws_xray_sdk.core import xray_recorder
 from aws_xray_sdk.core import patch_all
+from local_cache import LocalAnswerCache, CacheStats, question_digest
+from embedding_store import EmbeddingStore
+from single_flight import SingleFlight
+from cache_lifecycle import CacheLifecycle
+from vector_modes import get_vector_mode
+from metrics import Metrics, emf_stdout_sink
 
 # Setup logging
 stdout_handler = logging.StreamHandler(sys.stdout)
@@ -20,143 +31,565 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logger.addHandler(stdout_handler)
 
-patch_all()
-
-redis_client = RedisCluster(host=os.getenv("PERISTENT_SEMANTIC_CACHE_ENDPOINT"), 
-                            port=6379,
-                            ssl=True)
-redis_client.ping()
-logger.info("Connection to Amazon MemoryDB successful")
-
-INDEX_NAME = "bedrock"                              # Vector Index Name
-DOC_PREFIX = "doc:"                               # RediSearch Key Prefix for the Index
+# How questions are embedded and stored, see vector_modes.py
+VECTOR_MODE = get_vector_mode(os.getenv("CACHE_VECTOR_MODE", "titan-v1"))
+INDEX_NAME = VECTOR_MODE.index_name                 # Vector Index Name
+DOC_PREFIX = VECTOR_MODE.doc_prefix                 # RediSearch Key Prefix for the Index
 knowledge_base_id = os.getenv("KNOWLEDGE_BASE_ID")
 model_id = 'anthropic.claude-3-sonnet-20240229-v1:0'
+EMBEDDING_TAG = VECTOR_MODE.tag
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "8"))
+GENERATION_CONCURRENCY = int(os.getenv("GENERATION_CONCURRENCY", "4"))
+MAX_BATCH_QUESTIONS = int(os.getenv("MAX_BATCH_QUESTIONS", "1000"))
+CACHE_RADIUS = float(os.getenv("CACHE_RADIUS", "0.4"))          # Maximum distance of a cache hit
+DEDUP_RADIUS = float(os.getenv("CACHE_DEDUP_RADIUS", "0.05"))   # Maximum distance of a near-duplicate entry
+CACHE_WRITE_BEHIND = os.getenv("CACHE_WRITE_BEHIND", "true").lower() == "true"
+
+# Clients are created on first use instead of at import, so the cold start only
+# pays for what the first request actually needs
+redis_client = None
+bedrock_client = None
+bedrock_agent_runtime = None
+embedding_store = None
+single_flight = None
+cache_lifecycle = None
+write_behind_executor = None
+pending_cache_writes = []
+pending_cache_writes_lock = threading.Lock()
+tracing_patched = False
+index_ready = os.getenv("SEMANTIC_CACHE_SETUP_INDEX", "true").lower() != "true"
+
+# In-process L1 cache of exact (normalized) questions, kept while the container is warm
+local_answer_cache = LocalAnswerCache(
+    max_entries=int(os.getenv("L1_CACHE_MAX_ENTRIES", "1024")),
+    ttl_seconds=int(os.getenv("L1_CACHE_TTL_SECONDS", "300"))
+)
+cache_stats = CacheStats()
+
+# Per-stage latency histograms, cache counters and similarity scores, flushed once per
+# invocation as CloudWatch embedded metric format log lines (METRICS_SINK=none disables them)
+metrics = Metrics(
+    os.getenv("METRICS_NAMESPACE", "SemanticCache"),
+    dimensions={"FunctionName": os.getenv("AWS_LAMBDA_FUNCTION_NAME", "answer-question-function")},
+    sink=emf_stdout_sink if os.getenv("METRICS_SINK", "emf") == "emf" else None
+)
 
-# Bedrock Runtime client used to invoke and question the models
-bedrock_client = boto3.client('bedrock-runtime',region_name="us-east-1")
-bedrock_agent_runtime = boto3.client('bedrock-agent-runtime',region_name="us-east-1")
 
-def setup_index():
+@contextmanager
+def stage(name):
     """
-    Creates the index if it doesn't exist
+    Traces a stage of the request as an X-Ray subsegment and records its latency.
+    """
+    with metrics.timer(name):
+        xray_recorder.begin_subsegment(name)
+        try:
+            yield
+        finally:
+            xray_recorder.end_subsegment()
+
+
+def record_cache_outcome(tier, score=None):
+    """
+    Counts an L1 hit, L2 hit or miss, and records the similarity score of L2 hits.
+    """
+    cache_stats.record(tier)
+    metrics.increment({"l1": "l1_hits", "l2": "l2_hits", "miss": "misses"}[tier])
+    if score is not None:
+        metrics.observe("similarity_score", float(score))
+
+
+def init_tracing():
+    """
+    Patches the supported libraries for X-Ray once, before the first client is created.
+    """
+    global tracing_patched
+    if not tracing_patched:
+        patch_all()
+        tracing_patched = True
+
+
+def get_redis_client():
+    """
+    Returns the MemoryDB client, connecting and checking the index on first use.
     """
     global redis_client
+    if redis_client is None:
+        init_tracing()
+        host = os.getenv("PERISTENT_SEMANTIC_CACHE_ENDPOINT")
+        port = int(os.getenv("PERISTENT_SEMANTIC_CACHE_PORT", "6379"))
+        ssl = os.getenv("PERISTENT_SEMANTIC_CACHE_SSL", "true").lower() == "true"
+        if os.getenv("PERISTENT_SEMANTIC_CACHE_CLUSTER_MODE", "true").lower() == "true":
+            client = RedisCluster(host=host, port=port, ssl=ssl)
+        else:
+            # Single node stand-in, for example a local Redis with the search module
+            client = Redis(host=host, port=port, ssl=ssl)
+        logger.info("Connection to Amazon MemoryDB successful")
+        redis_client = client
+    ensure_index()
+    return redis_client
+
+
+def get_bedrock_client():
+    """
+    Returns the Bedrock Runtime client used to invoke the embedding model.
+    """
+    global bedrock_client
+    if bedrock_client is None:
+        init_tracing()
+        bedrock_client = boto3.client('bedrock-runtime',region_name="us-east-1")
+    return bedrock_client
+
+
+def get_bedrock_agent_runtime():
+    """
+    Returns the Bedrock Agent Runtime client used to question the knowledge base.
+    """
+    global bedrock_agent_runtime
+    if bedrock_agent_runtime is None:
+        init_tracing()
+        bedrock_agent_runtime = boto3.client('bedrock-agent-runtime',region_name="us-east-1")
+    return bedrock_agent_runtime
+
+
+def get_embedding_store():
+    """
+    Returns the store memoizing embeddings in MemoryDB by model id and text hash.
+    """
+    global embedding_store
+    if embedding_store is None:
+        embedding_store = EmbeddingStore(
+            get_redis_client(),
+            ttl_seconds=int(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+        )
+    return embedding_store
+
+
+def get_single_flight():
+    """
+    Returns the helper coalescing concurrent misses for the same question into a single model call.
+    """
+    global single_flight
+    if single_flight is None:
+        single_flight = SingleFlight(
+            get_redis_client(),
+            lock_ttl_ms=int(os.getenv("SINGLE_FLIGHT_LOCK_TTL_MS", "15000")),
+            wait_timeout_ms=int(os.getenv("SINGLE_FLIGHT_WAIT_TIMEOUT_MS", "15000"))
+        )
+    return single_flight
+
+
+def get_cache_lifecycle():
+    """
+    Returns the manager applying TTLs, counting hits and evicting least frequently used entries.
+    Sweeps are scheduled with EventBridge (see sweep_handler); an in-process sweeper thread
+    is only started when CACHE_SWEEP_INTERVAL_SECONDS is greater than zero.
+    """
+    global cache_lifecycle
+    if cache_lifecycle is None:
+        cache_lifecycle = CacheLifecycle(
+            get_redis_client(),
+            INDEX_NAME,
+            ttl_seconds=int(os.getenv("CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+            max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "100000")),
+            max_bytes=int(os.getenv("CACHE_MAX_BYTES", "0")),
+            key_prefix=VECTOR_MODE.lifecycle_prefix
+        )
+        cache_lifecycle.start_background_sweeper(int(os.getenv("CACHE_SWEEP_INTERVAL_SECONDS", "0")))
+    return cache_lifecycle
+
+
+def setup_index(redis_client=None):
+    """
+    Creates the index if it doesn't exist
+    """
     global INDEX_NAME
     global DOC_PREFIX
+    redis_client = redis_client or get_redis_client()
     logger.info(f"Creating index {INDEX_NAME}")
     try:
         # check to see if index exists
         redis_client.ft(INDEX_NAME).info()
         logger.info("Index already exists!")
-    except:
-        # schema
-        schema = (
-            TextField("answer"),
-            TagField("tag"),                       # Tag Field Name
-            VectorField("vector",                  # Vector Field Name
-                "HNSW", {                          # Vector Index Type: FLAT or HNSW
-                    "TYPE": "FLOAT32",             # FLOAT32 or FLOAT64
-                    "DIM": 1536,      # Number of Vector Dimensions
-                    "DISTANCE_METRIC": "COSINE",   # Vector Search Distance Metric
-                }
-            ),
-        )
-        # index Definition
-        definition = IndexDefinition(prefix=[DOC_PREFIX], index_type=IndexType.HASH)
-        # create Index
+        return
+    except ResponseError:
+        pass
+    # schema
+    schema = (
+        TextField("answer"),
+        TagField("tag"),                       # Tag Field Name
+        VectorField("vector",                  # Vector Field Name
+            "HNSW", {                          # Vector Index Type: FLAT or HNSW
+                "TYPE": "FLOAT32",             # FLOAT32 or FLOAT64
+                "DIM": VECTOR_MODE.dimensions,      # Number of Vector Dimensions
+                "DISTANCE_METRIC": "COSINE",   # Vector Search Distance Metric
+            }
+        ),
+    )
+    # index Definition
+    definition = IndexDefinition(prefix=[DOC_PREFIX], index_type=IndexType.HASH)
+    # create Index
+    try:
         redis_client.ft(INDEX_NAME).create_index(fields=schema, definition=definition)
+    except ResponseError as e:
+        # Another container created it since the check
+        if "Index already exists" not in str(e):
+            raise
+        logger.info("Index already exists!")
 
 
-setup_index()
+def ensure_index():
+    """
+    Runs setup_index until it succeeds once in the container. Set SEMANTIC_CACHE_SETUP_INDEX=false
+    when the index is created at deploy time with `python app.py setup-index`.
+    """
+    global index_ready
+    if not index_ready:
+        setup_index(redis_client)
+        index_ready = True
+
 
-def lookup_cache_range(user_question_embedding):
+def lookup_cache_range(user_question_embedding, radius=CACHE_RADIUS):
     """
     Looks up the cache for similar questions based on the provided embedding.
     :param user_question_embedding: The embedding vector for the user's question.
+    :param radius: Maximum cosine distance of a match.
     :return: A list of dictionaries containing the closest matching questions and their embeddings.
     """
-    global redis_client
+    return lookup_cache_range_batch([user_question_embedding], radius)[0]
+
+def lookup_cache_range_batch(user_question_embeddings, radius=CACHE_RADIUS):
+    """
+    Looks up the cache for several questions, sending all the range queries in one pipeline.
+    :param user_question_embeddings: The embedding vectors for the user's questions.
+    :param radius: Maximum cosine distance of a match.
+    :return: For every embedding, a list with the closest cached document, or an empty list.
+    """
     global INDEX_NAME
-    logger.info(f"Looking for question in cache using index: {INDEX_NAME}")
-    
-    question_embedding = np.array(user_question_embedding,dtype=np.float32).tobytes()
-    q = Query('@vector:[VECTOR_RANGE $radius $vec]=>{$YIELD_DISTANCE_AS: score}').paging(0, 1).dialect(2).return_fields("answer","tag", "score")
-    query_params = {
-        "radius": 0.4,
-        "vec": question_embedding
-    }
-    xray_recorder.begin_subsegment('cache_query')
-    response = redis_client.ft(INDEX_NAME).search(q, query_params).docs
-    xray_recorder.end_subsegment()
-    return response
+    redis_client = get_redis_client()
+    logger.info(f"Looking for {len(user_question_embeddings)} questions in cache using index: {INDEX_NAME}")
+
+    # FT.SEARCH is not bound to a key, so the whole batch goes to a single node
+    if isinstance(redis_client, RedisCluster):
+        redis_client = redis_client.get_default_node().redis_connection
+    pipe = redis_client.pipeline(transaction=False)
+    for user_question_embedding in user_question_embeddings:
+        question_embedding = np.array(user_question_embedding,dtype=np.float32).tobytes()
+        pipe.execute_command(
+            "FT.SEARCH", INDEX_NAME, "@vector:[VECTOR_RANGE $radius $vec]=>{$YIELD_DISTANCE_AS: score}",
+            "PARAMS", 4, "radius", radius, "vec", question_embedding,
+            "RETURN", 3, "answer", "tag", "score",
+            "LIMIT", 0, 1,
+            "DIALECT", 2
+        )
+    with stage('cache_query'):
+        replies = pipe.execute()
+    return [parse_search_reply(reply) for reply in replies]
+
+def parse_search_reply(reply):
+    """
+    Converts a raw FT.SEARCH reply ([total, key, [field, value, ...], ...]) into documents.
+    """
+    docs = []
+    for i in range(1, len(reply) - 1, 2):
+        fields = dict(zip(reply[i + 1][::2], reply[i + 1][1::2]))
+        fields = {k.decode("utf-8"): v.decode("utf-8") for k, v in fields.items()}
+        docs.append(Document(reply[i].decode("utf-8"), **fields))
+    return docs
+
+def cache_document_key(user_question):
+    """
+    Returns the key of the cache entry for a question. The key is a digest of the
+    normalized question and the embedding model tag, so it is the same in every container.
+    """
+    return f"{DOC_PREFIX}{question_digest(user_question, namespace=EMBEDDING_TAG)}"
 
 def add_to_cache(user_question,user_question_embedding, answer):
+    """
+    Adds an answer to the cache. A range query within DEDUP_RADIUS runs first, and when
+    a near-identical question was cached since the lookup that missed, for example by a
+    concurrent miss in another container, that entry is refreshed instead of adding a new one.
+    :param user_question: The question asked by the user.
+    :param user_question_embedding: The embedding vector for the user's question.
+    :param answer: The answer to cache.
+    """
     question_embedding = np.array(user_question_embedding,dtype=np.float32).tobytes()
-    key = f'doc:{hash(user_question) % 2**sys.hash_info.width}'
-    xray_recorder.begin_subsegment('add_to_cache')
-    redis_client.hset(key, mapping = {
-        "vector": question_embedding,
-        "answer": answer,
-        "tag": "amazon.titan-embed-text-v1"
-    })
-    xray_recorder.end_subsegment()
+    with stage('add_to_cache'):
+        near_duplicates = lookup_cache_range(user_question_embedding, radius=DEDUP_RADIUS)
+        if near_duplicates:
+            nearest = near_duplicates[0]
+            logger.info(f"Refreshing near-duplicate cache entry {nearest.id}")
+            get_cache_lifecycle().refresh(nearest.id, {
+                "answer": answer,
+                "tag": EMBEDDING_TAG
+            })
+        else:
+            get_cache_lifecycle().insert(cache_document_key(user_question), {
+                "vector": question_embedding,
+                "answer": answer,
+                "tag": EMBEDDING_TAG
+            })
     
 
 def get_embedding(text_content):
     """
-    Generates embeddings for a given piece of text using the Bedrock service.
+    Returns the embedding for a given piece of text, generating it with Bedrock
+    only when it is not already in the embedding store.
+    :param text_content: The text content for which to generate embeddings.
+    :return: Embedding vector.
+    """
+    return get_embeddings([text_content])[0]
+
+
+def get_embeddings(text_contents):
+    """
+    Returns the embeddings for several pieces of text. Embeddings that are not in the
+    embedding store are generated concurrently, since the model embeds one text per call.
+    :param text_contents: The text contents for which to generate embeddings.
+    :return: Embedding vectors in the order of text_contents.
+    """
+    def invoke_concurrently(texts):
+        with ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY) as executor:
+            return list(executor.map(invoke_embedding_model, texts))
+
+    store = get_embedding_store()
+    embeddings = store.get_or_compute_many(EMBEDDING_TAG, text_contents, invoke_concurrently)
+    logger.info(f"Embedding store stats: {json.dumps(store.snapshot())}")
+    return embeddings
+
+
+def invoke_embedding_model(text_content):
+    """
+    Generates embeddings for a given piece of text using the Bedrock service,
+    in the dimensions of the configured vector mode.
     :param text_content: The text content for which to generate embeddings.
     :return: Embedding vector or None if an error occurs.
     """
     try:
-        body_content = json.dumps({"inputText": text_content})
-        response = bedrock_client.invoke_model(
-            body=body_content,
-            contentType="application/json",
-            accept="*/*",
-            modelId="amazon.titan-embed-text-v1"
-        )
-        # Assuming the response content is in JSON format
-        response_body = json.loads(response.get('body').read())
-        embedding = response_body.get('embedding')  # Adjust based on your actual response structure
-        return embedding
+        return VECTOR_MODE.embed(get_bedrock_client(), text_content)
     except Exception as e:
         logger.info(f"Error generating embedding: {e}")
         logger.info(traceback.format_exc())
         raise e
 
 
+def knowledge_base_configuration():
+    """
+    Returns the retrieve and generate configuration for the knowledge base.
+    """
+    return {
+        "knowledgeBaseConfiguration": {
+            "knowledgeBaseId": knowledge_base_id,
+            "modelArn": model_id,
+            "retrievalConfiguration":{
+                'vectorSearchConfiguration': {
+                    'numberOfResults': 5,
+                    'overrideSearchType':'HYBRID'
+                }
+            }
+        },
+        "type": "KNOWLEDGE_BASE"
+    }
+
 def answer_question_with_model(user_question):
     """
     Answers the user's question using a foundation model.
     :param user_question: The question asked by the user.
     :return: The answer provided by the model.
     """
-    global bedrock_agent_runtime
-    response = bedrock_agent_runtime.retrieve_and_generate(
+    response = get_bedrock_agent_runtime().retrieve_and_generate(
         input= {
             'text': user_question
         },
-        retrieveAndGenerateConfiguration={
-            "knowledgeBaseConfiguration": {
-                "knowledgeBaseId": knowledge_base_id,
-                "modelArn": model_id,
-                "retrievalConfiguration":{
-                    'vectorSearchConfiguration': {
-                        'numberOfResults': 5,
-                        'overrideSearchType':'HYBRID'
-                    }
-                }
-            },
-            "type": "KNOWLEDGE_BASE"
-        }
+        retrieveAndGenerateConfiguration=knowledge_base_configuration()
     )
 
     answer = response['output']['text']
     return answer
 
+def stream_answer_with_model(user_question):
+    """
+    Answers the user's question using a foundation model, yielding the text as it is generated.
+    :param user_question: The question asked by the user.
+    :return: Generator of answer text chunks.
+    """
+    response = get_bedrock_agent_runtime().retrieve_and_generate_stream(
+        input= {
+            'text': user_question
+        },
+        retrieveAndGenerateConfiguration=knowledge_base_configuration()
+    )
+    for event in response['stream']:
+        if 'output' in event:
+            yield event['output']['text']
+
+def schedule_cache_write(user_question, user_question_embedding, answer):
+    """
+    Adds the answer to the semantic cache in a background thread, so the response
+    does not wait for the MemoryDB write. Set CACHE_WRITE_BEHIND=false to write synchronously.
+    """
+    global write_behind_executor
+    if not CACHE_WRITE_BEHIND:
+        add_to_cache(user_question,user_question_embedding,answer)
+        return
+    with pending_cache_writes_lock:
+        if write_behind_executor is None:
+            write_behind_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-write-behind")
+        pending_cache_writes.append(
+            write_behind_executor.submit(add_to_cache, user_question, user_question_embedding, answer)
+        )
+
+def flush_cache_writes(timeout=None):
+    """
+    Waits for the pending cache writes. Lambda freezes the container, and the writer
+    thread with it, once a response is returned, so writes left over from the previous
+    invocation are completed at the start of the next one.
+    :param timeout: Maximum number of seconds to wait.
+    """
+    global pending_cache_writes
+    with pending_cache_writes_lock:
+        futures = pending_cache_writes
+        pending_cache_writes = []
+    if not futures:
+        return
+    done, not_done = wait(futures, timeout=timeout)
+    for future in done:
+        if future.exception() is not None:
+            logger.warning(f"Write-behind cache write failed: {future.exception()}")
+    with pending_cache_writes_lock:
+        pending_cache_writes.extend(not_done)
+
+def generate_and_cache_answer(user_question, user_question_embedding):
+    """
+    Answers the question with the model and adds the answer to the semantic cache.
+    :param user_question: The question asked by the user.
+    :param user_question_embedding: The embedding vector for the user's question.
+    :return: The answer provided by the model.
+    """
+    with stage('answer_question_with_model'):
+        answer = answer_question_with_model(user_question)
+    logger.info("Adding response to cache")
+    schedule_cache_write(user_question,user_question_embedding,answer)
+    return answer
+
+def find_cached_answers(user_questions):
+    """
+    Looks the questions up in the local cache and then in the semantic cache.
+    Embeddings and cache lookups are batched for the questions missing locally.
+    :param user_questions: The questions asked by the user.
+    :return: Tuple of (answers by question key, questions by key for the keys not found locally,
+             embeddings by key, the keys missing from both caches).
+    """
+    answers = {}
+    pending = {}
+    embeddings = {}
+    misses = []
+    for user_question in user_questions:
+        question_key = question_digest(user_question)
+        if question_key in answers or question_key in pending:
+            continue
+        answer = local_answer_cache.get(question_key)
+        if answer is not None:
+            logger.info("Using a locally cached answer")
+            record_cache_outcome("l1")
+            answers[question_key] = answer
+        else:
+            pending[question_key] = user_question
+
+    if pending:
+        logger.info("Getting embedding")
+        with stage('get_user_question_embedding'):
+            embeddings = dict(zip(pending, get_embeddings(list(pending.values()))))
+        for question_key, cache_hits in zip(pending, lookup_cache_range_batch(list(embeddings.values()))):
+            if len(cache_hits) > 0 and cache_hits[0]['answer'] is not None:
+                logger.info("Using a cached answer")
+                answers[question_key] = cache_hits[0]['answer']
+                record_cache_outcome("l2", cache_hits[0]['score'])
+                get_cache_lifecycle().record_hit(cache_hits[0].id)
+            else:
+                record_cache_outcome("miss")
+                misses.append(question_key)
+    return answers, pending, embeddings, misses
+
+def answer_questions(user_questions):
+    """
+    Answers several questions, going through the local cache, the semantic cache and
+    finally the model. The model is only called for the misses, with bounded parallelism.
+    :param user_questions: The questions asked by the user.
+    :return: The answers in the order of user_questions.
+    """
+    answers, pending, embeddings, misses = find_cached_answers(user_questions)
+
+    def answer_miss(question_key):
+        user_question = pending[question_key]
+        answer, role = get_single_flight().do(
+            question_key,
+            lambda: generate_and_cache_answer(user_question, embeddings[question_key])
+        )
+        logger.info(f"Answer obtained as single-flight {role}")
+        metrics.increment(f"single_flight_{role}")
+        return answer
+
+    if len(misses) == 1:
+        question_key = misses[0]
+        answers[question_key] = answer_miss(question_key)
+    elif misses:
+        with ThreadPoolExecutor(max_workers=GENERATION_CONCURRENCY) as executor:
+            answers.update(zip(misses, executor.map(answer_miss, misses)))
+    for question_key in pending:
+        local_answer_cache.put(question_key, answers[question_key])
+    logger.info(f"Cache stats: {json.dumps(cache_stats.snapshot())}")
+    return [answers[question_digest(user_question)] for user_question in user_questions]
+
+def stream_question(user_question):
+    """
+    Answers a question as a stream of text chunks, for the streaming front end of
+    stream_server.py. A cached answer is yielded at once. On a miss the single-flight
+    leader forwards the model output as it arrives and writes the gathered answer to
+    the cache after the stream ends, off the critical path; concurrent callers for the
+    same question get the leader's answer at once.
+    :param user_question: The question asked by the user.
+    :return: Generator of answer text chunks.
+    """
+    answers, pending, embeddings, misses = find_cached_answers([user_question])
+    question_key = question_digest(user_question)
+    if not misses:
+        yield answers[question_key]
+        return
+
+    stream, role = get_single_flight().do_stream(
+        question_key,
+        lambda: stream_answer_with_model(user_question)
+    )
+    logger.info(f"Answer streamed as single-flight {role}")
+    metrics.increment(f"single_flight_{role}")
+    chunks = []
+    with stage('stream_answer_with_model'):
+        for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+    answer = "".join(chunks)
+    local_answer_cache.put(question_key, answer)
+    if role != "follower":
+        logger.info("Adding streamed response to cache")
+        schedule_cache_write(user_question, embeddings[question_key], answer)
+
 def lambda_handler(event, context):
+    if event.get("source") == "aws.events":
+        # The scheduled sweep shares the function, see the cache_sweep rule in main.tf
+        return sweep_handler(event, context)
+    try:
+        with metrics.timer('request'):
+            return handle_request(event)
+    finally:
+        metrics.flush()
+
+def is_question(value):
+    """
+    Returns whether a request value is a question that can be answered.
+    """
+    return isinstance(value, str) and value.strip() != ""
+
+def handle_request(event):
     logger.info("Recieved new request")
     #logger.info(f"Event: {json.dumps(event['requestContext'])}")
     response_lambda = {
@@ -166,31 +599,50 @@ def lambda_handler(event, context):
             'Access-Control-Allow-Headers': '*'
         }
     }
-    body = event.get("body")
-    
-    body = json.loads(body)
-    user_question = body['question']
-
-    answer = None
-    logger.info("Getting embedding")
-    xray_recorder.begin_subsegment('get_user_question_embedding')
-    user_question_embedding = get_embedding(user_question)
-    xray_recorder.end_subsegment()
-    cache_hits = lookup_cache_range(user_question_embedding)
-    if len(cache_hits) > 0:
-        if cache_hits[0]['answer'] is not None:
-            logger.info("Using a cached answer")
-            answer = cache_hits[0]['answer']
-
-    if answer is None:
-        xray_recorder.begin_subsegment('answer_question_with_model')
-        answer = answer_question_with_model(user_question)
-        xray_recorder.end_subsegment()
-        logger.info("Adding response to cache")
-        add_to_cache(user_question,user_question_embedding,answer)
-        
+    flush_cache_writes()
+    try:
+        body = json.loads(event.get("body") or "null")
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        response_lambda['statusCode'] = 400
+        response_lambda['body'] = json.dumps({"error": "the body must be a JSON object"})
+        return response_lambda
+
+    if 'questions' in body:
+        user_questions = body['questions']
+        if (not isinstance(user_questions, list) or len(user_questions) > MAX_BATCH_QUESTIONS
+                or not all(is_question(user_question) for user_question in user_questions)):
+            response_lambda['statusCode'] = 400
+            response_lambda['body'] = json.dumps({"error": f"questions must be a list of at most {MAX_BATCH_QUESTIONS} non-empty strings"})
+            return response_lambda
+        answers = answer_questions(user_questions)
+        response_lambda['statusCode'] = 200
+        response_lambda['body'] = json.dumps({"answers":answers})
+        return response_lambda
+
+    user_question = body.get('question')
+    if not is_question(user_question):
+        response_lambda['statusCode'] = 400
+        response_lambda['body'] = json.dumps({"error": "question must be a non-empty string"})
+        return response_lambda
+    answer = answer_questions([user_question])[0]
+
     response_lambda['statusCode'] = 200
     response_lambda['body'] = json.dumps({"answer":answer})    
     return response_lambda
 
 
+def sweep_handler(event, context):
+    """
+    Entry point for a scheduled sweep of the semantic cache. The EventBridge rule of main.tf
+    invokes lambda_handler, which forwards its events here.
+    """
+    return get_cache_lifecycle().sweep()
+
+
+if __name__ == "__main__":
+    # One-time deploy step: python app.py setup-index
+    if sys.argv[1:] == ["setup-index"]:
+        index_ready = True
+        setup_index()
@@ -0,0 +1,197 @@
+import logging
+import threading
+import time
+import uuid
+
+from single_flight import RELEASE_SCRIPT
+
+logger = logging.getLogger(__name__)
+
+
+class CacheLifecycle:
+    """
+    Keeps the semantic cache bounded.
+
+    Every entry gets a TTL when it is written. Hits are counted in a sorted set
+    (member: entry key, score: hits) and the size of every entry is tracked in a
+    hash. A sweeper drops the tracking of expired entries and evicts the least
+    frequently used entries while the entry count or byte budget is exceeded.
+    """
+
+    def __init__(self, client, index_name, ttl_seconds=7 * 24 * 3600, max_entries=100000, max_bytes=0,
+                 key_prefix="semantic_cache:", batch_size=500):
+        """
+        :param client: MemoryDB client.
+        :param index_name: Name of the vector index over the cache entries.
+        :param ttl_seconds: Expiry of every entry, 0 to keep entries until evicted.
+        :param max_entries: Maximum number of entries, 0 for no limit.
+        :param max_bytes: Maximum approximate size of the entries in bytes, 0 for no limit.
+        """
+        self.client = client
+        self.index_name = index_name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.lfu_key = f"{key_prefix}lfu"
+        self.sizes_key = f"{key_prefix}sizes"
+        self.stats_key = f"{key_prefix}stats"
+        self.sweep_lock_key = f"{key_prefix}sweep_lock"
+        self._sweeper = None
+
+    def insert(self, key, mapping):
+        """
+        Writes a cache entry with its TTL and starts tracking it.
+        """
+        size = sum(len(k) + len(v if isinstance(v, bytes) else str(v).encode("utf-8")) for k, v in mapping.items())
+        pipe = self.client.pipeline()
+        pipe.hset(key, mapping=mapping)
+        if self.ttl_seconds > 0:
+            pipe.expire(key, self.ttl_seconds)
+        pipe.zadd(self.lfu_key, {key: 0}, nx=True)
+        pipe.hset(self.sizes_key, key, size)
+        pipe.execute()
+
+    def refresh(self, key, mapping):
+        """
+        Updates fields of an existing entry and restarts its TTL, keeping its hit count.
+        """
+        pipe = self.client.pipeline()
+        pipe.hset(key, mapping=mapping)
+        if self.ttl_seconds > 0:
+            pipe.expire(key, self.ttl_seconds)
+        pipe.execute()
+
+    def record_hit(self, key):
+        """
+        Counts a cache hit for the entry.
+        """
+        try:
+            self.client.zincrby(self.lfu_key, 1, key)
+        except Exception as e:
+            logger.warning(f"Failed to record cache hit: {e}")
+
+    def _forget(self, keys):
+        pipe = self.client.pipeline()
+        pipe.zrem(self.lfu_key, *keys)
+        pipe.hdel(self.sizes_key, *keys)
+        pipe.execute()
+
+    def _prune_expired(self):
+        """
+        Stops tracking entries that expired since the last sweep.
+        :return: Number of expired entries.
+        """
+        expired = 0
+        cursor = 0
+        while True:
+            cursor, members = self.client.zscan(self.lfu_key, cursor, count=self.batch_size)
+            keys = [member for member, _ in members]
+            if keys:
+                pipe = self.client.pipeline()
+                for key in keys:
+                    pipe.exists(key)
+                missing = [key for key, exists in zip(keys, pipe.execute()) if not exists]
+                if missing:
+                    self._forget(missing)
+                    expired += len(missing)
+            if cursor == 0:
+                return expired
+
+    def _evict(self, entries, used_bytes):
+        """
+        Deletes the least frequently used entries until both budgets are met. Candidates
+        are read batch_size at a time in LFU order, and only the ones needed to get back
+        under the budgets are deleted.
+        :return: Tuple of (number of evicted entries, bytes left).
+        """
+        evicted = 0
+        while self._over_budget(entries, used_bytes):
+            candidates = self.client.zrange(self.lfu_key, 0, self.batch_size - 1)
+            if not candidates:
+                break
+            keys = []
+            for key, size in zip(candidates, self.client.hmget(self.sizes_key, candidates)):
+                if not self._over_budget(entries, used_bytes):
+                    break
+                keys.append(key)
+                entries -= 1
+                used_bytes -= int(size or 0)
+            pipe = self.client.pipeline()
+            for key in keys:
+                pipe.delete(key)
+            pipe.execute()
+            self._forget(keys)
+            evicted += len(keys)
+        return evicted, used_bytes
+
+    def _over_budget(self, entries, used_bytes):
+        return bool((self.max_entries and entries > self.max_entries)
+                    or (self.max_bytes and used_bytes > self.max_bytes))
+
+    def sweep(self):
+        """
+        Runs one sweep. Only one sweeper at a time does the work across all containers.
+        :return: Dictionary with the index size and eviction statistics, or None if another sweep is running.
+        """
+        token = uuid.uuid4().hex
+        if not self.client.set(self.sweep_lock_key, token, nx=True, ex=300):
+            return None
+        try:
+            started = time.time()
+            expired = self._prune_expired()
+            entries = self.client.zcard(self.lfu_key)
+            used_bytes = sum(int(size) for size in self.client.hvals(self.sizes_key))
+            evicted, used_bytes = self._evict(entries, used_bytes)
+
+            last_sweep = self.client.hget(self.stats_key, "last_sweep")
+            elapsed = started - float(last_sweep) if last_sweep else 0
+            pipe = self.client.pipeline()
+            pipe.hincrby(self.stats_key, "evictions", evicted)
+            pipe.hincrby(self.stats_key, "expirations", expired)
+            pipe.hset(self.stats_key, "last_sweep", started)
+            pipe.execute()
+
+            report = {
+                "index_num_docs": self.index_size(),
+                "tracked_entries": entries - evicted,
+                "tracked_bytes": used_bytes,
+                "evicted": evicted,
+                "expired": expired,
+                "evictions_per_second": evicted / elapsed if elapsed > 0 else 0.0,
+                "sweep_seconds": time.time() - started,
+            }
+            logger.info(f"Cache sweep: {report}")
+            return report
+        finally:
+            self.client.eval(RELEASE_SCRIPT, 1, self.sweep_lock_key, token)
+
+    def index_size(self):
+        """
+        Returns the number of documents in the vector index, or None if it cannot be read.
+        """
+        try:
+            info = self.client.ft(self.index_name).info()
+            return int(info.get("num_docs", info.get(b"num_docs", 0)))
+        except Exception as e:
+            logger.warning(f"Failed to read index info: {e}")
+            return None
+
+    def start_background_sweeper(self, interval_seconds):
+        """
+        Starts a daemon thread running a sweep every interval_seconds. In Lambda the
+        thread only runs while the container is processing requests.
+        """
+        if self._sweeper is not None or interval_seconds <= 0:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    self.sweep()
+                except Exception as e:
+                    logger.warning(f"Cache sweep failed: {e}")
+
+        self._sweeper = threading.Thread(target=run, name="semantic-cache-sweeper", daemon=True)
+        self._sweeper.start()
@@ -0,0 +1,116 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_question(text):
+    """
+    Normalizes a question so trivially different spellings share a cache entry.
+    :param text: The raw user question.
+    :return: The lower-cased question with collapsed whitespace.
+    """
+    return " ".join(text.lower().split())
+
+
+def question_digest(text, namespace=""):
+    """
+    Returns a stable hex digest of the normalized question.
+    :param text: The raw user question.
+    :param namespace: Optional prefix hashed with the question, for example a model tag.
+    :return: SHA-256 hex digest of the normalized question.
+    """
+    payload = f"{namespace}\n{normalize_question(text)}" if namespace else normalize_question(text)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LocalAnswerCache:
+    """
+    Bounded in-process LRU cache with a per-entry TTL.
+
+    Lives for the lifetime of a warm Lambda container and sits in front of the
+    semantic cache in MemoryDB, so repeated questions skip both the embedding
+    call and the vector search.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None when missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """
+        Stores value under key, evicting the least recently used entry when full.
+        """
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CacheStats:
+    """
+    Counts L1 (in-process) and L2 (MemoryDB) hits for the lifetime of the container.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, tier):
+        """
+        Records the outcome of one question.
+        :param tier: One of "l1", "l2" or "miss".
+        """
+        with self._lock:
+            self.requests += 1
+            if tier == "l1":
+                self.l1_hits += 1
+            elif tier == "l2":
+                self.l2_hits += 1
+            else:
+                self.misses += 1
+
+    def snapshot(self):
+        """
+        Returns the counters and hit ratios as a dictionary.
+        L2 hit ratio is relative to the requests that reached L2.
+        """
+        with self._lock:
+            l2_requests = self.requests - self.l1_hits
+            return {
+                "requests": self.requests,
+                "l1_hits": self.l1_hits,
+                "l2_hits": self.l2_hits,
+                "misses": self.misses,
+                "l1_hit_ratio": self.l1_hits / self.requests if self.requests else 0.0,
+                "l2_hit_ratio": self.l2_hits / l2_requests if l2_requests else 0.0,
+                # Every L1 hit saves one Bedrock embedding call and one FT.SEARCH
+                "embedding_calls_saved": self.l1_hits,
+                "searches_saved": self.l1_hits,
+            }
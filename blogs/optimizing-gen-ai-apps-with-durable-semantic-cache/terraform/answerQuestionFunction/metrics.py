@@ -0,0 +1,165 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets grow by 10% from 0.1 ms to about 2 minutes, score buckets are 0.01 wide
+LATENCY_BOUNDS_MS = [0.1 * 1.1 ** i for i in range(150)]
+SCORE_BOUNDS = [round(0.01 * i, 2) for i in range(1, 201)]
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram. Recording a value is a binary search and a counter
+    increment, and percentiles are read from the bucket counts.
+    """
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def _bucket_value(self, i):
+        # Upper bound of the bucket, clamped to the observed range
+        value = self.bounds[i] if i < len(self.bounds) else self.max
+        return min(max(value, self.min), self.max)
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return self._bucket_value(i)
+        return self.max
+
+    def values_and_counts(self):
+        """
+        Returns the non-empty buckets as parallel value and count lists, the
+        histogram representation of the CloudWatch embedded metric format.
+        """
+        buckets = [(self._bucket_value(i), count) for i, count in enumerate(self.counts) if count]
+        return [value for value, _ in buckets], [count for _, count in buckets]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+def emf_stdout_sink(record):
+    """
+    Prints the record as a CloudWatch embedded metric format log line.
+    """
+    print(json.dumps(record))
+
+
+class Metrics:
+    """
+    Per-stage latency histograms, counters and value distributions.
+
+    Values recorded since the last flush are sent to the sink as one embedded
+    metric format (EMF) record, from which CloudWatch derives the percentiles.
+    Histograms covering the whole life of the container are kept as well, for
+    summary() and local runs.
+    """
+
+    def __init__(self, namespace, dimensions=None, sink=emf_stdout_sink):
+        """
+        :param namespace: CloudWatch metrics namespace.
+        :param dimensions: Dictionary of dimension names and values added to every record.
+        :param sink: Callable receiving every flushed record, or None to only keep the summaries.
+        """
+        self.namespace = namespace
+        self.dimensions = dimensions or {}
+        self.sink = sink
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._counters = {}
+        self._totals = {}
+        self._units = {}
+
+    def _record(self, name, value, bounds, unit):
+        with self._lock:
+            if name not in self._pending:
+                self._pending[name] = Histogram(bounds)
+                self._units[name] = unit
+            if name not in self._totals:
+                self._totals[name] = Histogram(bounds)
+            self._pending[name].record(value)
+            self._totals[name].record(value)
+
+    def record_latency(self, stage, milliseconds):
+        self._record(f"{stage}_ms", milliseconds, LATENCY_BOUNDS_MS, "Milliseconds")
+
+    def observe(self, name, value, bounds=SCORE_BOUNDS, unit="None"):
+        """
+        Records a value in the distribution of name, for example a similarity score.
+        """
+        self._record(name, value, bounds, unit)
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+            self._units[name] = "Count"
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        Records the duration of the block in the latency histogram of stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_latency(stage, (time.perf_counter() - start) * 1000)
+
+    def flush(self):
+        """
+        Sends the values recorded since the last flush to the sink.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            counters, self._counters = self._counters, {}
+            units = dict(self._units)
+        if self.sink is None or not (pending or counters):
+            return
+        record = dict(self.dimensions)
+        record["_aws"] = {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": self.namespace,
+                "Dimensions": [list(self.dimensions)],
+                "Metrics": [{"Name": name, "Unit": units[name]} for name in list(pending) + list(counters)],
+            }],
+        }
+        for name, histogram in pending.items():
+            values, counts = histogram.values_and_counts()
+            record[name] = {"Values": values, "Counts": counts, "Min": histogram.min,
+                            "Max": histogram.max, "Sum": histogram.total, "Count": histogram.count}
+        record.update(counters)
+        self.sink(record)
+
+    def summary(self):
+        """
+        Returns p50/p95/p99 of every histogram over the life of the container.
+        """
+        with self._lock:
+            return {name: histogram.summary() for name, histogram in self._totals.items()}
@@ -0,0 +1,3 @@
+#!/bin/bash
+# Entry point of the streaming function, started by the Lambda Web Adapter
+exec python3 stream_server.py
@@ -0,0 +1,150 @@
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Publishes the result and releases the lock only if it is still owned by the caller.
+# Both keys share a hash tag, so the script runs on a single shard.
+PUBLISH_AND_RELEASE_SCRIPT = """
+redis.call('set', KEYS[2], ARGV[2], 'PX', ARGV[3])
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    Distributed single-flight on top of MemoryDB.
+
+    The first caller for a key takes a short-lived lock and computes the value.
+    Concurrent callers poll for the published result instead of computing it
+    again. If the leader crashes, its lock expires and a waiter takes over, and a
+    waiter that cannot get a result before wait_timeout_ms computes the value itself.
+    """
+
+    def __init__(self, client, key_prefix="sf:", lock_ttl_ms=15000, result_ttl_ms=30000,
+                 wait_timeout_ms=15000, poll_interval_ms=50, max_poll_interval_ms=500):
+        self.client = client
+        self.key_prefix = key_prefix
+        self.lock_ttl_ms = lock_ttl_ms
+        self.result_ttl_ms = result_ttl_ms
+        self.wait_timeout_ms = wait_timeout_ms
+        self.poll_interval_ms = poll_interval_ms
+        self.max_poll_interval_ms = max_poll_interval_ms
+
+    def _keys(self, key):
+        return f"{self.key_prefix}{{{key}}}:lock", f"{self.key_prefix}{{{key}}}:result"
+
+    def _try_acquire(self, lock_key, token):
+        try:
+            return bool(self.client.set(lock_key, token, nx=True, px=self.lock_ttl_ms))
+        except Exception as e:
+            # Without the lock service every caller simply computes its own value
+            logger.warning(f"Single-flight lock unavailable: {e}")
+            return True
+
+    def _release(self, lock_key, token):
+        try:
+            self.client.eval(RELEASE_SCRIPT, 1, lock_key, token)
+        except Exception as e:
+            logger.warning(f"Failed to release single-flight lock: {e}")
+
+    def _publish(self, lock_key, result_key, token, value):
+        try:
+            self.client.eval(PUBLISH_AND_RELEASE_SCRIPT, 2, lock_key, result_key,
+                             token, value, self.result_ttl_ms)
+        except Exception as e:
+            logger.warning(f"Failed to publish single-flight result: {e}")
+
+    def _lead(self, lock_key, result_key, token, compute):
+        try:
+            value = compute()
+        except Exception:
+            self._release(lock_key, token)
+            raise
+        self._publish(lock_key, result_key, token, value)
+        return value
+
+    def _lead_stream(self, lock_key, result_key, token, stream):
+        chunks = []
+        try:
+            for chunk in stream():
+                chunks.append(chunk)
+                yield chunk
+        except (Exception, GeneratorExit):
+            # Also raised when the consumer stops reading, so a waiter takes over
+            self._release(lock_key, token)
+            raise
+        self._publish(lock_key, result_key, token, "".join(chunks))
+
+    def _acquire_or_follow(self, lock_key, result_key, token):
+        """
+        Takes the lock, or polls for the result of the current leader.
+        :return: Tuple of (role, value), where value is the published result for a
+                 "follower" and None when the caller became the "leader" or must
+                 compute the value itself ("fallback").
+        """
+        if self._try_acquire(lock_key, token):
+            return "leader", None
+        deadline = time.monotonic() + self.wait_timeout_ms / 1000
+        interval = self.poll_interval_ms
+        while time.monotonic() < deadline:
+            time.sleep(interval / 1000)
+            interval = min(interval * 2, self.max_poll_interval_ms)
+            try:
+                result = self.client.get(result_key)
+                if result is not None:
+                    return "follower", result.decode("utf-8") if isinstance(result, bytes) else result
+            except Exception as e:
+                logger.warning(f"Single-flight poll failed: {e}")
+                break
+            # The leader failed or its lock expired without a result, so take over
+            if self._try_acquire(lock_key, token):
+                return "leader", None
+        return "fallback", None
+
+    def do(self, key, compute):
+        """
+        Returns the value for key, computing it at most once across concurrent callers.
+        :param key: Stable identifier of the work, for example the question digest.
+        :param compute: Callable returning the value as a string.
+        :return: Tuple of (value, role) where role is "leader", "follower" or "fallback".
+        """
+        lock_key, result_key = self._keys(key)
+        token = uuid.uuid4().hex
+        role, value = self._acquire_or_follow(lock_key, result_key, token)
+        if role == "leader":
+            return self._lead(lock_key, result_key, token, compute), role
+        if role == "fallback":
+            logger.info(f"Single-flight wait timed out for {key}, computing locally")
+            return compute(), role
+        return value, role
+
+    def do_stream(self, key, stream):
+        """
+        Like do, for a value produced as a stream of string chunks. The leader gets the
+        chunks as they arrive and publishes their concatenation once the stream ends,
+        while a follower gets the published value as a single chunk.
+        :param key: Stable identifier of the work, for example the question digest.
+        :param stream: Callable returning an iterator of string chunks.
+        :return: Tuple of (chunk iterator, role) where role is "leader", "follower" or "fallback".
+        """
+        lock_key, result_key = self._keys(key)
+        token = uuid.uuid4().hex
+        role, value = self._acquire_or_follow(lock_key, result_key, token)
+        if role == "leader":
+            return self._lead_stream(lock_key, result_key, token, stream), role
+        if role == "fallback":
+            logger.info(f"Single-flight wait timed out for {key}, streaming locally")
+            return stream(), role
+        return iter([value]), role
@@ -0,0 +1,84 @@
+"""
+HTTP front end streaming the answers of stream_question.
+
+The Python Lambda runtime returns a response only once the handler returns, so the
+streaming function of main.tf runs this server behind the Lambda Web Adapter
+instead (run.sh). The adapter forwards the requests of the function URL, whose
+invoke mode is RESPONSE_STREAM, and streams the chunked response back as it is
+written.
+
+    POST /  {"question": "..."}  ->  the answer as chunked text/plain
+"""
+import json
+import logging
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app import flush_cache_writes, is_question, metrics, stream_question
+
+logger = logging.getLogger()
+
+
+class StreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        # Readiness check of the Lambda Web Adapter
+        self.send_json(200, {"status": "ok"})
+
+    def do_POST(self):
+        try:
+            with metrics.timer('request'):
+                self.answer()
+        finally:
+            metrics.flush()
+
+    def answer(self):
+        flush_cache_writes()
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"null")
+        except ValueError:
+            body = None
+        user_question = body.get("question") if isinstance(body, dict) else None
+        if not is_question(user_question):
+            self.send_json(400, {"error": "question must be a non-empty string"})
+            return
+
+        chunks = stream_question(user_question)
+        # The first chunk is read before the status is sent, so a failure before any
+        # text is generated is still reported as a 500
+        try:
+            first = next(chunks, "")
+        except Exception as e:
+            logger.exception(f"Error answering the question: {e}")
+            self.send_json(500, {"error": "An error occurred"})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            self.write_chunk(first)
+            for chunk in chunks:
+                self.write_chunk(chunk)
+        finally:
+            chunks.close()
+            self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, text):
+        data = text.encode("utf-8")
+        if data:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+if __name__ == "__main__":
+    ThreadingHTTPServer(("127.0.0.1", int(os.getenv("PORT", "8080"))), StreamHandler).serve_forever()
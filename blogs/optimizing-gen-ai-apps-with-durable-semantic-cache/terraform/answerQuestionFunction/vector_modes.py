@@ -0,0 +1,107 @@
+import json
+
+import numpy as np
+
+TITAN_V1 = "amazon.titan-embed-text-v1"
+TITAN_V2 = "amazon.titan-embed-text-v2:0"
+TITAN_V1_DIMENSIONS = 1536
+PROJECTION_SEED = 1536
+
+
+class VectorMode:
+    """
+    How the semantic cache embeds questions and stores their vectors.
+
+    A mode either asks Titan Text Embeddings v2 for a smaller output size, or
+    projects Titan v1 embeddings to fewer dimensions on the client with a fixed,
+    seeded random projection (which approximately preserves cosine distances).
+    Every mode has its own index and key prefix, since the vector dimensions of
+    an index cannot change. The key prefixes must not start with one another, or an
+    index would also pick up the hashes of another mode. Every mode also keeps its
+    own eviction tracking (lifecycle_prefix), so one mode cannot evict the entries
+    of another.
+    """
+
+    def __init__(self, name, model_id, dimensions, request_dimensions=None, projection=False,
+                 index_name=None, doc_prefix=None, lifecycle_prefix=None):
+        self.name = name
+        self.model_id = model_id
+        self.dimensions = dimensions
+        self.request_dimensions = request_dimensions
+        self.projection = projection
+        self.index_name = index_name or f"bedrock-{name}"
+        self.doc_prefix = doc_prefix or f"doc-{name}:"
+        self.lifecycle_prefix = lifecycle_prefix or f"semantic_cache:{name}:"
+        self._projection_matrix = None
+
+    @property
+    def tag(self):
+        """
+        Identifies the vectors produced by this mode, for cache tags and embedding store keys.
+        """
+        if self.projection:
+            return f"{self.model_id}/projection-{self.dimensions}"
+        if self.request_dimensions:
+            return f"{self.model_id}/{self.request_dimensions}"
+        return self.model_id
+
+    @property
+    def bytes_per_vector(self):
+        return self.dimensions * np.dtype(np.float32).itemsize
+
+    def request_body(self, text):
+        body = {"inputText": text}
+        if self.request_dimensions:
+            body["dimensions"] = self.request_dimensions
+            body["normalize"] = True
+        return json.dumps(body)
+
+    def transform(self, embedding):
+        """
+        Converts the model output into the stored vector.
+        """
+        if not self.projection:
+            return embedding
+        if self._projection_matrix is None:
+            rng = np.random.default_rng(PROJECTION_SEED)
+            self._projection_matrix = (
+                rng.standard_normal((TITAN_V1_DIMENSIONS, self.dimensions)) / np.sqrt(self.dimensions)
+            ).astype(np.float32)
+        return (np.asarray(embedding, dtype=np.float32) @ self._projection_matrix).tolist()
+
+    def embed(self, bedrock_client, text):
+        """
+        Embeds text with the Bedrock Runtime client and returns the stored vector.
+        """
+        response = bedrock_client.invoke_model(
+            body=self.request_body(text),
+            contentType="application/json",
+            accept="*/*",
+            modelId=self.model_id
+        )
+        response_body = json.loads(response.get('body').read())
+        return self.transform(response_body.get('embedding'))
+
+
+# The default mode keeps the original index and keys
+VECTOR_MODES = {
+    mode.name: mode for mode in (
+        VectorMode("titan-v1", TITAN_V1, TITAN_V1_DIMENSIONS, index_name="bedrock", doc_prefix="doc:",
+                   lifecycle_prefix="semantic_cache:"),
+        VectorMode("titan-v2-1024", TITAN_V2, 1024, request_dimensions=1024),
+        VectorMode("titan-v2-512", TITAN_V2, 512, request_dimensions=512),
+        VectorMode("titan-v2-256", TITAN_V2, 256, request_dimensions=256),
+        VectorMode("projection-512", TITAN_V1, 512, projection=True),
+        VectorMode("projection-256", TITAN_V1, 256, projection=True),
+    )
+}
+
+
+def get_vector_mode(name):
+    """
+    Returns the vector mode with the given name.
+    :raises ValueError: If the mode does not exist.
+    """
+    if name not in VECTOR_MODES:
+        raise ValueError(f"Unknown vector mode {name}, expected one of {', '.join(VECTOR_MODES)}")
+    return VECTOR_MODES[name]
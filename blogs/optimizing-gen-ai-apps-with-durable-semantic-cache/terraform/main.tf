@@ -142,12 +142,14 @@ module "lambda" {
                 "Effect": "Allow",
                 "Action": [
                     "bedrock:InvokeModel",
+                    "bedrock:InvokeModelWithResponseStream",
                     "bedrock:RetrieveAndGenerate",
                     "bedrock:Retrieve"
                 ],
                 "Resource": [
                   "arn:aws:bedrock:${local.region}::foundation-model/anthropic.claude-3-sonnet-20240229-v1:0",
                   "arn:aws:bedrock:${local.region}::foundation-model/amazon.titan-embed-text-v1",
+                  "arn:aws:bedrock:${local.region}::foundation-model/amazon.titan-embed-text-v2:0",
                   "arn:aws:bedrock:${local.region}:${data.aws_caller_identity.current.account_id}:knowledge-base/*"
                 ]
             },
@@ -172,6 +174,50 @@ module "lambda" {
 
 }
 
+# Streams the answers through a function URL in RESPONSE_STREAM mode. The Python
+# runtime cannot stream a handler response, so the Lambda Web Adapter layer runs
+# run.sh, the HTTP server of stream_server.py, and streams what it writes. The
+# function shares the code and the role of the function above.
+module "lambda_stream" {
+  source = "terraform-aws-modules/lambda/aws"
+
+  environment_variables = {
+    "KNOWLEDGE_BASE_ID" : aws_bedrockagent_knowledge_base.docs_small.id
+    "PERISTENT_SEMANTIC_CACHE_ENDPOINT" : aws_memorydb_cluster.semantic_cache_cluster.cluster_endpoint[0].address
+    "AWS_LAMBDA_EXEC_WRAPPER" : "/opt/bootstrap"
+    "AWS_LWA_INVOKE_MODE" : "response_stream"
+    "PORT" : "8080"
+    # The server runs outside the handler, where there is no X-Ray segment to trace in
+    "AWS_XRAY_SDK_ENABLED" : "false"
+  }
+  function_name = "answer-question-stream-function-${random_string.random.result}"
+  description   = "Example function to stream answers from a knowledge base"
+  handler       = "run.sh"
+  runtime       = "python3.11"
+  layers = [
+    "arn:aws:lambda:us-east-1:336392948345:layer:AWSSDKPandas-Python311:12",
+    "arn:aws:lambda:us-east-1:753240598075:layer:LambdaAdapterLayerX86:23"
+  ]
+
+  source_path = "./answerQuestionFunction"
+
+  vpc_subnet_ids                     = module.vpc.private_subnets
+  vpc_security_group_ids             = [aws_security_group.semantic_cache_sg.id]
+  replace_security_groups_on_destroy = true
+  replacement_security_group_ids     = [aws_security_group.semantic_cache_sg.id]
+  timeout                            = 60
+
+  create_role = false
+  lambda_role = module.lambda.lambda_role_arn
+
+  create_lambda_function_url = true
+  authorization_type         = "AWS_IAM"
+  invoke_mode                = "RESPONSE_STREAM"
+
+  code_signing_config_arn = aws_lambda_code_signing_config.this.arn
+
+}
+
 resource "aws_lambda_code_signing_config" "this" {
   allowed_publishers {
     signing_profile_version_arns = [aws_signer_signing_profile.this.arn]
@@ -187,6 +233,29 @@ resource "aws_signer_signing_profile" "this" {
   platform_id = "AWSLambda-SHA384-ECDSA"
 }
 
+################################################################################
+# Cache sweep
+################################################################################
+
+resource "aws_cloudwatch_event_rule" "cache_sweep" {
+  name                = "semantic-cache-sweep-${random_string.random.result}"
+  description         = "Evicts expired and least frequently used semantic cache entries"
+  schedule_expression = "rate(1 minute)"
+}
+
+resource "aws_cloudwatch_event_target" "cache_sweep" {
+  rule = aws_cloudwatch_event_rule.cache_sweep.name
+  arn  = module.lambda.lambda_function_arn
+}
+
+resource "aws_lambda_permission" "cache_sweep" {
+  statement_id  = "AllowEventBridgeInvoke"
+  action        = "lambda:InvokeFunction"
+  function_name = module.lambda.lambda_function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.cache_sweep.arn
+}
+
 ################################################################################
 # API Gateway
 ################################################################################
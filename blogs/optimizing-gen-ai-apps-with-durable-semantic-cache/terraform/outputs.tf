@@ -28,6 +28,11 @@ output "api_id" {
   value       = aws_api_gateway_rest_api.chat_api.id
 }
 
+output "stream_function_url" {
+  description = "Function URL streaming the answers"
+  value       = module.lambda_stream.lambda_function_url
+}
+
 output "resource_random_id" {
   description = "ID appended to resources"
   value       = random_string.random.result
@@ -14,6 +14,7 @@ from redis.cluster import RedisCluster as MemoryDBCluster
 from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.prompts import ChatPromptTemplate
+from embedding_store import CachedEmbeddings, memorydb_embedding_store
 
 load_dotenv()
 
@@ -63,7 +64,7 @@ def get_llm():
 
 # Initialize embeddings
 def initialize_embeddings():
-    return BedrockEmbeddings()
+    return CachedEmbeddings(BedrockEmbeddings(), memorydb_embedding_store(MEMORYDB_CLUSTER))
 
 def check_index_existence():
     try:
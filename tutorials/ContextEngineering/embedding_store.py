@@ -0,0 +1,192 @@
+"""
+Content-addressed embedding store backed by Amazon MemoryDB.
+
+Embeddings are stored as raw FLOAT32 bytes under
+``<prefix><model id>:<sha256 of the text>`` with a TTL, so identical text is
+only embedded once per model across every process sharing the cluster.
+A small in-memory tier in front of MemoryDB serves repeated text without a
+network round trip.
+
+The MemoryDB client must be created with ``decode_responses=False`` because
+the values are binary.
+
+memorydb_embedding_store() builds the store of a MemoryDB cluster, so a sample
+only imports this file. The samples of tutorials/ContextEngineering and
+tutorials/memorydb-rag ship it unchanged next to their code.
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from redis.cluster import RedisCluster
+
+try:
+    from langchain_core.embeddings import Embeddings as _EmbeddingsBase
+except ImportError:
+    _EmbeddingsBase = object
+
+logger = logging.getLogger(__name__)
+
+_shared_stores = {}
+_shared_stores_lock = threading.Lock()
+
+
+class EmbeddingStore:
+    """
+    Two tier (in-memory, then MemoryDB) memoization of embedding vectors.
+    """
+
+    def __init__(self, client, ttl_seconds=7 * 24 * 3600, key_prefix="emb:", front_tier_size=1024):
+        """
+        :param client: A redis-py client (RedisCluster or Redis) with decode_responses=False,
+                       or None to only use the in-memory tier.
+        :param ttl_seconds: Expiry of the entries written to MemoryDB.
+        :param key_prefix: Prefix of the keys written to MemoryDB.
+        :param front_tier_size: Maximum number of vectors kept in memory.
+        """
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.key_prefix = key_prefix
+        self.front_tier_size = front_tier_size
+        self._front = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"front_hits": 0, "store_hits": 0, "misses": 0, "store_errors": 0}
+
+    def key(self, model_id, text):
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{self.key_prefix}{model_id}:{digest}"
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def _front_get(self, key):
+        with self._lock:
+            vector = self._front.get(key)
+            if vector is not None:
+                self._front.move_to_end(key)
+            return vector
+
+    def _front_put(self, key, vector):
+        if self.front_tier_size <= 0:
+            return
+        with self._lock:
+            self._front[key] = vector
+            self._front.move_to_end(key)
+            while len(self._front) > self.front_tier_size:
+                self._front.popitem(last=False)
+
+    def get_many(self, model_id, texts):
+        """
+        Looks up the embeddings of several texts.
+        :return: A list with a float32 numpy array, or None on a miss, for every text.
+        """
+        keys = [self.key(model_id, text) for text in texts]
+        vectors = [self._front_get(key) for key in keys]
+        self._count("front_hits", sum(v is not None for v in vectors))
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing and self.client is not None:
+            try:
+                pipe = self.client.pipeline()
+                for i in missing:
+                    pipe.get(keys[i])
+                for i, raw in zip(missing, pipe.execute()):
+                    if raw is not None:
+                        vectors[i] = np.frombuffer(raw, dtype=np.float32)
+                        self._front_put(keys[i], vectors[i])
+                        self._count("store_hits")
+            except Exception as e:
+                self._count("store_errors")
+                logger.warning(f"Embedding store lookup failed: {e}")
+        self._count("misses", sum(v is None for v in vectors))
+        return vectors
+
+    def put_many(self, model_id, texts, vectors):
+        """
+        Stores the embeddings of several texts in both tiers.
+        """
+        items = []
+        for text, vector in zip(texts, vectors):
+            key = self.key(model_id, text)
+            vector = np.asarray(vector, dtype=np.float32)
+            self._front_put(key, vector)
+            items.append((key, vector))
+        if self.client is None:
+            return
+        try:
+            pipe = self.client.pipeline()
+            for key, vector in items:
+                pipe.set(key, vector.tobytes(), ex=self.ttl_seconds)
+            pipe.execute()
+        except Exception as e:
+            self._count("store_errors")
+            logger.warning(f"Embedding store write failed: {e}")
+
+    def get_or_compute_many(self, model_id, texts, compute_many):
+        """
+        Returns the embeddings of texts, calling compute_many only for the misses.
+        :param compute_many: Callable taking a list of texts and returning their embeddings.
+        :return: A list of embeddings (lists of floats) in the order of texts.
+        """
+        vectors = self.get_many(model_id, texts)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            computed = compute_many([texts[i] for i in missing])
+            self.put_many(model_id, [texts[i] for i in missing], computed)
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+        return [np.asarray(v, dtype=np.float32).tolist() for v in vectors]
+
+    def get_or_compute(self, model_id, text, compute):
+        """
+        Returns the embedding of text, calling compute(text) only on a miss.
+        """
+        return self.get_or_compute_many(model_id, [text], lambda batch: [compute(t) for t in batch])[0]
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.stats["front_hits"] + self.stats["store_hits"] + self.stats["misses"]
+            hits = self.stats["front_hits"] + self.stats["store_hits"]
+            return dict(self.stats, hit_ratio=hits / lookups if lookups else 0.0)
+
+
+class CachedEmbeddings(_EmbeddingsBase):
+    """
+    LangChain compatible embeddings wrapper that memoizes another embeddings object
+    (for example BedrockEmbeddings) in an EmbeddingStore.
+    """
+
+    def __init__(self, embeddings, store, model_id=None):
+        self.embeddings = embeddings
+        self.store = store
+        self.model_id = model_id or getattr(embeddings, "model_id", type(embeddings).__name__)
+
+    def embed_documents(self, texts):
+        return self.store.get_or_compute_many(self.model_id, list(texts), self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        return self.store.get_or_compute(self.model_id, text, self.embeddings.embed_query)
+
+
+def memorydb_embedding_store(host, port=6379, ttl_seconds=None):
+    """
+    Returns the embedding store of the MemoryDB cluster at host, created on first use
+    and shared by the whole process. When the cluster cannot be reached, the store only
+    uses the in-memory tier.
+    :param ttl_seconds: Expiry of the entries, EMBEDDING_CACHE_TTL_SECONDS (default 7 days) if None.
+    """
+    with _shared_stores_lock:
+        if (host, port) not in _shared_stores:
+            if ttl_seconds is None:
+                ttl_seconds = int(os.environ.get("EMBEDDING_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+            try:
+                # Binary vectors are stored, so this client must not decode responses
+                client = RedisCluster(host=host, port=port, ssl=True, decode_responses=False, ssl_cert_reqs="none")
+            except Exception as e:
+                logger.warning(f"Embedding store is not using MemoryDB: {e}")
+                client = None
+            _shared_stores[(host, port)] = EmbeddingStore(client, ttl_seconds=ttl_seconds)
+        return _shared_stores[(host, port)]
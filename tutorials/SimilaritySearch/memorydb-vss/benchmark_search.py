@@ -0,0 +1,156 @@
+"""
+Latency of process_question before and after the vector index.
+
+The products are synthetic: random 768-dimension question vectors under the
+--prefix key prefix, so the products of the app are left alone. For each size of
+--sizes, the catalog grows to that many products and both search paths answer the
+same random queries:
+
+    scan   the previous path: KEYS, one HGETALL per product and cosine in Python
+    knn    one KNN FT.SEARCH on the HNSW index, returning question, answer and score
+    local  the local index of local_search.py: one matrix-vector product, then one
+           HMGET per match
+
+The report gives the latency of every path, the speedup over the scan, and the
+share of the exact top 5 found by the index. The knn path is skipped when the
+cluster has no search commands. The local index is refreshed from the change log
+after each load, and the report gives the time of the refresh too.
+
+Usage:
+    python benchmark_search.py --host $MEMORYDB_CLUSTER --sizes 1000,10000,100000
+"""
+import argparse
+import json
+import statistics
+import time
+
+import numpy as np
+import redis
+
+import mmlib
+from local_search import LocalVectorIndex, change_log
+
+
+def scan_search(client, query_vector, prefix, k=mmlib.TOP_K):
+    """The search of process_question before the index."""
+    field = mmlib.ITEM_KEYWORD_EMBEDDING_FIELD.encode('utf-8')
+    results = []
+    for key in client.keys(f'{prefix}*'.encode('utf-8')):
+        product_data = client.hgetall(key)
+        if field in product_data:
+            product_vector = np.frombuffer(product_data[field], dtype=np.float32)
+            similarity = np.dot(query_vector, product_vector) / (np.linalg.norm(query_vector) * np.linalg.norm(product_vector))
+            results.append((key.decode('utf-8'), similarity))
+    results.sort(key=lambda x: x[1], reverse=True)
+    return [key for key, _ in results[:k]]
+
+
+def local_search(client, local_index, query_vector, k=mmlib.TOP_K):
+    """The search of process_question in the local index, without its refresh."""
+    matches = local_index.search(query_vector, k)
+    pipe = client.pipeline(transaction=False)
+    for key, _ in matches:
+        pipe.hmget(key, 'question', 'answer')
+    return list(zip(matches, pipe.execute()))
+
+
+def latency_report(latencies, scan_p50):
+    if not latencies:
+        return None
+    p50 = statistics.median(latencies)
+    return {'queries': len(latencies), 'p50_ms': p50, 'p95_ms': float(np.percentile(latencies, 95)),
+            'speedup': scan_p50 / p50 if scan_p50 else None}
+
+
+def wait_for_index(client, index_name, count, timeout=600):
+    deadline = time.monotonic() + timeout
+    while int(client.ft(index_name).info()['num_docs']) < count:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{index_name} did not index {count} products in {timeout} seconds")
+        time.sleep(0.5)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def cleanup(client, index_name, prefix):
+    try:
+        client.ft(index_name).dropindex()
+    except redis.ResponseError:
+        pass
+    pipe = client.pipeline(transaction=False)
+    for i, key in enumerate(client.scan_iter(match=f'{prefix}*', count=1000), 1):
+        pipe.delete(key)
+        if i % 1000 == 0:
+            pipe.execute()
+    pipe.execute()
+    client.delete(change_log(prefix))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=mmlib.MEMORYDB_CLUSTER)
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--no-ssl', action='store_true')
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--queries', type=int, default=50, help='Queries of the indexed path per size')
+    parser.add_argument('--scan-queries', type=int, default=5, help='Queries of the scan path per size')
+    parser.add_argument('--prefix', default='bench:product:')
+    parser.add_argument('--index', default='idx:pqa_vss_bench')
+    args = parser.parse_args()
+
+    client = redis.Redis(host=args.host, port=args.port, decode_responses=False, ssl=not args.no_ssl,
+                         ssl_cert_reqs='none')
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+    rng = np.random.default_rng(0)
+    cleanup(client, args.index, args.prefix)
+    knn = mmlib.has_search_module(client)
+    if knn:
+        mmlib.create_index(client, args.index, args.prefix, initial_cap=sizes[-1])
+    local_index = LocalVectorIndex(client, args.prefix, mmlib.ITEM_KEYWORD_EMBEDDING_FIELD,
+                                   mmlib.TEXT_EMBEDDING_DIMENSION)
+
+    report = {'dimensions': mmlib.TEXT_EMBEDDING_DIMENSION, 'sizes': {}}
+    loaded = 0
+    try:
+        for size in sizes:
+            vectors = rng.standard_normal((size - loaded, mmlib.TEXT_EMBEDDING_DIMENSION), dtype=np.float32)
+            mmlib.load_products(client, ((loaded + i, vector, f'question {loaded + i}', f'answer {loaded + i}')
+                                         for i, vector in enumerate(vectors)), prefix=args.prefix)
+            loaded = size
+            if knn:
+                wait_for_index(client, args.index, size)
+            _, refresh_ms = timed(local_index.refresh)
+
+            queries = rng.standard_normal((args.queries, mmlib.TEXT_EMBEDDING_DIMENSION), dtype=np.float32)
+            knn_latencies, local_latencies, scan_latencies, overlaps = [], [], [], []
+            for i, query in enumerate(queries):
+                if knn:
+                    found, latency = timed(mmlib.search_products, client, query, mmlib.TOP_K, args.index)
+                    knn_latencies.append(latency)
+                _, latency = timed(local_search, client, local_index, query)
+                local_latencies.append(latency)
+                if i < args.scan_queries:
+                    exact, latency = timed(scan_search, client, query, args.prefix)
+                    scan_latencies.append(latency)
+                    if knn:
+                        overlaps.append(len({doc['Hash Key'] for doc in found} & set(exact)) / mmlib.TOP_K)
+            scan_p50 = statistics.median(scan_latencies) if scan_latencies else None
+            report['sizes'][size] = {
+                'scan': {'queries': len(scan_latencies), 'p50_ms': scan_p50},
+                'knn': latency_report(knn_latencies, scan_p50),
+                'local': {**latency_report(local_latencies, scan_p50), 'refresh_ms': refresh_ms},
+                'recall_at_5': statistics.mean(overlaps) if overlaps else None
+            }
+            print(json.dumps({size: report['sizes'][size]}))
+    finally:
+        local_index.close()
+        cleanup(client, args.index, args.prefix)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
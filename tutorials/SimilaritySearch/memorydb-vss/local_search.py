@@ -0,0 +1,209 @@
+import logging
+import os
+import tempfile
+import weakref
+
+import numpy as np
+
+# Streams of the keys written under each prefix, which let the local index refresh
+# without scanning the whole catalog again
+CHANGE_LOG_PREFIX = 'changes:'
+CHANGE_LOG_MAXLEN = 100000
+
+
+def change_log(prefix):
+    return CHANGE_LOG_PREFIX + prefix
+
+
+def log_change(pipe, prefix, key):
+    """
+    Add the key of a written or deleted hash of prefix to its change log.
+
+    Only mmlib.load_products calls it. Code writing or deleting products in another
+    way must call it too, or the local indexes will not see the change.
+    """
+    pipe.xadd(change_log(prefix), {'key': key}, maxlen=CHANGE_LOG_MAXLEN, approximate=True)
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _stream_id(entry_id):
+    return tuple(int(part) for part in entry_id.split('-'))
+
+
+class LocalVectorIndex:
+    """
+    Brute-force cosine search over all the product vectors, kept in this process.
+
+    The vectors are normalized once and kept as the rows of a contiguous float32
+    matrix, memory-mapped from a file, so a query costs one matrix-vector product
+    and a batch of queries one matrix-matrix product. Without a path, the matrix
+    lives in a temporary file removed by close() or when the index is collected.
+
+    The first refresh() reads the catalog with SCAN, and can be spread over several
+    calls with max_keys. Later calls only read the keys added to the change log since
+    the previous call, and fetch the vectors of those keys. The catalog is scanned
+    again when the change log was trimmed past the last entry read. Products written
+    or deleted without log_change are not seen until a new index scans the catalog.
+    """
+
+    def __init__(self, client, prefix, field, dimensions, path=None, capacity=1024, batch_size=1000):
+        self.client = client
+        self.prefix = prefix
+        self.change_log = change_log(prefix)
+        self.field = field
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self._finalizer = None
+        if path is None:
+            handle, path = tempfile.mkstemp(prefix='vectors-', suffix='.f32')
+            os.close(handle)
+            self._finalizer = weakref.finalize(self, _remove_file, path)
+        self.path = path
+        self.matrix = np.memmap(self.path, dtype=np.float32, mode='w+', shape=(capacity, dimensions))
+        self.keys = []
+        self.rows = {}
+        self.scan_cursor = None
+        self.log_id = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def close(self):
+        """Release the matrix, and remove its file when it is a temporary one."""
+        self.matrix = None
+        self.keys = []
+        self.rows = {}
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def refresh(self, max_keys=None):
+        """Apply the changes since the previous refresh and return the number of keys read."""
+        if self.log_id is None or self._log_trimmed():
+            # The change log is read from its last entry once the scan is done, since
+            # the scan sees everything written before
+            last = self.client.xrevrange(self.change_log, count=1)
+            self.log_id = last[0][0].decode('utf-8') if last else '0-0'
+            self.scan_cursor = 0
+            logging.info(f"Scanning the {self.prefix} products into the local index")
+        if self.scan_cursor is not None:
+            return self._scan(max_keys)
+        return self._read_log()
+
+    def _log_trimmed(self):
+        if self.scan_cursor is not None:
+            return False
+        try:
+            info = self.client.xinfo_stream(self.change_log)
+        except Exception:
+            return False
+        if self.log_id == '0-0':
+            # Nothing was read yet, so any trimmed entry is missed. Only Redis 7 and
+            # later report the number of entries ever added
+            added = info.get('entries-added')
+            return added is not None and int(added) > int(info['length'])
+        # MAXLEN trimming removes the oldest entries and moves the first entry of the
+        # stream. Once the last entry read is gone, the entries after it may be gone too,
+        # so the catalog is scanned again
+        entry = info.get('first-entry')
+        first = entry[0] if entry else info.get('last-generated-id')
+        first = first.decode('utf-8') if isinstance(first, bytes) else first
+        return _stream_id(first) > _stream_id(self.log_id)
+
+    def _scan(self, max_keys):
+        read = 0
+        while max_keys is None or read < max_keys:
+            self.scan_cursor, keys = self.client.scan(self.scan_cursor, match=f'{self.prefix}*', count=self.batch_size,
+                                                      _type='HASH')
+            self._load(keys)
+            read += len(keys)
+            if self.scan_cursor == 0:
+                self.scan_cursor = None
+                logging.info(f"Local index holds {len(self)} products")
+                return read + self._read_log()
+        return read
+
+    def _read_log(self):
+        read = 0
+        while True:
+            entries = self.client.xrange(self.change_log, min=f'({self.log_id}', count=self.batch_size)
+            if not entries:
+                return read
+            self.log_id = entries[-1][0].decode('utf-8')
+            self._load(list({fields[b'key']: None for _, fields in entries}))
+            read += len(entries)
+
+    def _load(self, keys):
+        if not keys:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hget(key, self.field)
+        for key, value in zip(keys, pipe.execute()):
+            key = key.decode('utf-8') if isinstance(key, bytes) else key
+            if value is None:
+                self._remove(key)
+            else:
+                self._upsert(key, np.frombuffer(value, dtype=np.float32))
+
+    def _upsert(self, key, vector):
+        norm = np.linalg.norm(vector)
+        if len(vector) != self.dimensions or not norm:
+            logging.warning(f"Skipping the vector of {key}")
+            return
+        row = self.rows.get(key)
+        if row is None:
+            row = len(self.keys)
+            if row == len(self.matrix):
+                self._grow()
+            self.keys.append(key)
+            self.rows[key] = row
+        self.matrix[row] = vector / norm
+
+    def _remove(self, key):
+        row = self.rows.pop(key, None)
+        if row is None:
+            return
+        # The last row moves into the hole, so the rows stay contiguous
+        last = len(self.keys) - 1
+        if row != last:
+            self.matrix[row] = self.matrix[last]
+            self.keys[row] = self.keys[last]
+            self.rows[self.keys[row]] = row
+        self.keys.pop()
+
+    def _grow(self):
+        matrix = np.memmap(self.path + '.next', dtype=np.float32, mode='w+',
+                           shape=(2 * len(self.matrix), self.dimensions))
+        matrix[:len(self.matrix)] = self.matrix
+        del self.matrix
+        os.replace(self.path + '.next', self.path)
+        self.matrix = matrix
+
+    def search(self, query_vector, k):
+        """Return the (key, cosine similarity) pairs of the k products closest to one query."""
+        return self.search_batch(np.asarray(query_vector, dtype=np.float32)[np.newaxis], k)[0]
+
+    def search_batch(self, query_vectors, k):
+        """Return the (key, cosine similarity) pairs of the k closest products of every row of a query matrix."""
+        count = len(self.keys)
+        if not count:
+            return [[] for _ in range(len(query_vectors))]
+        queries = np.asarray(query_vectors, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        # A zero query is similar to nothing, rather than NaN to everything
+        norms[norms == 0] = 1
+        queries = queries / norms
+        similarities = queries @ self.matrix[:count].T
+        k = min(k, count)
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in zip(similarities, top):
+            order = candidates[np.argsort(-row[candidates])]
+            results.append([(self.keys[i], float(row[i])) for i in order])
+        return results
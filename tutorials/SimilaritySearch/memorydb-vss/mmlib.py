@@ -6,6 +6,8 @@ import os
 import logging
 from sentence_transformers import SentenceTransformer
 import redis
+from redis.commands.search.query import Query
+from local_search import LocalVectorIndex, log_change
 
 
 # Set up logging
@@ -16,10 +18,25 @@ INDEX_NAME = 'idx:pqa_vss'
 ITEM_KEYWORD_EMBEDDING_FIELD = 'question_vector'
 TEXT_EMBEDDING_DIMENSION = 768
 NUMBER_PRODUCTS = 1000
+KEY_PREFIX = 'product:'
+TOP_K = 5
+HNSW_M = 40
 MEMORYDB_CLUSTER = os.environ.get("MEMORYDB_CLUSTER")
+# Catalogs of up to this many products are searched in the local index, 0 to always use the vector index
+LOCAL_SEARCH_MAX_PRODUCTS = int(os.environ.get("LOCAL_SEARCH_MAX_PRODUCTS", 0))
 
-# Initialize model
-model = SentenceTransformer('sentence-transformers/all-distilroberta-v1')
+# The model is loaded on first use
+model = None
+
+# Whether the cluster has the search commands, and the local index used without them
+search_module = None
+local_index = None
+
+def get_model():
+    global model
+    if model is None:
+        model = SentenceTransformer('sentence-transformers/all-distilroberta-v1')
+    return model
 
 def initialize_redis():
     try:
@@ -54,49 +71,151 @@ def loadVectorStore(client, file_name='amazon-pqa/amazon_pqa_headsets.json', num
     def create_embeddings(qa_list):
         logging.info("Creating embeddings for questions")
         item_keywords = [qa['question'] for qa in qa_list.to_dict(orient='index').values()]
-        return [model.encode(sentence) for sentence in item_keywords]
+        return [get_model().encode(sentence) for sentence in item_keywords]
 
     def load_vectors(client, qa_list, vector_dict):
         logging.info("Loading vectors into Redis")
-        for index, qa in qa_list.iterrows():
-            key = f'product:{index}'
-            item_keywords_vector = vector_dict[index].astype(np.float32).tobytes()
-            client.hset(key, ITEM_KEYWORD_EMBEDDING_FIELD, item_keywords_vector)
-            client.hset(key, 'question', qa['question'].encode('utf-8'))
-            client.hset(key, 'answer', qa['answer'].encode('utf-8'))
+        load_products(client, [
+            (index, vector_dict[index], qa['question'], qa['answer']) for index, qa in qa_list.iterrows()
+        ])
         logging.info(f"Loaded {len(qa_list)} vectors into Redis")
 
     qa_list = load_pqa(file_name, number_rows)
     item_keywords_vectors = create_embeddings(qa_list)
+    if has_search_module(client):
+        create_index(client, initial_cap=number_rows)
     start_time = time.time()
     load_vectors(client, qa_list, item_keywords_vectors)
     end_time = time.time()
 
     logging.info(f'Loading {NUMBER_PRODUCTS} products completed in {end_time - start_time:.2f} seconds')
 
-def check_index_existence(client):
-    keys = client.keys(b'product:*')
-    result = {'exists': len(keys) > 0, 'num_docs': len(keys)}
+def load_products(client, products, prefix=KEY_PREFIX, batch_size=1000):
+    """Write (id, vector, question, answer) products as hashes, batch_size per pipeline."""
+    pipe = client.pipeline(transaction=False)
+    for i, (product_id, vector, question, answer) in enumerate(products, 1):
+        pipe.hset(f'{prefix}{product_id}', mapping={
+            ITEM_KEYWORD_EMBEDDING_FIELD: np.asarray(vector, dtype=np.float32).tobytes(),
+            'question': question.encode('utf-8'),
+            'answer': answer.encode('utf-8')
+        })
+        log_change(pipe, prefix, f'{prefix}{product_id}')
+        if i % batch_size == 0:
+            pipe.execute()
+    pipe.execute()
+
+def create_index(client, index_name=INDEX_NAME, prefix=KEY_PREFIX, initial_cap=NUMBER_PRODUCTS):
+    """Create the HNSW index of the product questions, unless it exists."""
+    try:
+        client.ft(index_name).info()
+        logging.info(f"Index {index_name} already exists")
+        return
+    except redis.ResponseError:
+        pass
+    # FT.CREATE is sent as is, since redis-py may reject the attributes of MemoryDB
+    client.execute_command(
+        'FT.CREATE', index_name, 'ON', 'HASH', 'PREFIX', 1, prefix,
+        'SCHEMA', ITEM_KEYWORD_EMBEDDING_FIELD, 'VECTOR', 'HNSW', 10,
+        'TYPE', 'FLOAT32', 'DIM', TEXT_EMBEDDING_DIMENSION, 'DISTANCE_METRIC', 'COSINE',
+        'INITIAL_CAP', initial_cap, 'M', HNSW_M
+    )
+    logging.info(f"Created index {index_name} on {prefix} hashes")
+
+def has_search_module(client):
+    global search_module
+    if search_module is None:
+        try:
+            client.execute_command('FT._LIST')
+            search_module = True
+        except redis.ResponseError:
+            logging.warning("No search commands on the cluster, questions are answered from the local index")
+            search_module = False
+    return search_module
+
+def get_local_index(client):
+    """Return the local index of the products, refreshed with the changes since the previous question."""
+    global local_index
+    if local_index is None:
+        local_index = LocalVectorIndex(client, KEY_PREFIX, ITEM_KEYWORD_EMBEDDING_FIELD, TEXT_EMBEDDING_DIMENSION)
+    local_index.refresh()
+    return local_index
+
+def use_local_search(client, index_name=INDEX_NAME):
+    if not has_search_module(client):
+        return True
+    if LOCAL_SEARCH_MAX_PRODUCTS <= 0:
+        return False
+    # The size comes from the vector index, so the local index is only loaded when it is used
+    try:
+        num_docs = int(client.ft(index_name).info()['num_docs'])
+    except redis.ResponseError:
+        return False
+    return num_docs <= LOCAL_SEARCH_MAX_PRODUCTS
+
+def check_index_existence(client, index_name=INDEX_NAME):
+    try:
+        if has_search_module(client):
+            num_docs = int(client.ft(index_name).info()['num_docs'])
+        else:
+            num_docs = len(get_local_index(client))
+    except redis.ResponseError:
+        num_docs = 0
+    result = {'exists': num_docs > 0, 'num_docs': num_docs}
     logging.info(f"Index check result: {result}")
     return result
 
+def search_products(client, query_vector, k=TOP_K, index_name=INDEX_NAME):
+    """Return the k products with the most similar questions, with one KNN search."""
+    query = (Query(f'*=>[KNN {k} @{ITEM_KEYWORD_EMBEDDING_FIELD} $vec_param AS vector_score]')
+             .sort_by('vector_score')
+             .return_fields('question', 'answer', 'vector_score')
+             .paging(0, k)
+             .dialect(2))
+    params = {'vec_param': np.asarray(query_vector, dtype=np.float32).tobytes()}
+    results = client.ft(index_name).search(query, query_params=params)
+
+    def text(value):
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    # The score is the cosine distance, 1 - cosine similarity
+    return [{'Hash Key': text(doc.id), 'Similarity': 1 - float(doc.vector_score),
+             'Question': text(doc.question), 'Answer': text(doc.answer)} for doc in results.docs]
+
+def search_products_locally(client, query_vectors, k=TOP_K):
+    """Return the k products closest to every row of a query matrix, from the local index."""
+    matches = get_local_index(client).search_batch(query_vectors, k)
+    # Only the questions and answers of the matches are fetched
+    pipe = client.pipeline(transaction=False)
+    for key, _ in (match for query_matches in matches for match in query_matches):
+        pipe.hmget(key, 'question', 'answer')
+    texts = iter(pipe.execute())
+    results = []
+    for query_matches in matches:
+        data = []
+        for key, similarity in query_matches:
+            question, answer = next(texts)
+            if question is not None:
+                data.append({'Hash Key': key, 'Similarity': similarity,
+                             'Question': question.decode('utf-8'), 'Answer': answer.decode('utf-8')})
+        results.append(data)
+    return results
+
 def process_question(client, query):
     logging.info(f"Processing question: {query}")
-    query_vector = model.encode(query).astype(np.float32)
-    
-    results = []
-    for key in client.keys(b'product:*'):
-        product_data = client.hgetall(key)
-        if ITEM_KEYWORD_EMBEDDING_FIELD.encode('utf-8') in product_data:
-            product_vector = np.frombuffer(product_data[ITEM_KEYWORD_EMBEDDING_FIELD.encode('utf-8')], dtype=np.float32)
-            similarity = np.dot(query_vector, product_vector) / (np.linalg.norm(query_vector) * np.linalg.norm(product_vector))
-            question = product_data[b'question'].decode('utf-8')
-            answer = product_data[b'answer'].decode('utf-8')
-            results.append((key, similarity, question, answer))
-    
-    results.sort(key=lambda x: x[1], reverse=True)
-    top_results = results[:5]  # Get top 5 results
-    
-    data = [{'Hash Key': key.decode('utf-8'), 'Similarity': sim, 'Question': q, 'Answer': a} for key, sim, q, a in top_results]
-    logging.info(f"Found {len(results)} results for the query")
+    query_vector = get_model().encode(query).astype(np.float32)
+    if use_local_search(client):
+        data = search_products_locally(client, query_vector[np.newaxis])[0]
+    else:
+        data = search_products(client, query_vector)
+    logging.info(f"Found {len(data)} results for the query")
     return pd.DataFrame(data)
+
+def process_questions(client, queries):
+    """Answer a batch of questions, with one matrix product in the local index."""
+    logging.info(f"Processing {len(queries)} questions")
+    query_vectors = np.asarray(get_model().encode(queries), dtype=np.float32)
+    if use_local_search(client):
+        results = search_products_locally(client, query_vectors)
+    else:
+        results = [search_products(client, query_vector) for query_vector in query_vectors]
+    return [pd.DataFrame(data) for data in results]
@@ -0,0 +1,136 @@
+"""
+Simulates the multi-region routing of the Lambda function against local clusters.
+
+Each region of --regions is a local Redis cluster, and the same cluster can stand
+in for several regions. Latency and outages are injected in the commands of
+every region. The scenario runs reads and writes through the RegionRouter of
+src/region_router.py, with the failover errors of the Lambda function, in four
+phases of --phase-seconds seconds:
+
+    baseline     the regions answer with the latencies of --latency
+    outage       every command of the fastest region fails
+    recovered    the region is back, and wins the reads again after --cooldown seconds
+    slowdown     the fastest region becomes the slowest
+
+The report gives, for every phase, the reads served by each region, the writes
+sent to each region and the errors that reached the caller.
+
+Usage:
+    python region_routing.py --regions us-east-1=127.0.0.1:7001,us-west-1=127.0.0.1:7001,eu-west-1=127.0.0.1:7001 \
+        --latency us-east-1=40,us-west-1=5,eu-west-1=80
+"""
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import time
+
+from redis.cluster import RedisCluster
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+from region_router import RegionRouter  # noqa: E402
+
+
+def load_lambda_module():
+    # The file name of the Lambda function is not a valid module name
+    spec = importlib.util.spec_from_file_location("lambda_function", os.path.join(SRC_DIR, "lambda-function.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def parse_pairs(spec):
+    return dict(item.split("=", 1) for item in spec.split(","))
+
+
+class FaultyCluster(RedisCluster):
+    """
+    Cluster client that delays every command of its region, or fails it while the region is down.
+    """
+
+    def __init__(self, faults, region, **kwargs):
+        self.faults = faults
+        self.region = region
+        super().__init__(**kwargs)
+
+    def execute_command(self, *args, **kwargs):
+        fault = self.faults[self.region]
+        if fault["down"]:
+            raise RedisConnectionError(f"{self.region} is down (injected)")
+        time.sleep(fault["latency_ms"] / 1000)
+        return super().execute_command(*args, **kwargs)
+
+
+def run_phase(router, seconds, write_every):
+    reads, writes, latencies, errors = {}, {}, [], []
+    deadline = time.monotonic() + seconds
+    operations = 0
+    while time.monotonic() < deadline:
+        operations += 1
+        try:
+            if operations % write_every == 0:
+                router.write(lambda r: r.set("region-routing:probe", operations))
+                writes[router.primary] = writes.get(router.primary, 0) + 1
+            else:
+                start = time.perf_counter()
+                region, _ = router.read(lambda r: r.get("region-routing:probe"))
+                latencies.append((time.perf_counter() - start) * 1000)
+                reads[region] = reads.get(region, 0) + 1
+        except Exception as e:
+            errors.append(str(e))
+    return {
+        "reads": reads,
+        "writes": writes,
+        "caller_errors": len(errors),
+        "read_p50_ms": statistics.median(latencies) if latencies else None,
+        "regions": router.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--regions", default="us-east-1=127.0.0.1:7001,us-west-1=127.0.0.1:7001,"
+                                             "eu-west-1=127.0.0.1:7001",
+                        help="region=host:port pairs, the first region being the primary")
+    parser.add_argument("--latency", default="us-east-1=40,us-west-1=5,eu-west-1=80",
+                        help="Injected latency in milliseconds of each region")
+    parser.add_argument("--phase-seconds", type=float, default=5)
+    parser.add_argument("--cooldown", type=float, default=2, help="Seconds a failing region is skipped")
+    parser.add_argument("--write-every", type=int, default=10, help="One operation in this many is a write")
+    args = parser.parse_args()
+
+    lambda_function = load_lambda_module()
+    regions = parse_pairs(args.regions)
+    latency = {region: float(ms) for region, ms in parse_pairs(args.latency).items()}
+    faults = {region: {"latency_ms": latency.get(region, 0.0), "down": False} for region in regions}
+
+    def connector(region):
+        host, _, port = regions[region].rpartition(":")
+        return lambda: FaultyCluster(faults, region, host=host, port=int(port),
+                                     socket_timeout=lambda_function.SOCKET_TIMEOUT_SECONDS)
+
+    primary = next(iter(regions))
+    router = RegionRouter({region: connector(region) for region in regions}, primary,
+                          lambda_function.FAILOVER_ERRORS, cooldown_seconds=args.cooldown)
+    fastest = min(regions, key=lambda region: faults[region]["latency_ms"])
+    slowest = max(faults[region]["latency_ms"] for region in regions)
+
+    report = {"primary": primary, "fastest": fastest, "latency_ms": latency, "phases": {}}
+    report["phases"]["baseline"] = run_phase(router, args.phase_seconds, args.write_every)
+    faults[fastest]["down"] = True
+    report["phases"]["outage"] = run_phase(router, args.phase_seconds, args.write_every)
+    faults[fastest]["down"] = False
+    report["phases"]["recovered"] = run_phase(router, args.phase_seconds, args.write_every)
+    faults[fastest]["latency_ms"] = slowest * 2
+    report["phases"]["slowdown"] = run_phase(router, args.phase_seconds, args.write_every)
+    router.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
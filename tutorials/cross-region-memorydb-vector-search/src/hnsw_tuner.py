@@ -0,0 +1,213 @@
+import json
+import logging
+import time
+import uuid
+from typing import List, Optional
+
+import numpy as np
+from redis.cluster import RedisCluster
+from redis.exceptions import ResponseError
+
+from bulk_insert import bulk_insert_vectors, random_vectors
+from region_router import RegionRouter
+from vector_benchmark import (create_vector_index, delete_keys, ground_truth, knn_query, latency_summary,
+                              recall_at_k, run_queries, wait_for_indexing)
+
+logger = logging.getLogger()
+
+# Defaults of the tuning event parameters
+TUNER_DEFAULTS = {
+    'sample_size': 10000,
+    'sample_prefix': None,
+    'queries': 200,
+    'k': 10,
+    'target_recall': 0.95,
+    'target_latency_ms': 10.0,
+    'latency_percentile': 'p95_ms',
+    'm': [8, 16, 32, 64],
+    'ef_construction': [64, 128, 256, 512],
+    'ef_runtime': [10, 20, 40, 80, 160, 320],
+    'concurrency': 1,
+    'batch_size': 1000,
+    'region': None,
+    'indexing_timeout': 600
+}
+
+
+def used_memory(r: RedisCluster) -> int:
+    """Return the memory used by all the primaries of the cluster."""
+    info = r.info('memory', target_nodes=RedisCluster.PRIMARIES)
+    # A cluster with a single primary returns its INFO instead of one INFO per node
+    if 'used_memory' in info:
+        return int(info['used_memory'])
+    return sum(int(node_info['used_memory']) for node_info in info.values())
+
+
+def index_memory(info: dict) -> Optional[int]:
+    """Return the vector index size reported by FT.INFO, in bytes, when it reports one."""
+    for name in ('vector_space_usage', 'space_usage'):
+        if name in info:
+            return int(float(info[name]))
+    if 'vector_index_sz_mb' in info:
+        return int(float(info['vector_index_sz_mb']) * 1024 * 1024)
+    return None
+
+
+def sample_vectors(r: RedisCluster, prefix: str, count: int, batch_size: int = 1000) -> np.ndarray:
+    """Read the vectors of up to count existing hashes of prefix into a float32 matrix."""
+    keys = []
+    for key in r.scan_iter(match=f"{prefix}*", count=batch_size):
+        keys.append(key)
+        if len(keys) == count:
+            break
+    rows = []
+    for start in range(0, len(keys), batch_size):
+        pipe = r.pipeline(transaction=False)
+        for key in keys[start:start + batch_size]:
+            pipe.hget(key, "content_vector")
+        rows += [value for value in pipe.execute() if value]
+    if not rows:
+        raise ValueError(f"No vectors found under {prefix}")
+    return np.frombuffer(b''.join(rows), dtype=np.float32).reshape(len(rows), -1)
+
+
+def parse_tuner_params(params: dict, dimensions: int) -> dict:
+    """Merge the tuning parameters of the event with the defaults, and validate them."""
+    unknown = set(params) - set(TUNER_DEFAULTS) - {'dimensions'}
+    if unknown:
+        raise ValueError(f"Unknown tuning parameters: {', '.join(sorted(unknown))}")
+    config = {**TUNER_DEFAULTS, 'dimensions': dimensions, **params}
+    for name in ('dimensions', 'sample_size', 'queries', 'k', 'concurrency', 'batch_size'):
+        config[name] = int(config[name])
+        if config[name] < 1:
+            raise ValueError(f"{name} must be positive")
+    for name in ('m', 'ef_construction', 'ef_runtime'):
+        config[name] = sorted(int(value) for value in config[name])
+    if config['latency_percentile'] not in ('p50_ms', 'p95_ms', 'p99_ms'):
+        raise ValueError("latency_percentile must be p50_ms, p95_ms or p99_ms")
+    return config
+
+
+def run_tuner(router: RegionRouter, index_name: str, config: dict, deadline: Optional[float] = None) -> dict:
+    """
+    Find the cheapest HNSW setting whose searches reach the target recall@k within the
+    target latency.
+
+    The sample is loaded once in the primary region, under a scratch prefix, and every
+    (M, EF_CONSTRUCTION) pair builds a scratch index over it, cheapest first: the memory
+    of the graph grows with M and its build time with EF_CONSTRUCTION. Each index is
+    queried with increasing EF_RUNTIME values until the recall is reached, and the first
+    pair reaching it ends the sweep. The queries are held out of the sample.
+
+    The indexes are built and queried in config['region'], the primary region by
+    default, since a scratch index only exists in the region that created it.
+
+    The sweep stops early past deadline, a time.monotonic() value, and reports the
+    trials done so far.
+    """
+    run_id = uuid.uuid4().hex[:8]
+    prefix = f"tune:{run_id}:"
+    k = config['k']
+    if config['sample_prefix']:
+        sample = router.write(lambda r: sample_vectors(r, config['sample_prefix'],
+                                                       config['sample_size'] + config['queries']))
+        if len(sample) <= config['queries']:
+            raise ValueError(f"The sample of {len(sample)} vectors is too small for {config['queries']} queries")
+    else:
+        sample = random_vectors(config['sample_size'] + config['queries'], config['dimensions'])
+    vectors, queries = sample[:-config['queries']], sample[-config['queries']:]
+    truth = ground_truth(vectors, queries, k)
+
+    trials: List[dict] = []
+    best = None
+    keys: List[bytes] = []
+    try:
+        keys, _ = router.write(lambda r: bulk_insert_vectors(r, vectors, config['batch_size'], key_prefix=prefix))
+        for m in config['m']:
+            for ef_construction in config['ef_construction']:
+                if best or (deadline and time.monotonic() > deadline):
+                    break
+                trial = tune_index(router, f"{index_name}-tune-{run_id}", prefix, vectors, queries, truth, keys,
+                                   m, ef_construction, config, deadline)
+                trials.append(trial)
+                if trial['meets_target']:
+                    best = trial
+    finally:
+        router.write(lambda r: delete_keys(r, keys, config['batch_size']))
+
+    report = {
+        'target': {'recall_at_k': config['target_recall'], 'k': k,
+                   config['latency_percentile']: config['target_latency_ms']},
+        'sample': {'vectors': len(vectors), 'queries': len(queries), 'dimensions': int(vectors.shape[1])},
+        'timed_out': bool(deadline and time.monotonic() > deadline and not best),
+        'best': None,
+        'trials': trials
+    }
+    if best:
+        report['best'] = {
+            'algorithm': 'HNSW',
+            'index_attributes': best['index_attributes'],
+            'ef_runtime': best['ef_runtime'],
+            'recall_at_k': best['recall_at_k'],
+            'latency': best['latency'],
+            'index_bytes_per_vector': best['index_bytes_per_vector'],
+            'used_memory_bytes_per_vector': best['used_memory_bytes_per_vector'],
+            'build_seconds': best['build_seconds']
+        }
+    logger.info(f"HNSW tuning result: {json.dumps(report['best'])}")
+    return report
+
+
+def tune_index(router: RegionRouter, scratch_index: str, prefix: str, vectors: np.ndarray, queries: np.ndarray,
+               truth: np.ndarray, keys: List[bytes], m: int, ef_construction: int, config: dict,
+               deadline: Optional[float]) -> dict:
+    """Build one scratch HNSW index over the loaded sample and sweep the EF_RUNTIME values on it."""
+    attributes = {'M': m, 'EF_CONSTRUCTION': ef_construction, 'INITIAL_CAP': len(vectors)}
+    region = config['region'] or router.primary
+    before = router.run_on(region, used_memory)
+    start = time.perf_counter()
+    router.run_on(region, lambda r: create_vector_index(r, scratch_index, prefix, vectors.shape[1], 'HNSW', attributes))
+    try:
+        info = router.run_on(region,
+                             lambda r: wait_for_indexing(r, scratch_index, len(vectors), config['indexing_timeout']))
+        build_seconds = time.perf_counter() - start
+        after = router.run_on(region, used_memory)
+        reported = index_memory(info)
+        trial = {
+            'index_attributes': {'M': m, 'EF_CONSTRUCTION': ef_construction},
+            'build_seconds': build_seconds,
+            'index_bytes_per_vector': reported / len(vectors) if reported is not None else None,
+            'used_memory_bytes_per_vector': (after - before) / len(vectors),
+            'ef_runtime': None,
+            'meets_target': False,
+            'sweep': []
+        }
+        rows = {key.decode('utf-8'): i for i, key in enumerate(keys)}
+        for ef_runtime in config['ef_runtime']:
+            if deadline and time.monotonic() > deadline:
+                break
+            query = knn_query(config['k'], ef_runtime)
+
+            def search(vector: bytes) -> tuple:
+                def search_keys(r: RedisCluster) -> List[str]:
+                    return [doc.id for doc in r.ft(scratch_index).search(query, {'vector': vector}).docs]
+                return region, router.read_from(region, search_keys)
+
+            found, latencies, _, _ = run_queries(search, queries, 0, config['concurrency'])
+            recall = recall_at_k([[rows.get(key, -1) for key in doc_ids] for doc_ids in found], truth)
+            latency = latency_summary(latencies)
+            trial['sweep'].append({'ef_runtime': ef_runtime, 'recall_at_k': recall, 'latency': latency})
+            logger.info(f"M={m} EF_CONSTRUCTION={ef_construction} EF_RUNTIME={ef_runtime}: "
+                        f"recall {recall:.3f}, {config['latency_percentile']} {latency[config['latency_percentile']]:.2f} ms")
+            if latency[config['latency_percentile']] > config['target_latency_ms']:
+                # A larger EF_RUNTIME only makes the searches slower
+                break
+            if recall >= config['target_recall']:
+                trial.update(ef_runtime=ef_runtime, recall_at_k=recall, latency=latency, meets_target=True)
+                break
+        return trial
+    finally:
+        try:
+            router.run_on(region, lambda r: r.ft(scratch_index).dropindex())
+        except ResponseError as e:
+            logger.warning(f"Error dropping index {scratch_index}: {str(e)}")
@@ -1,10 +1,11 @@
 import os
 import redis
-from redis.commands.search.field import VectorField, TextField
-from redis.commands.search.indexDefinition import IndexDefinition, IndexType
 from redis.cluster import RedisCluster
-from redis.exceptions import ResponseError
-from typing import Dict, Tuple, Union, List
+from redis.exceptions import (AuthenticationError, ClusterDownError, ClusterError, RedisClusterException,
+                              ResponseError, SlotNotCoveredError)
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import TimeoutError as RedisTimeoutError
+from typing import Callable, Dict, Tuple, Union, List
 from urllib.parse import ParseResult, urlencode, urlunparse
 import botocore.session
 from botocore.model import ServiceId
@@ -13,13 +14,58 @@ import logging
 import random
 import struct
 import json
-import uuid
+import threading
 import time
+import uuid
+import zlib
+from bulk_insert import bulk_insert_vectors, random_vectors
+from region_router import RegionRouter
+from hnsw_tuner import parse_tuner_params, run_tuner
+from vector_benchmark import create_vector_index, parse_benchmark_params, run_benchmark
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Signed IAM tokens are valid for 900 seconds and are renewed this long before they expire
+TOKEN_EXPIRY_SECONDS = 900
+TOKEN_REFRESH_MARGIN_SECONDS = int(os.environ.get('REDIS_TOKEN_REFRESH_MARGIN', 60))
+
+# Idle connections are checked with a PING before being reused after this many seconds
+HEALTH_CHECK_INTERVAL_SECONDS = int(os.environ.get('REDIS_HEALTH_CHECK_INTERVAL', 30))
+
+# Errors after which the client is rebuilt: rejected credentials or a changed cluster topology
+REBUILD_ERRORS = (AuthenticationError, ClusterDownError, ClusterError, SlotNotCoveredError, RedisClusterException,
+                  RedisConnectionError)
+
+# Algorithm and attributes of the index created by create_index_if_not_exists, for example
+# the HNSW parameters picked by the tuner, and the EF_RUNTIME of the HNSW searches
+INDEX_ALGORITHM = os.environ.get('REDIS_INDEX_ALGORITHM', 'FLAT').upper()
+INDEX_ATTRIBUTES = json.loads(os.environ.get('REDIS_INDEX_ATTRIBUTES') or '{}')
+EF_RUNTIME = int(os.environ.get('REDIS_EF_RUNTIME', 0))
+
+# Vectors written per cluster pipeline by insert_vectors
+INSERT_BATCH_SIZE = int(os.environ.get('REDIS_INSERT_BATCH_SIZE', 1000))
+
+# Keys of the inserted vectors listed in the response, which Lambda limits to 6 MB
+MAX_REPORTED_KEYS = 100
+
+# Errors after which reads fail over to the next region
+FAILOVER_ERRORS = REBUILD_ERRORS + (RedisTimeoutError,)
+
+# A region is skipped for REDIS_FAILOVER_COOLDOWN seconds once the moving average
+# of its error rate reaches REDIS_FAILOVER_ERROR_RATE
+FAILOVER_ERROR_RATE = float(os.environ.get('REDIS_FAILOVER_ERROR_RATE', 0.5))
+FAILOVER_COOLDOWN_SECONDS = float(os.environ.get('REDIS_FAILOVER_COOLDOWN', 30))
+
+# Commands and connections to a region that stopped answering fail after this many seconds
+SOCKET_TIMEOUT_SECONDS = float(os.environ.get('REDIS_SOCKET_TIMEOUT', 5))
+
+# Kept across warm invocations of the same execution environment
+_region_router = None
+_region_router_params = None
+_known_indexes = set()
+
 class MemoryDBIAMProvider(redis.CredentialProvider):
     def __init__(self, user, cluster_name, region):
         self.user = user
@@ -36,9 +82,25 @@ class MemoryDBIAMProvider(redis.CredentialProvider):
             self.credentials,
             self.session.get_component("event_emitter"),
         )
+        self._lock = threading.Lock()
+        self._token = None
+        self._token_expires_at = 0.0
         logger.info(f"Initialized MemoryDBIAMProvider for user: {user}, cluster: {cluster_name}, region: {region}")
 
     def get_credentials(self) -> Union[Tuple[str], Tuple[str, str]]:
+        """Return the cached signed token, signing a new one shortly before it expires."""
+        with self._lock:
+            if self._token is None or time.monotonic() >= self._token_expires_at:
+                self._token = self._generate_token()
+                self._token_expires_at = time.monotonic() + TOKEN_EXPIRY_SECONDS - TOKEN_REFRESH_MARGIN_SECONDS
+            return (self.user, self._token)
+
+    def expire_token(self) -> None:
+        """Sign a new token on the next connection, for example after it was rejected."""
+        with self._lock:
+            self._token = None
+
+    def _generate_token(self) -> str:
         query_params = {"Action": "connect", "User": self.user}
         url = urlunparse(
             ParseResult(
@@ -60,7 +122,7 @@ class MemoryDBIAMProvider(redis.CredentialProvider):
                 region_name=self.region,
             )
             logger.info("Successfully generated presigned URL")
-            return (self.user, signed_url.removeprefix("https://"))
+            return signed_url.removeprefix("https://")
         except Exception as e:
             logger.error(f"Error generating presigned URL: {str(e)}")
             raise
@@ -69,25 +131,18 @@ def generate_random_vector(dimensions: int) -> List[float]:
     """Generate a random vector with specified dimensions."""
     return [random.random() for _ in range(dimensions)]
 
-def create_index_if_not_exists(r: RedisCluster, index_name: str, vector_dimensions: int) -> None:
-    """Create a Redis search index if it doesn't exist."""
+def create_index_if_not_exists(r: RedisCluster, index_name: str, vector_dimensions: int, region: str) -> None:
+    """Create a Redis search index in the cluster of a region if it doesn't exist."""
+    if (region, index_name) in _known_indexes:
+        return
     try:
         # Check if index exists
         r.ft(index_name).info()
         logger.info(f"Index {index_name} already exists")
     except ResponseError:
         # Index doesn't exist, create it
-        schema = (
-            VectorField("content_vector", "FLOAT32", vector_dimensions, "FLAT", {
-                "TYPE": "FLOAT32",
-                "DIM": vector_dimensions,
-                "DISTANCE_METRIC": "COSINE"
-            }),
-            TextField("metadata")
-        )
-        definition = IndexDefinition(prefix=[b"vector:"], index_type=IndexType.HASH)
-        r.ft(index_name).create_index(schema, definition=definition)
-        logger.info(f"Created index {index_name}")
+        create_vector_index(r, index_name, "vector:", vector_dimensions, INDEX_ALGORITHM, INDEX_ATTRIBUTES)
+    _known_indexes.add((region, index_name))
 
 def establish_redis_connection(conn_params: dict, max_retries: int = 3) -> RedisCluster:
     """Establish Redis connection with retry logic."""
@@ -107,26 +162,60 @@ def establish_redis_connection(conn_params: dict, max_retries: int = 3) -> Redis
     
     raise last_exception
 
-def insert_vectors(r: RedisCluster, index_dimensions: int, num_vectors: int = 10) -> List[bytes]:
-    """Insert random vectors into Redis."""
-    created_vectors = []
+def endpoint_connector(conn_params: dict, provider_params: dict) -> Callable[[], RedisCluster]:
+    """Return a function connecting to one regional cluster, reusing its IAM provider across reconnections."""
+    provider = MemoryDBIAMProvider(**provider_params)
+
+    def connect() -> RedisCluster:
+        # Reconnections follow an error, which may be a rejected token
+        provider.expire_token()
+        return establish_redis_connection({
+            **conn_params,
+            'credential_provider': provider,
+            'health_check_interval': HEALTH_CHECK_INTERVAL_SECONDS
+        })
+    return connect
+
+def parse_read_endpoints(spec: str) -> List[dict]:
+    """Parse REDIS_READ_ENDPOINTS, a JSON list of {"region", "host", "port", "cluster_name"} objects."""
+    endpoints = json.loads(spec) if spec else []
+    for endpoint in endpoints:
+        missing = {'region', 'host', 'port', 'cluster_name'} - set(endpoint)
+        if missing:
+            raise ValueError(f"Read endpoint {endpoint} is missing {', '.join(sorted(missing))}")
+    return endpoints
+
+def get_region_router(conn_params: dict, provider_params: dict, read_endpoints: List[dict]) -> RegionRouter:
+    """Return the router of previous invocations, or build one when the parameters changed."""
+    global _region_router, _region_router_params
+    params = (conn_params, provider_params, read_endpoints)
+    if _region_router is not None and _region_router_params == params:
+        return _region_router
+    if _region_router is not None:
+        _region_router.close()
+        _known_indexes.clear()
+    # The primary region takes the writes and serves reads like the other regions
+    connectors = {provider_params['region']: endpoint_connector(conn_params, provider_params)}
+    for endpoint in read_endpoints:
+        connectors[endpoint['region']] = endpoint_connector(
+            {**conn_params, 'host': endpoint['host'], 'port': int(endpoint['port'])},
+            {**provider_params, 'cluster_name': endpoint['cluster_name'], 'region': endpoint['region']}
+        )
+    _region_router = RegionRouter(connectors, provider_params['region'], FAILOVER_ERRORS,
+                                  max_error_rate=FAILOVER_ERROR_RATE, cooldown_seconds=FAILOVER_COOLDOWN_SECONDS)
+    _region_router_params = params
+    return _region_router
+
+def insert_vectors(r: RedisCluster, index_dimensions: int, num_vectors: int = 10,
+                   batch_size: int = INSERT_BATCH_SIZE, run_id: str = None) -> Tuple[List[bytes], dict]:
+    """
+    Insert random vectors into Redis in pipelined batches. The keys and the vectors
+    are derived from run_id, so a retry with the same run_id rewrites the same hashes.
+    """
     try:
-        for i in range(num_vectors):
-            vector_id = f"vector:{uuid.uuid4()}".encode('utf-8')
-            vector_data = generate_random_vector(index_dimensions)
-            
-            # Pack vector data as binary
-            packed_vector = struct.pack(f'{index_dimensions}f', *vector_data)
-            
-            # Create mapping with required fields
-            mapping = {
-                b"content_vector": packed_vector,
-                b"metadata": f"Random vector {i+1}".encode('utf-8')
-            }
-            
-            r.hset(vector_id, mapping=mapping)
-            created_vectors.append(vector_id)
-        return created_vectors
+        run_id = run_id or uuid.uuid4().hex
+        vectors = random_vectors(num_vectors, index_dimensions, seed=zlib.crc32(run_id.encode('utf-8')))
+        return bulk_insert_vectors(r, vectors, batch_size, run_id=run_id)
     except Exception as e:
         logger.error(f"Error inserting vectors: {str(e)}")
         raise
@@ -135,7 +224,8 @@ def perform_vector_search(r: RedisCluster, index_name: str, index_dimensions: in
     """Perform a test vector search."""
     try:
         test_vector = generate_random_vector(index_dimensions)
-        query = f"*=>[KNN {k} @content_vector $vector AS score]"
+        ef_runtime = f" EF_RUNTIME {EF_RUNTIME}" if EF_RUNTIME else ""
+        query = f"*=>[KNN {k} @content_vector $vector{ef_runtime} AS score]"
         
         # Pack the vector data
         packed_vector = struct.pack(f'{index_dimensions}f', *test_vector)
@@ -159,8 +249,49 @@ def perform_vector_search(r: RedisCluster, index_name: str, index_dimensions: in
         logger.error(f"Error in vector search: {str(e)}")
         raise
 
+def run_operations(router: RegionRouter, index_name: str, index_dimensions: int, num_vectors: int = 10,
+                   batch_size: int = INSERT_BATCH_SIZE, run_id: str = None) -> dict:
+    """
+    Create the index if needed and insert test vectors in the primary region, then search them.
+    The operations can be run again with the same run_id without inserting the vectors twice.
+    """
+    # Create the index in every region the search may go to, since an index only exists
+    # in the cluster that created it while the vectors are replicated from the primary
+    router.write(lambda r: create_index_if_not_exists(r, index_name, index_dimensions, router.primary))
+    for region in router.connectors:
+        if region == router.primary:
+            continue
+        try:
+            router.run_on(region, lambda r: create_index_if_not_exists(r, index_name, index_dimensions, region))
+        except FAILOVER_ERRORS as e:
+            # The search fails over from this region, and the next invocation tries again
+            logger.warning(f"Could not create index {index_name} in {region}: {str(e)}")
+
+    # Insert some test vectors
+    created_vectors, insert_stats = router.write(
+        lambda r: insert_vectors(r, index_dimensions, num_vectors, batch_size, run_id))
+    # Decode binary data for logging, listing at most MAX_REPORTED_KEYS of the keys
+    created_vectors_decoded = [v.decode('utf-8') for v in created_vectors[:MAX_REPORTED_KEYS]]
+    logger.info(f"Created and inserted vectors: {created_vectors_decoded}")
+
+    # Perform a test search
+    search_region, (total_results, search_results) = router.read(
+        lambda r: perform_vector_search(r, index_name, index_dimensions))
+    logger.info(f"Search completed in {search_region} with {total_results} results")
+
+    return {
+        'message': 'Operations completed successfully',
+        'created_vectors': created_vectors_decoded,
+        'insert': insert_stats,
+        'search_results': {
+            'region': search_region,
+            'total': total_results,
+            'results': search_results
+        },
+        'regions': router.stats()
+    }
+
 def lambda_handler(event, context):
-    r = None
     try:
         # Ensure environment variables are valid
         redis_host = os.environ.get('REDIS_HOST')
@@ -182,14 +313,22 @@ def lambda_handler(event, context):
         except ValueError as ve:
             raise ValueError(f"Invalid numerical values: {ve}")
 
-        logger.info(f"Redis parameters: {redis_host}, {redis_port}, {redis_username}, {redis_cluster_name}, {redis_region}, {redis_index_name}, {redis_index_dimensions}")
+        # A "benchmark" object in the event runs the benchmark mode instead of the test
+        # operations, and a "tune" object runs the HNSW tuner
+        benchmark_params = event.get('benchmark')
+        if benchmark_params is not None:
+            benchmark_config = parse_benchmark_params(benchmark_params, redis_index_dimensions)
+        tuner_params = event.get('tune')
+        if tuner_params is not None:
+            tuner_config = parse_tuner_params(tuner_params, redis_index_dimensions)
 
-        # Create a strong reference to MemoryDBIAMProvider
-        creds_provider = MemoryDBIAMProvider(
-            user=redis_username,
-            cluster_name=redis_cluster_name,
-            region=redis_region
-        )
+        # The number of vectors to insert and the pipeline batch size can be set per invocation
+        num_vectors = int(event.get('num_vectors', 10))
+        batch_size = int(event.get('batch_size', INSERT_BATCH_SIZE))
+        if num_vectors < 1 or batch_size < 1:
+            raise ValueError("num_vectors and batch_size must be positive")
+
+        logger.info(f"Redis parameters: {redis_host}, {redis_port}, {redis_username}, {redis_cluster_name}, {redis_region}, {redis_index_name}, {redis_index_dimensions}")
 
         redis_conn_params = {
             'host': redis_host,
@@ -197,35 +336,48 @@ def lambda_handler(event, context):
             'ssl': True,
             'ssl_cert_reqs': "none",
             'decode_responses': False,
-            'credential_provider': creds_provider
+            'socket_timeout': SOCKET_TIMEOUT_SECONDS,
+            'socket_connect_timeout': SOCKET_TIMEOUT_SECONDS
+        }
+        provider_params = {
+            'user': redis_username,
+            'cluster_name': redis_cluster_name,
+            'region': redis_region
         }
 
-        # Establish connection with retry logic
-        r = establish_redis_connection(redis_conn_params)
-
-        # Create index if it doesn't exist
-        create_index_if_not_exists(r, redis_index_name, redis_index_dimensions)
-
-        # Insert some test vectors
-        created_vectors = insert_vectors(r, redis_index_dimensions)
-        # Decode binary data for logging
-        created_vectors_decoded = [v.decode('utf-8') if isinstance(v, bytes) else v for v in created_vectors]
-        logger.info(f"Created and inserted vectors: {created_vectors_decoded}")
+        # Clusters in other regions that can serve the searches
+        read_endpoints = parse_read_endpoints(os.environ.get('REDIS_READ_ENDPOINTS'))
 
-        # Perform a test search
-        total_results, search_results = perform_vector_search(r, redis_index_name, redis_index_dimensions)
-        logger.info(f"Search completed with {total_results} results")
+        # The router, with the providers and the clients of every region, is kept at module
+        # scope, so warm invocations skip the TLS handshake, the authentication and the
+        # topology discovery
+        router = get_region_router(redis_conn_params, provider_params, read_endpoints)
+        if benchmark_params is not None:
+            return {
+                'statusCode': 200,
+                'body': json.dumps(run_benchmark(router, redis_index_name, benchmark_config))
+            }
+        if tuner_params is not None:
+            # Stop sweeping early enough to return the trials before the function times out
+            deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - 60 if context else None
+            return {
+                'statusCode': 200,
+                'body': json.dumps(run_tuner(router, redis_index_name, tuner_config, deadline))
+            }
+        # The retry inserts under the same keys, so it overwrites the vectors written
+        # before the error instead of inserting the batch twice
+        run_id = context.aws_request_id if context else uuid.uuid4().hex
+        try:
+            body = run_operations(router, redis_index_name, redis_index_dimensions, num_vectors, batch_size, run_id)
+        except FAILOVER_ERRORS as e:
+            # The router already closed the client of the failing region
+            logger.warning(f"Retrying the operations after error: {str(e)}")
+            _known_indexes.clear()
+            body = run_operations(router, redis_index_name, redis_index_dimensions, num_vectors, batch_size, run_id)
 
         return {
             'statusCode': 200,
-            'body': json.dumps({
-                'message': 'Operations completed successfully',
-                'created_vectors': created_vectors_decoded,
-                'search_results': {
-                    'total': total_results,
-                    'results': search_results
-                }
-            })
+            'body': json.dumps(body)
         }
 
     except Exception as e:
@@ -237,10 +389,3 @@ def lambda_handler(event, context):
                 'error': str(e)
             })
         }
-    finally:
-        if r:
-            try:
-                r.close()
-                logger.info("Redis connection closed successfully")
-            except Exception as e:
-                logger.warning(f"Error closing Redis connection: {str(e)}")
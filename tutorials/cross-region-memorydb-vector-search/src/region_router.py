@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+from redis.cluster import RedisCluster
+
+logger = logging.getLogger()
+
+T = TypeVar('T')
+
+
+class EndpointHealth:
+    """
+    Moving averages of the round-trip latency and the error rate of one endpoint.
+
+    Reads can run from several threads at once, so the averages are updated and read
+    under a lock.
+    """
+
+    def __init__(self, alpha: float):
+        self.alpha = alpha
+        self.latency_ms: Optional[float] = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.down_until = 0.0
+        self._lock = threading.Lock()
+
+    def record_success(self, latency_ms: Optional[float]) -> None:
+        with self._lock:
+            self.requests += 1
+            self.error_rate *= 1 - self.alpha
+            if latency_ms is None:
+                return
+            if self.latency_ms is None:
+                self.latency_ms = latency_ms
+            else:
+                self.latency_ms += self.alpha * (latency_ms - self.latency_ms)
+
+    def record_failure(self, max_error_rate: float, cooldown_seconds: float) -> None:
+        with self._lock:
+            self.requests += 1
+            self.errors += 1
+            self.error_rate += self.alpha * (1 - self.error_rate)
+            if self.error_rate >= max_error_rate:
+                self.down_until = time.monotonic() + cooldown_seconds
+
+    def is_healthy(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    def rank(self) -> tuple:
+        """Return the sort key of the endpoint in the read order: healthy first, then by latency."""
+        with self._lock:
+            if not self.is_healthy():
+                return (True, self.down_until, False, 0.0)
+            return (False, 0.0, self.latency_ms is not None, self.latency_ms or 0.0)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                'latency_ms': self.latency_ms,
+                'error_rate': self.error_rate,
+                'requests': self.requests,
+                'errors': self.errors,
+                'healthy': self.is_healthy()
+            }
+
+
+class RegionRouter:
+    """
+    Routes operations over the clusters of several regions.
+
+    Writes always go to the primary region. Reads go to the healthy endpoint with the
+    lowest moving average latency, endpoints without measurements first so that each
+    one gets measured. A read failing with one of failover_errors is retried on the
+    next endpoint, and an endpoint whose error rate reaches max_error_rate is skipped
+    for cooldown_seconds. When every endpoint is down, they are all tried anyway.
+    """
+
+    def __init__(self, connectors: Dict[str, Callable[[], RedisCluster]], primary: str,
+                 failover_errors: Tuple[type, ...], alpha: float = 0.2, max_error_rate: float = 0.5,
+                 cooldown_seconds: float = 30.0):
+        if primary not in connectors:
+            raise ValueError(f"The primary region {primary} has no endpoint")
+        self.connectors = connectors
+        self.primary = primary
+        self.failover_errors = failover_errors
+        self.max_error_rate = max_error_rate
+        self.cooldown_seconds = cooldown_seconds
+        self.health = {name: EndpointHealth(alpha) for name in connectors}
+        self._clients: Dict[str, RedisCluster] = {}
+        self._lock = threading.Lock()
+
+    def client(self, name: str) -> RedisCluster:
+        """Return the client of an endpoint, connecting it on first use."""
+        with self._lock:
+            if name not in self._clients:
+                self._clients[name] = self.connectors[name]()
+            return self._clients[name]
+
+    def reset(self, name: str) -> None:
+        """Close the client of an endpoint, so the next operation connects again."""
+        with self._lock:
+            client = self._clients.pop(name, None)
+        if client is not None:
+            try:
+                client.close()
+            except Exception as e:
+                logger.warning(f"Error closing the client of {name}: {str(e)}")
+
+    def close(self) -> None:
+        for name in list(self._clients):
+            self.reset(name)
+
+    def read_order(self) -> List[str]:
+        """Return the endpoints in the order reads try them."""
+        return sorted(self.connectors, key=lambda name: self.health[name].rank())
+
+    def read(self, operation: Callable[[RedisCluster], T]) -> Tuple[str, T]:
+        """Run a read on the fastest healthy endpoint and return its name with the result."""
+        last_error = None
+        for name in self.read_order():
+            try:
+                return name, self._run(name, operation, measure=True)
+            except self.failover_errors as e:
+                logger.warning(f"Read on {name} failed, failing over: {str(e)}")
+                last_error = e
+        raise last_error
+
+    def read_from(self, name: str, operation: Callable[[RedisCluster], T]) -> T:
+        """Run a read on one endpoint, without failing over."""
+        return self._run(name, operation, measure=True)
+
+    def write(self, operation: Callable[[RedisCluster], T]) -> T:
+        """Run a write on the primary region."""
+        return self._run(self.primary, operation, measure=False)
+
+    def run_on(self, name: str, operation: Callable[[RedisCluster], T]) -> T:
+        """Run an operation on one endpoint without measuring it, like the creation of an index in every region."""
+        return self._run(name, operation, measure=False)
+
+    def _run(self, name: str, operation: Callable[[RedisCluster], T], measure: bool) -> T:
+        # Only reads update the latency average, since writes like bulk inserts take
+        # much longer than a query and would make the primary look slow
+        health = self.health[name]
+        try:
+            client = self.client(name)
+            start = time.perf_counter()
+            result = operation(client)
+        except self.failover_errors:
+            health.record_failure(self.max_error_rate, self.cooldown_seconds)
+            self.reset(name)
+            raise
+        health.record_success((time.perf_counter() - start) * 1000 if measure else None)
+        return result
+
+    def stats(self) -> dict:
+        return {name: health.to_dict() for name, health in self.health.items()}
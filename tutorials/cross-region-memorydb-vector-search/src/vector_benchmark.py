@@ -0,0 +1,269 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from redis.cluster import RedisCluster
+from redis.commands.search.field import TextField, VectorField
+from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+from redis.commands.search.query import Query
+from redis.exceptions import ResponseError
+
+from bulk_insert import bulk_insert_vectors, random_vectors
+from region_router import RegionRouter
+
+logger = logging.getLogger()
+
+ALGORITHMS = ('FLAT', 'HNSW')
+
+# Defaults of the benchmark event parameters
+BENCHMARK_DEFAULTS = {
+    'algorithm': 'FLAT',
+    'index_size': 10000,
+    'queries': 1000,
+    'k': 10,
+    'qps': 0,
+    'concurrency': 4,
+    'batch_size': 1000,
+    'attributes': {},
+    'ef_runtime': None,
+    'region': None,
+    'cleanup': True,
+    'indexing_timeout': 600
+}
+
+
+def create_vector_index(r: RedisCluster, index_name: str, prefix: str, dimensions: int, algorithm: str = 'FLAT',
+                        attributes: Optional[dict] = None) -> None:
+    """Create a cosine vector index over the hashes of prefix, with extra algorithm attributes like M for HNSW."""
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unsupported algorithm {algorithm}, expected one of {', '.join(ALGORITHMS)}")
+    schema = (
+        VectorField("content_vector", algorithm, {
+            "TYPE": "FLOAT32",
+            "DIM": dimensions,
+            "DISTANCE_METRIC": "COSINE",
+            **(attributes or {})
+        }),
+        TextField("metadata")
+    )
+    definition = IndexDefinition(prefix=[prefix], index_type=IndexType.HASH)
+    r.ft(index_name).create_index(schema, definition=definition)
+    logger.info(f"Created {algorithm} index {index_name} with {attributes or {}}")
+
+
+def wait_for_indexing(r: RedisCluster, index_name: str, count: int, timeout: float) -> dict:
+    """Wait until the index holds count documents and return its FT.INFO."""
+    deadline = time.monotonic() + timeout
+    while True:
+        info = r.ft(index_name).info()
+        if int(float(info.get('num_docs', 0))) >= count:
+            return info
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Index {index_name} holds {info.get('num_docs')} of {count} documents "
+                               f"after {timeout} seconds")
+        time.sleep(0.5)
+
+
+def drop_vector_index(r: RedisCluster, index_name: str, keys: List[bytes], batch_size: int = 1000) -> None:
+    """Drop an index and delete its documents."""
+    try:
+        r.ft(index_name).dropindex()
+    except ResponseError as e:
+        logger.warning(f"Error dropping index {index_name}: {str(e)}")
+    delete_keys(r, keys, batch_size)
+
+
+def delete_keys(r: RedisCluster, keys: List[bytes], batch_size: int = 1000) -> None:
+    """Delete keys in pipelined batches."""
+    for start in range(0, len(keys), batch_size):
+        pipe = r.pipeline(transaction=False)
+        for key in keys[start:start + batch_size]:
+            pipe.delete(key)
+        pipe.execute()
+
+
+def knn_query(k: int, ef_runtime: Optional[int] = None) -> Query:
+    """Return the query of the k nearest neighbours of the $vector parameter."""
+    ef = f" EF_RUNTIME {ef_runtime}" if ef_runtime else ""
+    return (Query(f"*=>[KNN {k} @content_vector $vector{ef} AS score]")
+            .sort_by("score")
+            .return_fields("score")
+            .paging(0, k)
+            .dialect(2))
+
+
+def ground_truth(vectors: np.ndarray, queries: np.ndarray, k: int, chunk_size: int = 256) -> np.ndarray:
+    """Return the row indexes of the exact k nearest vectors of every query, by cosine distance."""
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    neighbours = np.empty((len(queries), k), dtype=np.int64)
+    # Chunks of queries bound the size of the similarity matrix
+    for start in range(0, len(queries), chunk_size):
+        similarity = queries[start:start + chunk_size] @ vectors.T
+        top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(similarity, top, axis=1), axis=1)
+        neighbours[start:start + chunk_size] = np.take_along_axis(top, order, axis=1)
+    return neighbours
+
+
+def recall_at_k(results: List[List[int]], truth: np.ndarray) -> float:
+    """Return the mean fraction of the exact k nearest neighbours found by the queries."""
+    k = truth.shape[1]
+    return float(np.mean([len(set(found[:k]) & set(expected)) / k for found, expected in zip(results, truth)]))
+
+
+def latency_summary(latencies_ms: List[float]) -> dict:
+    if not latencies_ms:
+        return {}
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99), 'max_ms': float(max(latencies_ms))}
+
+
+def run_queries(search: Callable[[bytes], Tuple[str, List[str]]], queries: np.ndarray, qps: float,
+                concurrency: int) -> Tuple[List[List[str]], List[float], Dict[str, int], float]:
+    """
+    Send the queries from concurrency threads, at qps queries per second or as fast as
+    possible when qps is 0. search takes the packed vector and returns the region that
+    answered with the keys found.
+
+    With a target rate, the latency of a query counts from the time it was scheduled,
+    so queries delayed by an overloaded target show up in the percentiles.
+
+    Returns the keys found by every query, the latencies, the queries per region and
+    the elapsed seconds.
+    """
+    results: List[List[str]] = [[] for _ in range(len(queries))]
+    latencies: List[float] = [0.0] * len(queries)
+    regions: Dict[str, int] = {}
+    lock = threading.Lock()
+    next_query = iter(range(len(queries)))
+    start = time.perf_counter()
+
+    def worker() -> None:
+        while True:
+            with lock:
+                i = next(next_query, None)
+            if i is None:
+                return
+            if qps:
+                sent = start + i / qps
+                delay = sent - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                sent = time.perf_counter()
+            region, keys = search(queries[i].tobytes())
+            latencies[i] = (time.perf_counter() - sent) * 1000
+            results[i] = keys
+            with lock:
+                regions[region] = regions.get(region, 0) + 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    return results, latencies, regions, time.perf_counter() - start
+
+
+def parse_benchmark_params(params: dict, dimensions: int) -> dict:
+    """Merge the benchmark parameters of the event with the defaults, and validate them."""
+    unknown = set(params) - set(BENCHMARK_DEFAULTS) - {'dimensions'}
+    if unknown:
+        raise ValueError(f"Unknown benchmark parameters: {', '.join(sorted(unknown))}")
+    config = {**BENCHMARK_DEFAULTS, 'dimensions': dimensions, **params}
+    config['algorithm'] = config['algorithm'].upper()
+    if config['algorithm'] not in ALGORITHMS:
+        raise ValueError(f"Unsupported algorithm {config['algorithm']}, expected one of {', '.join(ALGORITHMS)}")
+    for name in ('dimensions', 'index_size', 'queries', 'k', 'concurrency', 'batch_size'):
+        config[name] = int(config[name])
+        if config[name] < 1:
+            raise ValueError(f"{name} must be positive")
+    if config['k'] > config['index_size']:
+        raise ValueError("k cannot exceed index_size")
+    config['qps'] = float(config['qps'])
+    return config
+
+
+def run_benchmark(router: RegionRouter, index_name: str, config: dict) -> dict:
+    """
+    Load config['index_size'] random vectors under a scratch prefix of the primary region,
+    query them with random vectors and compare the answers with the exact neighbours.
+    The queries go to config['region'], or to the regions picked by the router. The scratch
+    index is created in every region the queries may go to, and the queries start once
+    each of them has indexed the vectors replicated from the primary.
+    """
+    run_id = uuid.uuid4().hex[:8]
+    bench_index = f"{index_name}-bench-{run_id}"
+    prefix = f"bench:{run_id}:"
+    k = config['k']
+    vectors = random_vectors(config['index_size'], config['dimensions'])
+    queries = random_vectors(config['queries'], config['dimensions'])
+    regions = [config['region']] if config['region'] else list(router.connectors)
+
+    indexed_regions: List[str] = []
+    keys: List[bytes] = []
+    try:
+        for region in regions:
+            router.run_on(region, lambda r: create_vector_index(r, bench_index, prefix, config['dimensions'],
+                                                                config['algorithm'], config['attributes']))
+            indexed_regions.append(region)
+        keys, insert_stats = router.write(
+            lambda r: bulk_insert_vectors(r, vectors, config['batch_size'], key_prefix=prefix))
+        infos = {}
+        for region in regions:
+            try:
+                infos[region] = router.run_on(
+                    region, lambda r: wait_for_indexing(r, bench_index, len(keys), config['indexing_timeout']))
+            except TimeoutError as e:
+                raise TimeoutError(f"The scratch index is not ready in {region}, no query was run: {str(e)}") from e
+
+        truth_start = time.perf_counter()
+        truth = ground_truth(vectors, queries, k)
+        truth_seconds = time.perf_counter() - truth_start
+
+        query = knn_query(k, config['ef_runtime'])
+
+        def search_keys(r: RedisCluster, vector: bytes) -> List[str]:
+            return [doc.id for doc in r.ft(bench_index).search(query, {'vector': vector}).docs]
+
+        def search(vector: bytes) -> Tuple[str, List[str]]:
+            if config['region']:
+                return config['region'], router.read_from(config['region'], lambda r: search_keys(r, vector))
+            return router.read(lambda r: search_keys(r, vector))
+
+        found, latencies, regions_used, seconds = run_queries(search, queries, config['qps'], config['concurrency'])
+        rows = {key.decode('utf-8'): i for i, key in enumerate(keys)}
+        results = [[rows.get(key, -1) for key in doc_ids] for doc_ids in found]
+    finally:
+        if config['cleanup']:
+            # Deleting the vectors on the primary deletes them in the other regions too
+            for region in indexed_regions:
+                if region != router.primary:
+                    router.run_on(region, lambda r: drop_vector_index(r, bench_index, []))
+            if router.primary in indexed_regions:
+                router.write(lambda r: drop_vector_index(r, bench_index, keys, config['batch_size']))
+            else:
+                router.write(lambda r: delete_keys(r, keys, config['batch_size']))
+
+    report = {
+        'config': config,
+        'index': {
+            'name': bench_index,
+            'num_docs': {region: int(float(info.get('num_docs', 0))) for region, info in infos.items()},
+            'cleaned_up': config['cleanup']
+        },
+        'insert': insert_stats,
+        'ground_truth_seconds': truth_seconds,
+        f'recall_at_{k}': recall_at_k(results, truth),
+        'queries': len(queries),
+        'seconds': seconds,
+        'throughput_qps': len(queries) / seconds,
+        'latency': latency_summary(latencies),
+        'regions': regions_used
+    }
+    logger.info(f"Benchmark of {bench_index}: {json.dumps(report)}")
+    return report